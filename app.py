@@ -4,29 +4,63 @@ import os
 import sys
 import yt_dlp
 import boto3
-from botocore.exceptions import NoCredentialsError, ClientError
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import NoCredentialsError, ClientError, BotoCoreError
+from botocore.config import Config as BotoConfig
 import logging
 from dotenv import load_dotenv
 import urllib.parse
+import email.utils
 import json
 from datetime import datetime
 import random
 import string
 import re
 from flask import Flask, render_template, request, jsonify, Response, copy_current_request_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 import time
-# import queue # ALT
-import multiprocessing # NEU: Für prozessübergreifende Queue
+import queue # Begrenzte Queues zwischen den Pipeline-Stufen
 import math
 import uuid
 import subprocess # NEU: Für FFmpeg Aufruf
 import traceback # NEU: Für detaillierte Fehlermeldungen
+import hashlib
+import sqlite3
+import functools
+import contextlib
+import atexit
+import bisect
+import shutil
+import socket
+try: import fcntl # Dateisperre für stats.json bei mehreren Worker-Prozessen (nicht unter Windows)
+except ImportError: fcntl = None
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict, Counter
 
 # --- Konstanten ---
 HISTORY_FILE = "download_history.json"
 STATS_FILE = "stats.json"
+HISTORY_PAGE_SIZE = 50 # Standard-Seitengröße für /history
+HISTORY_MAX_PAGE_SIZE = 1000 # Obergrenze für /history?limit=
+HISTORY_PAGE_CACHE_ENTRIES = 64 # Im Speicher gehaltene /history Seiten (LRU)
 RANDOM_NAME_LENGTH = 4
 MAX_FILENAME_RETRIES = 10
+S3_NAME_ID_LENGTH = 6 # Base36-Stellen der fortlaufenden Objektnamen (Zehntelsekunden eines Jahres < 36^6)
+# Scheduler-Schätzung, solange keine Metadaten vorliegen: typische Dauer je Plattform (Sekunden),
+# Bitraten (Bytes/s) und angenommener Durchsatz von Download + Upload
+SCHEDULER_ASSUMED_DURATION = {"SoundCloud": 240, "YouTube": 600, "TikTok": 45, "Instagram": 45, "Twitter": 60}
+SCHEDULER_AUDIO_BYTES_PER_SECOND = 24 * 1024 # ~192 kbit/s
+SCHEDULER_VIDEO_BYTES_PER_SECOND = 512 * 1024 # ~4 Mbit/s
+SCHEDULER_THROUGHPUT_BYTES_PER_SECOND = 5 * 1024 * 1024
+SCHEDULER_SCAN_LIMIT = 200 # Wartende Aufträge, die beim Leasen auf freie Limits geprüft werden
+RATE_LIMIT_MAX_BACKOFF_SECONDS = 900
+RATE_LIMIT_RECOVERY_SECONDS = 300 # Nach einer Drosselung steigt die Rate in dieser Zeit linear wieder auf den Sollwert
+RATE_LIMIT_MAX_403_RETRIES = 2 # 403 kann auch endgültig sein (privat, Geo-Sperre): nur so oft als Drosselung behandeln
+JOB_RETRY_MAX_BACKOFF_SECONDS = 600
+CHECKPOINT_FILE_NAME = "checkpoint.json" # Zuletzt abgeschlossene Phase, liegt im Arbeitsverzeichnis neben den Artefakten
+# Download-Fehler, die sich bei einem späteren Versuch meist von selbst erledigen (Netzwerk, Serverfehler)
+TRANSIENT_DOWNLOAD_ERROR_REGEX = re.compile(r'HTTP Error 5\d\d|timed out|Connection (?:reset|refused|aborted)|Temporary failure in name resolution|'
+                                            r'IncompleteRead|Remote end closed|urlopen error|did not get any data blocks', re.IGNORECASE)
 ANSI_ESCAPE_REGEX = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
 URL_REGEX = re.compile(r'https?://[^\s<>"]+|www\.[^\s<>"]+')
 # NEU: Plattformen expliziter definieren
@@ -38,8 +72,22 @@ MP4_QUALITIES = ["Best", "Medium (~720p)", "Low (~480p)"]
 DEFAULT_MP3_BITRATE = "192k"
 DEFAULT_MP4_QUALITY = "Best"
 DOWNLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sc_downloads")
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 JOB_STATUS_TTL_SECONDS = 300 # 5 Minuten Lebenszeit für abgeschlossene Job-Status
+BACKEND_STATE_TTL_SECONDS = 86400 # Kleine Zustände im Job-Backend (z.B. Rate-Limits) verfallen nach einem Tag ohne Änderung
+BACKEND_JOB_TTL_SECONDS = 7 * 86400 # Auftrags-Hash in Redis ohne Abschluss (z.B. Absturz aller Worker) verfällt nach einer Woche
+JOB_LOG_MAX_ENTRIES = 100 # Ringpuffer-Größe der Logs pro Job
+JOB_STORE_LOCK_STRIPES = 16 # Anzahl der Lock-Streifen im Job-Store
+DOWNLOAD_LOG_PROGRESS_STEP = 5 # Log-Eintrag alle X Prozent Download-Fortschritt
+STATUS_STREAM_KEEPALIVE_SECONDS = 15 # Kommentarzeile gegen Proxy-Timeouts bei SSE
+STATUS_STREAM_QUEUED_RECHECK_SECONDS = 2 # Intervall für Positions-Updates wartender Jobs
+STATUS_STREAM_MAX_SECONDS = 300 # Danach wird der Stream beendet, der Browser verbindet neu
+STATUS_STREAM_RETRY_MS = 1000 # Reconnect-Wartezeit für EventSource
+LONG_POLL_MAX_TIMEOUT_SECONDS = 25
+JOB_BACKEND_POLL_SECONDS = 0.5 # Abfrageintervall der Download-Worker bei geteiltem Job-Backend (SQLite/Redis)
+JOB_STATUS_PUBLISH_SECONDS = 0.5 # Geänderter Status eigener Jobs wird höchstens so oft ins Backend geschrieben
+REMOTE_STATUS_REFRESH_SECONDS = 1 # Status von Jobs anderer Worker wird so oft aus dem Backend nachgeladen
+JOB_BACKEND_KEY_PREFIX = "medien-dl" # Schlüssel-Präfix in Redis
+BATCH_REFRESH_SECONDS = 1 # Intervall, in dem Fortschritt und Zustand laufender Batches zusammengefasst werden
 # NEU: FFmpeg Kompatibilitäts-Parameter
 FFMPEG_COMPAT_ARGS = [
     '-c:v', 'libx264',       # Video Codec: H.264
@@ -50,6 +98,15 @@ FFMPEG_COMPAT_ARGS = [
     '-b:a', '128k',          # Audio Bitrate
     '-movflags', '+faststart' # Für Web-Streaming optimieren
 ]
+# Quellen mit diesen Eigenschaften werden nur umverpackt statt neu kodiert
+H264_COMPAT_PROFILES = ("Constrained Baseline", "Baseline", "Main", "High")
+H264_COMPAT_PIX_FMTS = ("yuv420p", "yuvj420p")
+FFMPEG_REMUX_ARGS = ['-c', 'copy', '-movflags', '+faststart']
+FFMPEG_AUDIO_ONLY_ARGS = ['-c:v', 'copy', '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart']
+FFMPEG_STDERR_MAX_LINES = 200 # Nur das Ende von stderr behalten (Fehlerdiagnose)
+FFMPEG_LOG_PROGRESS_STEP = 10 # Statusmeldung alle X Prozent Konvertierungs-Fortschritt
+UPLOAD_LOG_PROGRESS_STEP = 10 # Statusmeldung alle X Prozent Upload-Fortschritt
+UPLOAD_LOG_BYTES_STEP = 10 * 1024 * 1024 # Statusmeldung alle X Bytes, wenn die Größe unbekannt ist (Streaming)
 
 # --- Konfiguration für Logging ---
 log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - [%(threadName)s] - %(message)s') # ThreadName hinzugefügt
@@ -84,31 +141,1156 @@ except ValueError:
 
 if MAX_WORKERS <= 0: MAX_WORKERS = 1 # Sicherstellen, dass mindestens 1 Worker läuft
 
+def get_int_env(name, default, minimum=1):
+    """Liest eine Ganzzahl aus der Umgebung, fällt bei ungültigen Werten auf `default` zurück."""
+    try:
+        value = int(os.getenv(name, str(default)))
+        if value < minimum:
+            logging.warning(f"{name} muss mindestens {minimum} sein, verwende Standardwert {default}.")
+            return default
+        return value
+    except ValueError:
+        logging.warning(f"Ungültiger Wert für {name} in .env, verwende Standardwert {default}.")
+        return default
+
+# Pipeline: Download und Upload sind I/O-lastig, die Konvertierung CPU-lastig.
+# FFmpeg nutzt selbst mehrere Threads, daher teilen sich die Konvertierungs-Worker die Kerne.
+CPU_COUNT = os.cpu_count() or 1
+DOWNLOAD_WORKERS = get_int_env('DOWNLOAD_WORKERS', MAX_WORKERS)
+TRANSCODE_WORKERS = get_int_env('TRANSCODE_WORKERS', max(1, CPU_COUNT // 4))
+UPLOAD_WORKERS = get_int_env('UPLOAD_WORKERS', MAX_WORKERS)
+PIPELINE_QUEUE_SIZE = get_int_env('PIPELINE_QUEUE_SIZE', 4)
+FFMPEG_THREADS_PER_JOB = max(1, CPU_COUNT // TRANSCODE_WORKERS)
+FFMPEG_TIMEOUT_SECONDS = get_int_env('FFMPEG_TIMEOUT_SECONDS', 0, minimum=0) # 0 = kein Zeitlimit
+# Multipart Upload: Schwelle und Teilgröße in MB, parallele Teile pro Upload, Versuche pro Teil
+S3_MULTIPART_THRESHOLD = get_int_env('S3_MULTIPART_THRESHOLD_MB', 16) * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = max(5, get_int_env('S3_MULTIPART_CHUNKSIZE_MB', 8)) * 1024 * 1024 # S3 Minimum: 5 MB
+S3_MAX_CONCURRENCY = get_int_env('S3_MAX_CONCURRENCY', 4)
+S3_PART_MAX_ATTEMPTS = get_int_env('S3_PART_MAX_ATTEMPTS', 5)
+S3_MAX_PARTS = 10000
+S3_MAX_POOL_CONNECTIONS = get_int_env('S3_MAX_POOL_CONNECTIONS', max(20, UPLOAD_WORKERS * S3_MAX_CONCURRENCY + 2))
+# Bedingte Uploads (If-None-Match: *) statt HEAD-Probe vor jedem Upload: 'auto' (probieren, bei Nichtunterstützung
+# auf HEAD-Probe ausweichen), 'true' (immer), 'false' (immer HEAD-Probe)
+S3_CONDITIONAL_WRITES = os.getenv('S3_CONDITIONAL_WRITES', 'auto').lower()
+if S3_CONDITIONAL_WRITES not in ('auto', 'true', 'false'):
+    logging.warning(f"Ungültiger Wert für S3_CONDITIONAL_WRITES in .env ('{S3_CONDITIONAL_WRITES}'), verwende 'auto'.")
+    S3_CONDITIONAL_WRITES = 'auto'
+# 'prefer': Bei H.264-Wunsch direkt H.264/AAC Formate von der Plattform anfragen (nur Fallback auf Konvertierung)
+# 'transcode': Immer das beste Format laden und danach konvertieren (altes Verhalten)
+H264_FORMAT_STRATEGY = os.getenv('H264_FORMAT_STRATEGY', 'prefer').lower()
+if H264_FORMAT_STRATEGY not in ('prefer', 'transcode'):
+    logging.warning(f"Ungültiger Wert für H264_FORMAT_STRATEGY in .env ('{H264_FORMAT_STRATEGY}'), verwende 'prefer'.")
+    H264_FORMAT_STRATEGY = 'prefer'
+STREAM_UPLOADS = os.getenv('STREAM_UPLOADS', 'false').lower() == 'true'
+ENABLE_DEDUP_CACHE = os.getenv('ENABLE_DEDUP_CACHE', 'true').lower() == 'true'
+STATS_FLUSH_INTERVAL_SECONDS = get_int_env('STATS_FLUSH_INTERVAL_SECONDS', 30)
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', os.path.join('db', 'history.db'))
+DEDUP_CACHE_PATH = os.getenv('DEDUP_CACHE_PATH', os.path.join('db', 'dedup_cache.db'))
+# Job-Backend: 'memory' (nur dieser Prozess), 'sqlite' (mehrere Gunicorn-Worker auf einem Host), 'redis' (mehrere Hosts)
+JOB_BACKEND = os.getenv('JOB_BACKEND', 'memory').lower()
+if JOB_BACKEND not in ('memory', 'sqlite', 'redis'):
+    logging.warning(f"Ungültiger Wert für JOB_BACKEND in .env ('{JOB_BACKEND}'), verwende 'memory'.")
+    JOB_BACKEND = 'memory'
+JOB_BACKEND_DB_PATH = os.getenv('JOB_BACKEND_DB_PATH', os.path.join('db', 'jobs.db'))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+JOB_LEASE_SECONDS = get_int_env('JOB_LEASE_SECONDS', 30)
+JOB_MAX_ATTEMPTS = get_int_env('JOB_MAX_ATTEMPTS', 3)
+# Automatische Wiederholungen nach vorübergehenden Fehlern (Netzwerk, HTTP 5xx) mit exponentiellem Backoff;
+# Artefakte bleiben bis zum Erfolg erhalten, ein neuer Versuch setzt an der zuletzt abgeschlossenen Phase an.
+JOB_RETRIES = get_int_env('JOB_RETRIES', 3, minimum=0)
+JOB_RETRY_BACKOFF_SECONDS = get_int_env('JOB_RETRY_BACKOFF_SECONDS', 15)
+BATCH_MAX_ITEMS = get_int_env('BATCH_MAX_ITEMS', 500)
+
+def parse_platform_limits(raw, name="PLATFORM_CONCURRENCY", minimum=1):
+    """Liest Limits im Format "YouTube=2,TikTok=4"."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in raw.split(','))):
+        platform, _, value = item.partition('=')
+        try: limits[platform.strip()] = max(minimum, int(value))
+        except ValueError: logging.warning(f"Ungültiger Eintrag in {name}: '{item}', wird ignoriert.")
+    return limits
+
+# Scheduler: Reihenfolge nach Eingang + geschätzter Bearbeitungsdauer (kurze Audios vor langen Videos,
+# höchstens SCHEDULER_MAX_DEFER_SECONDS später; 0 = reine Eingangsreihenfolge). Limits für gleichzeitig
+# laufende Jobs je Plattform ("YouTube=2,TikTok=4") und je Client (0 = unbegrenzt)
+SCHEDULER_MAX_DEFER_SECONDS = get_int_env('SCHEDULER_MAX_DEFER_SECONDS', 600, minimum=0)
+PLATFORM_CONCURRENCY = parse_platform_limits(os.getenv('PLATFORM_CONCURRENCY', ''))
+CLIENT_CONCURRENCY = get_int_env('CLIENT_CONCURRENCY', 0, minimum=0)
+SCHEDULER_LIMITS_ACTIVE = bool(PLATFORM_CONCURRENCY or CLIENT_CONCURRENCY)
+# Anzahl vertrauenswürdiger Reverse-Proxies vor der App (0 = X-Forwarded-For wird ignoriert)
+TRUSTED_PROXY_COUNT = get_int_env('TRUSTED_PROXY_COUNT', 0, minimum=0)
+# Rate-Limit je Plattform für Extraktion und Download (Anfragen pro Minute, 0 = unbegrenzt), geteilt über das
+# Job-Backend. Nach HTTP 429/403 wird die Rate halbiert und die Plattform gesperrt (Retry-After bzw. Backoff);
+# betroffene Jobs kommen verzögert zurück in die Warteschlange, statt zu scheitern.
+RATE_LIMIT_PER_MINUTE = get_int_env('RATE_LIMIT_PER_MINUTE', 60, minimum=0)
+PLATFORM_RATE_LIMITS = parse_platform_limits(os.getenv('PLATFORM_RATE_LIMITS', ''), 'PLATFORM_RATE_LIMITS', minimum=0)
+RATE_LIMIT_BURST = get_int_env('RATE_LIMIT_BURST', 5)
+RATE_LIMIT_MAX_WAIT_SECONDS = get_int_env('RATE_LIMIT_MAX_WAIT_SECONDS', 10, minimum=0) # Länger: Job zurück in die Warteschlange
+RATE_LIMIT_BACKOFF_SECONDS = get_int_env('RATE_LIMIT_BACKOFF_SECONDS', 30)
+RATE_LIMIT_MAX_QUEUE_SECONDS = get_int_env('RATE_LIMIT_MAX_QUEUE_SECONDS', 3600) # Danach wird ein gedrosselter Job aufgegeben
+# Metadaten-Cache für yt-dlp: TTL in Sekunden (0 = aus), Einträge im Speicher, optional SQLite-Datei
+INFO_CACHE_TTL_SECONDS = get_int_env('INFO_CACHE_TTL_SECONDS', 900, minimum=0)
+INFO_CACHE_ENTRIES = get_int_env('INFO_CACHE_ENTRIES', 64)
+INFO_CACHE_PATH = os.getenv('INFO_CACHE_PATH', '')
+# Basis für die Arbeitsverzeichnisse der Jobs (je Job ein Unterordner), z.B. ein tmpfs-Mount
+JOB_WORK_DIR = os.getenv('JOB_WORK_DIR') or DOWNLOAD_DIR
+os.makedirs(JOB_WORK_DIR, exist_ok=True)
+
+try:
+    PROGRESS_UPDATES_PER_SECOND = float(os.getenv('PROGRESS_UPDATES_PER_SECOND', '4'))
+    if PROGRESS_UPDATES_PER_SECOND <= 0: raise ValueError
+except ValueError:
+    PROGRESS_UPDATES_PER_SECOND = 4.0
+    logging.warning("Ungültiger Wert für PROGRESS_UPDATES_PER_SECOND in .env, verwende Standardwert 4.")
+
 logging.info(f"Verlauf aktiviert: {ENABLE_HISTORY}")
 logging.info(f"Maximale Worker-Threads (für Hintergrundverarbeitung): {MAX_WORKERS}")
+logging.info(f"Pipeline-Worker: Download={DOWNLOAD_WORKERS}, Konvertierung={TRANSCODE_WORKERS} (je {FFMPEG_THREADS_PER_JOB} FFmpeg-Threads), Upload={UPLOAD_WORKERS}")
 
 # --- Flask App Initialisierung ---
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
+if TRUSTED_PROXY_COUNT: # remote_addr aus X-Forwarded-For, nur die letzten N (eigenen) Hops zählen
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+
+# --- Job-Status Speicher (In-Process, Lock-Striped) ---
+class JobRecord:
+    """Kompakter Status-Datensatz eines Jobs. Logs liegen in einem Ringpuffer."""
+    __slots__ = ("job_id", "status", "running", "message", "progress", "logs",
+                 "error", "result_url", "start_time", "last_update",
+                 "downloaded_bytes", "uploaded_bytes", "total_bytes", "speed", "eta",
+                 "version", "log_seq", "changed", "children")
+
+    def __init__(self, job_id, message="In Warteschlange...", status="queued"):
+        now = time.time()
+        self.job_id = job_id
+        self.status = status
+        self.running = False
+        self.message = message
+        self.progress = 0.0
+        self.logs = deque(maxlen=JOB_LOG_MAX_ENTRIES)
+        self.error = None
+        self.result_url = None
+        self.start_time = now
+        self.last_update = now
+        self.downloaded_bytes = None
+        self.uploaded_bytes = None
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        # Änderungsverfolgung für Delta-Updates (/status/stream, /status/poll)
+        self.version = 1
+        self.log_seq = 0 # Anzahl aller jemals angehängten Log-Zeilen
+        self.changed = {} # Feldname -> Version der letzten Änderung
+        self.children = None # Nur bei Batches: Zustand der einzelnen Aufträge
+
+    def to_dict(self):
+        # Gleiche Struktur wie bisher in /status ausgeliefert
+        return {
+            "running": self.running, "message": self.message, "progress": self.progress,
+            "logs": list(self.logs), "error": self.error, "result_url": self.result_url,
+            "start_time": self.start_time, "last_update": self.last_update, "status": self.status,
+            "downloaded_bytes": self.downloaded_bytes, "uploaded_bytes": self.uploaded_bytes, "total_bytes": self.total_bytes,
+            "speed": self.speed, "eta": self.eta,
+        } | ({"children": self.children} if self.children is not None else {})
+
+    def append_log(self, line):
+        self.logs.append(line)
+        self.log_seq += 1
+
+    def touch(self, names):
+        self.version += 1
+        self.last_update = time.time()
+        for name in names: self.changed[name] = self.version
+        self.changed["last_update"] = self.version
+
+
+MIRRORED_JOB_FIELDS = ("status", "running", "message", "progress", "error", "result_url", "start_time",
+                       "downloaded_bytes", "uploaded_bytes", "total_bytes", "speed", "eta", "children")
+
+
+class JobStore:
+    """Thread-sicherer Speicher für Job-Status innerhalb des Prozesses.
+
+    Jeder Job wird über einen von mehreren Lock-Streifen geschützt, so dass
+    Updates verschiedener Jobs sich nicht gegenseitig blockieren. Updates
+    ändern nur die betroffenen Felder statt den ganzen Datensatz zu ersetzen.
+    Jede Änderung erhöht die Version des Jobs; wartende Streams werden über
+    die Condition des jeweiligen Streifens geweckt.
+    """
+
+    def __init__(self, stripes=JOB_STORE_LOCK_STRIPES):
+        self._jobs = {}
+        self._jobs_lock = threading.Lock() # Nur für Einfügen/Entfernen
+        self._stripes = [threading.Condition() for _ in range(max(1, stripes))]
+        self._mirrored_log_seq = {} # job_id -> zuletzt gespiegelte log_seq eines anderen Workers
+
+    def _lock_for(self, job_id):
+        return self._stripes[hash(job_id) % len(self._stripes)]
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def create(self, job_id, log_entry=None, **fields):
+        record = JobRecord(job_id)
+        for name, value in fields.items(): setattr(record, name, value)
+        if log_entry is not None:
+            record.append_log(f"{datetime.now().strftime('%H:%M:%S')} - {log_entry}")
+        with self._jobs_lock:
+            self._jobs[job_id] = record
+        return record
+
+    def remove(self, job_id):
+        with self._jobs_lock:
+            record = self._jobs.pop(job_id, None)
+            self._mirrored_log_seq.pop(job_id, None)
+        if record is not None:
+            cond = self._lock_for(job_id)
+            with cond: cond.notify_all()
+        return record
+
+    def job_ids(self):
+        with self._jobs_lock:
+            return list(self._jobs.keys())
+
+    def get_field(self, job_id, name, default=None):
+        record = self._jobs.get(job_id)
+        if record is None: return default
+        return getattr(record, name, default)
+
+    def snapshot(self, job_id):
+        record = self._jobs.get(job_id)
+        if record is None: return None
+        with self._lock_for(job_id):
+            return record.to_dict()
+
+    def set_fields(self, job_id, **fields):
+        record = self._jobs.get(job_id)
+        if record is None: return False
+        cond = self._lock_for(job_id)
+        with cond:
+            for name, value in fields.items(): setattr(record, name, value)
+            record.touch(fields.keys())
+            cond.notify_all()
+        return True
+
+    def update(self, job_id, message=None, progress=None, log_entry=None, error=None, result_url=None, running=None, status_code=None):
+        record = self._jobs.get(job_id)
+        if record is None: return False
+        if log_entry is not None:
+            log_line = f"{datetime.now().strftime('%H:%M:%S')} - {strip_ansi_codes(str(log_entry))}"
+        touched = []
+        cond = self._lock_for(job_id)
+        with cond:
+            if message is not None: record.message = message; touched.append("message")
+            if progress is not None: record.progress = max(0.0, min(100.0, float(progress))); touched.append("progress")
+            if log_entry is not None: record.append_log(log_line)
+            if error is not None:
+                record.error = strip_ansi_codes(str(error))
+                record.running = False
+                record.message = f"Fehler: {record.error}"
+                record.status = "error"
+                touched.extend(("error", "running", "message", "status"))
+            if result_url is not None: record.result_url = result_url; touched.append("result_url")
+            if running is not None:
+                record.running = bool(running); touched.append("running")
+                if not record.running and not record.error:
+                    if record.status not in ["error", "queued", "completed"]:
+                        record.status = "completed"
+                        record.message = record.message or "Abgeschlossen!"
+                        touched.extend(("status", "message"))
+            if status_code is not None:
+                record.status = status_code; touched.append("status")
+            record.touch(touched)
+            cond.notify_all()
+        if error is not None:
+            logging.error(f"Job Error [{job_id}]: {record.error}")
+        return True
+
+    def delta(self, job_id, since_version=0, since_log_seq=0):
+        """Liefert alle seit `since_version` geänderten Felder und neue Log-Zeilen."""
+        record = self._jobs.get(job_id)
+        if record is None: return None
+        with self._lock_for(job_id):
+            if since_version > record.version: since_version = 0 # Cursor eines anderen Prozesses: alle Felder neu senden
+            if since_version <= 0:
+                fields = record.to_dict(); fields.pop("logs")
+            else:
+                fields = {name: getattr(record, name) for name, version in record.changed.items() if version > since_version}
+            new_log_count = min(record.log_seq - max(0, since_log_seq), len(record.logs))
+            logs = list(record.logs)[-new_log_count:] if new_log_count > 0 else []
+            return {"version": record.version, "log_seq": record.log_seq, "fields": fields, "logs": logs}
+
+    def wait_for_change(self, job_id, since_version, timeout):
+        """Blockiert, bis der Job eine neuere Version als `since_version` hat, entfernt wurde oder `timeout` abläuft."""
+        record = self._jobs.get(job_id)
+        if record is None: return True
+        cond = self._lock_for(job_id)
+        with cond:
+            return cond.wait_for(lambda: record.version > since_version or job_id not in self._jobs, timeout)
+
+    def export(self, job_id):
+        """Status inkl. Version und Log-Zähler, wie er in ein geteiltes Job-Backend geschrieben wird."""
+        record = self._jobs.get(job_id)
+        if record is None: return None
+        with self._lock_for(job_id):
+            snapshot = record.to_dict()
+            snapshot["version"], snapshot["log_seq"] = record.version, record.log_seq
+            return snapshot
+
+    def apply_snapshot(self, job_id, snapshot):
+        """Spiegelt den von einem anderen Worker veröffentlichten Status in diesen Job-Store.
+
+        Die Version folgt mindestens der des besitzenden Workers, damit Stream-Cursor auch nach einem
+        Wechsel auf einen anderen Gunicorn-Worker gültig bleiben; neue Log-Zeilen werden anhand von
+        `log_seq` erkannt und angehängt.
+        """
+        with self._jobs_lock:
+            record = self._jobs.get(job_id)
+            is_new = record is None
+            if is_new: record = self._jobs[job_id] = JobRecord(job_id, status=None)
+        remote_log_seq = snapshot.get("log_seq", 0)
+        cond = self._lock_for(job_id)
+        with cond:
+            touched = [name for name in MIRRORED_JOB_FIELDS if name in snapshot and getattr(record, name) != snapshot[name]]
+            for name in touched: setattr(record, name, snapshot[name])
+            seen_log_seq = self._mirrored_log_seq.get(job_id, 0)
+            new_log_count = remote_log_seq - seen_log_seq if remote_log_seq >= seen_log_seq else remote_log_seq # Kleiner: Job neu übernommen
+            logs = snapshot.get("logs") or []
+            for line in (logs[-min(new_log_count, len(logs)):] if new_log_count > 0 and logs else ()): record.append_log(line)
+            if is_new: record.log_seq = remote_log_seq # Übernommener Job zählt dort weiter, wo der vorige Worker war
+            self._mirrored_log_seq[job_id] = remote_log_seq
+            if touched or new_log_count > 0:
+                record.version = max(record.version, snapshot.get("version", 0) - 1)
+                record.touch(touched)
+                record.last_update = snapshot.get("last_update", record.last_update)
+                cond.notify_all()
+        return record
+
+
+job_store = JobStore()
+
+def get_queue_position(job_id):
+    """Liefert (Position, Anzahl wartender Jobs) für einen Job in der Warteschlange."""
+    return job_backend.queue_position(job_id) or (1, 0)
+
+# --- Job-Backend: Warteschlange, Status und Abbruch (Prozess, SQLite oder Redis) ---
+# Mit 'sqlite' oder 'redis' teilen sich mehrere Gunicorn-Worker bzw. Container die Aufträge.
+# Ein Worker least einen Auftrag für JOB_LEASE_SECONDS und verlängert das Lease per Heartbeat;
+# fällt er aus, übernimmt nach Ablauf ein anderer Worker (höchstens JOB_MAX_ATTEMPTS Versuche).
+def encode_task(task):
+    """Serialisiert einen Auftrag für geteilte Backends. S3-Zugangsdaten bleiben in der Umgebung der Worker."""
+    fields = list(task)
+    fields[7] = fields[8] = None # access_key, secret_key
+    return json.dumps(fields)
+
+def decode_task(raw):
+    fields = json.loads(raw)
+    fields[7] = fields[7] or os.getenv('AWS_ACCESS_KEY_ID')
+    fields[8] = fields[8] or os.getenv('AWS_SECRET_ACCESS_KEY')
+    return tuple(fields)
+
+def current_worker_id():
+    # Nach dem Fork durch Gunicorn hat jeder Worker eine eigene PID
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+# --- Scheduler: Sortierwert und Limits ---
+# Aufträge sind Tupel (job_id, url, platform, ..., endpoint_url, client_id, enqueued_at, queue_score, retry_state),
+# siehe JobContext. Ältere Aufträge ohne die letzten Felder laufen zuerst.
+def estimate_job_cost(platform, format_preference, codec_preference, duration=None, filesize=None):
+    """Grob geschätzte Bearbeitungszeit in Sekunden, nur für die Reihenfolge in der Warteschlange."""
+    is_audio = platform == "SoundCloud" or format_preference == 'mp3'
+    duration = duration or SCHEDULER_ASSUMED_DURATION.get(platform, 300)
+    filesize = filesize or duration * (SCHEDULER_AUDIO_BYTES_PER_SECOND if is_audio else SCHEDULER_VIDEO_BYTES_PER_SECOND)
+    cost = filesize / SCHEDULER_THROUGHPUT_BYTES_PER_SECOND
+    if codec_preference == 'h264' and not is_audio: cost += duration / 2 # Konvertierung
+    return cost
+
+def queue_score(enqueued_at, cost):
+    """Sortierwert: Eingangszeit plus Kosten. Große Aufträge werden so zurückgestellt, aber nie unbegrenzt."""
+    return enqueued_at + min(cost, SCHEDULER_MAX_DEFER_SECONDS)
+
+def task_scheduling(task):
+    """(Plattform, Client, Sortierwert) eines Auftrags."""
+    client_id, _, score = (tuple(task[12:15]) + (None,) * 3)[:3]
+    return task[2], client_id, score or 0.0
+
+def pick_schedulable(candidates, running):
+    """Erster Kandidat, dessen Plattform und Client ihr Limit noch nicht erreicht haben.
+
+    `candidates`: (Plattform, Client, Wert) in Sortierreihenfolge, `running`: (Plattform, Client) laufender Jobs.
+    """
+    if not SCHEDULER_LIMITS_ACTIVE: return next((item for _, _, item in candidates), None)
+    running = list(running)
+    platforms = Counter(platform for platform, _ in running)
+    clients = Counter(client for _, client in running if client)
+    for platform, client, item in candidates:
+        if platform in PLATFORM_CONCURRENCY and platforms[platform] >= PLATFORM_CONCURRENCY[platform]: continue
+        if CLIENT_CONCURRENCY and client and clients[client] >= CLIENT_CONCURRENCY: continue
+        return item
+    return None
+
+
+class MemoryJobBackend:
+    """Standard: Warteschlange und Status nur in diesem Prozess (genau ein Gunicorn-Worker).
+
+    Wartende Aufträge liegen in einer nach (Sortierwert, Eingang) geordneten Liste.
+    """
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queued = [] # (Sortierwert, Sequenz, job_id), aufsteigend sortiert
+        self._tasks = {} # job_id -> (Eintrag in _queued, Auftrag)
+        self._delayed = [] # (fällig ab, job_id, Auftrag), aufsteigend sortiert
+        self._running = {} # job_id -> (Plattform, Client)
+        self._next_seq = 0
+        self._sequences = {}
+        self._states = {}
+
+    def enqueue(self, task, snapshot):
+        with self._lock: self._enqueue_locked(task)
+
+    def _enqueue_locked(self, task):
+        self._next_seq += 1
+        entry = (task_scheduling(task)[2], self._next_seq, task[0])
+        bisect.insort(self._queued, entry)
+        self._tasks[task[0]] = (entry, task)
+        self._changed.notify_all()
+
+    def _remove_queued(self, job_id):
+        entry, task = self._tasks.pop(job_id)
+        del self._queued[bisect.bisect_left(self._queued, entry)]
+        return task
+
+    def lease(self, worker_id, timeout):
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                while self._delayed and self._delayed[0][0] <= time.time(): self._enqueue_locked(self._delayed.pop(0)[2])
+                candidates = ((*task_scheduling(self._tasks[job_id][1])[:2], job_id) for _, _, job_id in self._queued[:SCHEDULER_SCAN_LIMIT])
+                job_id = pick_schedulable(candidates, self._running.values())
+                if job_id is not None:
+                    task = self._remove_queued(job_id)
+                    self._running[job_id] = task_scheduling(task)[:2]
+                    return task, 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: return None
+                if self._delayed: remaining = min(remaining, max(0.01, self._delayed[0][0] - time.time()))
+                self._changed.wait(remaining)
+
+    def requeue(self, task, worker_id, delay=0):
+        with self._lock:
+            self._running.pop(task[0], None)
+            if delay > 0: bisect.insort(self._delayed, (time.time() + delay, task[0], task)); self._changed.notify_all()
+            else: self._enqueue_locked(task)
+
+    def complete(self, job_id, worker_id):
+        with self._lock:
+            if self._running.pop(job_id, None) is not None: self._changed.notify_all() # Limit wieder frei
+
+    def cancel_queued(self, job_id):
+        with self._lock:
+            if job_id in self._tasks:
+                self._remove_queued(job_id)
+                return True
+            delayed = [item for item in self._delayed if item[1] != job_id]
+            if len(delayed) == len(self._delayed): return False
+            self._delayed = delayed
+        return True
 
-# --- Globaler Status -> Job-Status Speicher ---
-manager = multiprocessing.Manager()
-job_statuses = manager.dict()
-task_lock = threading.Lock()
+    def queue_position(self, job_id):
+        with self._lock:
+            if job_id not in self._tasks: return None
+            return bisect.bisect_left(self._queued, self._tasks[job_id][0]) + 1, len(self._queued)
+
+    def first_queued_score(self):
+        with self._lock: return self._queued[0][0] if self._queued else None
+
+    def queued_count(self): return len(self._queued) + len(self._delayed)
+
+    def heartbeat(self, job_ids, worker_id): return set()
+    def publish_status(self, job_id, snapshot, worker_id): return True
+    def store_finished(self, job_id, snapshot): pass
+    def request_cancel(self, job_id): return False
+    def cancelled_jobs(self, job_ids): return set()
+
+    def active_jobs(self, job_ids):
+        with self._lock:
+            delayed = {item[1] for item in self._delayed}
+            return {job_id for job_id in job_ids if job_id in self._tasks or job_id in self._running or job_id in delayed}
+    def get_status(self, job_id): return None
+    def purge(self, before): pass
+
+    def next_sequence(self, name, floor):
+        with self._lock:
+            value = self._sequences[name] = max(self._sequences.get(name, 0) + 1, floor)
+        return value
+
+    def update_state(self, name, update):
+        """Atomares Lesen-Ändern-Schreiben eines kleinen Zustands: update(Zustand oder None) -> (neuer Zustand, Ergebnis)."""
+        with self._lock:
+            self._states[name], result = update(self._states.get(name))
+        return result
+
+
+class SQLiteJobBackend:
+    """Geteilte Warteschlange in einer SQLite-Datenbank (WAL) für mehrere Worker-Prozesse auf einem Host.
+
+    Leasen passiert in einer `BEGIN IMMEDIATE` Transaktion, so dass genau ein Worker einen
+    wartenden (oder verwaisten) Auftrag bekommt, in der Reihenfolge des Sortierwerts und unter
+    Beachtung der Limits je Plattform und Client.
+    """
+    shared = True
+
+    def __init__(self, path):
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL UNIQUE, task TEXT,
+                state TEXT NOT NULL, owner TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0,
+                cancel INTEGER NOT NULL DEFAULT 0, status TEXT, updated_at REAL NOT NULL,
+                score REAL NOT NULL DEFAULT 0, platform TEXT, client TEXT, not_before REAL NOT NULL DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, seq);
+            CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS states (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in (("score", "REAL NOT NULL DEFAULT 0"), ("platform", "TEXT"), ("client", "TEXT"),
+                                   ("not_before", "REAL NOT NULL DEFAULT 0")):
+            if column not in columns: self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_score ON jobs (state, score, seq)")
+
+    def enqueue(self, task, snapshot):
+        platform, client_id, score = task_scheduling(task)
+        with self._lock:
+            self._conn.execute("INSERT INTO jobs (job_id, task, state, status, updated_at, score, platform, client) "
+                               "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                               (task[0], encode_task(task), json.dumps(snapshot), time.time(), score, platform, client_id))
+
+    def lease(self, worker_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            leased = self._try_lease(worker_id)
+            if leased is not None or time.monotonic() >= deadline: return leased
+            time.sleep(JOB_BACKEND_POLL_SECONDS)
+
+    def _try_lease(self, worker_id):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT platform, client, job_id, task, attempts FROM jobs "
+                    "WHERE (state = 'queued' AND not_before <= ?) OR (state = 'leased' AND lease_expires < ?) "
+                    "ORDER BY score, seq LIMIT ?", (now, now, SCHEDULER_SCAN_LIMIT)).fetchall()
+                running = self._conn.execute("SELECT platform, client FROM jobs WHERE state = 'leased' AND lease_expires >= ?",
+                                             (now,)).fetchall() if SCHEDULER_LIMITS_ACTIVE and rows else ()
+                row = pick_schedulable(((r[0], r[1], r[2:]) for r in rows), running)
+                if row is not None:
+                    self._conn.execute("UPDATE jobs SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE job_id = ?",
+                                       (worker_id, now + JOB_LEASE_SECONDS, row[0]))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return (decode_task(row[1]), row[2] + 1) if row else None
+
+    def requeue(self, task, worker_id, delay=0):
+        """Gibt einen geleasten Auftrag mit neuem Sortierwert zurück in die Warteschlange (zählt nicht als Versuch),
+        frühestens nach `delay` Sekunden wieder leasbar."""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET state = 'queued', owner = NULL, lease_expires = NULL, attempts = MAX(attempts - 1, 0), "
+                               "task = ?, score = ?, not_before = ? WHERE job_id = ? AND owner = ? AND state = 'leased'",
+                               (encode_task(task), task_scheduling(task)[2], time.time() + delay, task[0], worker_id))
+
+    def cancel_queued(self, job_id):
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET state = 'done', cancel = 1, updated_at = ? WHERE job_id = ? AND state = 'queued'",
+                                        (time.time(), job_id))
+        return cursor.rowcount > 0
+
+    def heartbeat(self, job_ids, worker_id):
+        """Verlängert die Leases und liefert die Jobs, die inzwischen einem anderen Worker gehören."""
+        placeholders = ",".join("?" * len(job_ids))
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET lease_expires = ? WHERE owner = ? AND state = 'leased' AND job_id IN ({placeholders})",
+                               (time.time() + JOB_LEASE_SECONDS, worker_id, *job_ids))
+            rows = self._conn.execute(f"SELECT job_id FROM jobs WHERE (owner != ? OR state != 'leased') AND job_id IN ({placeholders})",
+                                      (worker_id, *job_ids)).fetchall()
+        return {row[0] for row in rows}
+
+    def publish_status(self, job_id, snapshot, worker_id):
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ? AND owner = ?",
+                                        (json.dumps(snapshot), time.time(), job_id, worker_id))
+        return cursor.rowcount > 0
+
+    def store_finished(self, job_id, snapshot):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO jobs (job_id, state, status, updated_at) VALUES (?, 'done', ?, ?)",
+                               (job_id, json.dumps(snapshot), time.time()))
+
+    def complete(self, job_id, worker_id):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET state = 'done', lease_expires = NULL, updated_at = ? WHERE job_id = ? AND owner = ?",
+                               (time.time(), job_id, worker_id))
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET cancel = 1 WHERE job_id = ? AND state != 'done'", (job_id,))
+        return cursor.rowcount > 0
+
+    def cancelled_jobs(self, job_ids):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT job_id FROM jobs WHERE cancel = 1 AND job_id IN ({','.join('?' * len(job_ids))})",
+                                      tuple(job_ids)).fetchall()
+        return {row[0] for row in rows}
+
+    def active_jobs(self, job_ids):
+        """Jobs, die noch warten oder geleast sind."""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT job_id FROM jobs WHERE state IN ('queued', 'leased') AND job_id IN ({','.join('?' * len(job_ids))})",
+                                      tuple(job_ids)).fetchall()
+        return {row[0] for row in rows}
+
+    def get_status(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def queue_position(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT score, seq FROM jobs WHERE job_id = ? AND state = 'queued'", (job_id,)).fetchone()
+            if row is None: return None
+            position = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND (score < ? OR (score = ? AND seq <= ?))",
+                                          (row[0], row[0], row[1])).fetchone()[0]
+            total = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+        return position, total
+
+    def first_queued_score(self):
+        with self._lock:
+            return self._conn.execute("SELECT MIN(score) FROM jobs WHERE state = 'queued' AND not_before <= ?", (time.time(),)).fetchone()[0]
+
+    def queued_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+
+    def purge(self, before):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE state = 'done' AND updated_at < ?", (before,))
+
+    def update_state(self, name, update):
+        """Atomares Lesen-Ändern-Schreiben eines kleinen Zustands: update(Zustand oder None) -> (neuer Zustand, Ergebnis)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value FROM states WHERE name = ?", (name,)).fetchone()
+                state, result = update(json.loads(row[0]) if row else None)
+                self._conn.execute("INSERT OR REPLACE INTO states (name, value) VALUES (?, ?)", (name, json.dumps(state)))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
 
-# --- Worker Queue (Prozesssicher) ---
-task_queue = multiprocessing.Queue()
+    def next_sequence(self, name, floor):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("INSERT INTO sequences (name, value) VALUES (?, ?) "
+                                   "ON CONFLICT(name) DO UPDATE SET value = MAX(value + 1, excluded.value)", (name, floor))
+                value = self._conn.execute("SELECT value FROM sequences WHERE name = ?", (name,)).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+
+class RedisJobBackend:
+    """Geteilte Warteschlange in Redis für mehrere Hosts.
+
+    `<prefix>:queue` (Sorted Set nach Sortierwert) hält wartende Aufträge, `<prefix>:delayed` (nach
+    Fälligkeit) verzögert zurückgestellte, `<prefix>:leases` (nach Ablaufzeit) die geleasten; Auftrag,
+    Status, Besitzer, Sortierwert, Plattform und Client
+    stehen im Hash `<prefix>:job:<id>`. Leasen (inkl. Limits je Plattform und Client) und
+    besitzergebundene Updates laufen atomar als Lua-Skript.
+    """
+    shared = True
+    LEASE_SCRIPT = """
+        local now, job_prefix, scan = tonumber(ARGV[1]), ARGV[4], tonumber(ARGV[6])
+        local limits = cjson.decode(ARGV[5])
+        for _, job_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)) do
+            redis.call('ZREM', KEYS[3], job_id)
+            redis.call('ZADD', KEYS[1], tonumber(redis.call('HGET', job_prefix .. job_id, 'score') or now), job_id)
+        end
+        local candidates = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now, 'LIMIT', 0, scan)
+        for _, job_id in ipairs(redis.call('ZRANGE', KEYS[1], 0, scan - 1)) do table.insert(candidates, job_id) end
+        local platforms, clients = {}, {}
+        if limits.active then
+            for _, job_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '(' .. now, '+inf')) do
+                local meta = redis.call('HMGET', job_prefix .. job_id, 'platform', 'client')
+                if meta[1] then platforms[meta[1]] = (platforms[meta[1]] or 0) + 1 end
+                if meta[2] and meta[2] ~= '' then clients[meta[2]] = (clients[meta[2]] or 0) + 1 end
+            end
+        end
+        for _, job_id in ipairs(candidates) do
+            local key = job_prefix .. job_id
+            local meta = redis.call('HMGET', key, 'task', 'platform', 'client')
+            if not meta[1] then
+                redis.call('ZREM', KEYS[1], job_id); redis.call('ZREM', KEYS[2], job_id)
+            elseif not limits.active or (
+                    (not meta[2] or not limits.platform[meta[2]] or (platforms[meta[2]] or 0) < limits.platform[meta[2]]) and
+                    (limits.client == 0 or not meta[3] or meta[3] == '' or (clients[meta[3]] or 0) < limits.client)) then
+                redis.call('ZREM', KEYS[1], job_id)
+                redis.call('ZADD', KEYS[2], ARGV[2], job_id)
+                redis.call('HSET', key, 'state', 'leased', 'owner', ARGV[3])
+                redis.call('EXPIRE', key, ARGV[7])
+                return {job_id, meta[1], redis.call('HINCRBY', key, 'attempts', 1)}
+            end
+        end
+        return nil
+    """
+    REQUEUE_SCRIPT = """
+        if redis.call('HGET', KEYS[1], 'owner') ~= ARGV[1] then return 0 end
+        redis.call('HSET', KEYS[1], 'state', 'queued', 'owner', '', 'task', ARGV[2], 'score', ARGV[3])
+        if tonumber(redis.call('HINCRBY', KEYS[1], 'attempts', -1)) < 0 then redis.call('HSET', KEYS[1], 'attempts', 0) end
+        redis.call('EXPIRE', KEYS[1], ARGV[6])
+        redis.call('ZREM', KEYS[3], ARGV[4])
+        if tonumber(ARGV[5]) > 0 then redis.call('ZADD', KEYS[4], ARGV[5], ARGV[4]) else redis.call('ZADD', KEYS[2], ARGV[3], ARGV[4]) end
+        return 1
+    """
+    UPDATE_IF_OWNER_SCRIPT = """
+        if redis.call('HGET', KEYS[1], 'owner') ~= ARGV[1] then return 0 end
+        redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+        return 1
+    """
+    NEXT_SEQUENCE_SCRIPT = """
+        local value = redis.call('INCR', KEYS[1])
+        if value < tonumber(ARGV[1]) then value = tonumber(ARGV[1]); redis.call('SET', KEYS[1], value) end
+        return value
+    """
+
+    def __init__(self, url, prefix=JOB_BACKEND_KEY_PREFIX):
+        import redis # Optionale Abhängigkeit, nur für JOB_BACKEND=redis nötig
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._redis.ping()
+        self._watch_error = redis.WatchError
+        self._queue_key, self._leases_key, self._delayed_key = f"{prefix}:queue", f"{prefix}:leases", f"{prefix}:delayed"
+        self._job_prefix, self._sequence_prefix, self._state_prefix = f"{prefix}:job:", f"{prefix}:sequence:", f"{prefix}:state:"
+        self._lease = self._redis.register_script(self.LEASE_SCRIPT)
+        self._update_if_owner = self._redis.register_script(self.UPDATE_IF_OWNER_SCRIPT)
+        self._next_sequence = self._redis.register_script(self.NEXT_SEQUENCE_SCRIPT)
+        self._requeue = self._redis.register_script(self.REQUEUE_SCRIPT)
+        self._limits = json.dumps({"active": SCHEDULER_LIMITS_ACTIVE, "platform": PLATFORM_CONCURRENCY, "client": CLIENT_CONCURRENCY})
+
+    def _job_key(self, job_id):
+        return self._job_prefix + job_id
+
+    def enqueue(self, task, snapshot):
+        platform, client_id, score = task_scheduling(task)
+        pipe = self._redis.pipeline()
+        pipe.hset(self._job_key(task[0]), mapping={"task": encode_task(task), "state": "queued", "status": json.dumps(snapshot),
+                                                   "attempts": 0, "cancel": 0, "score": score, "platform": platform, "client": client_id or ""})
+        pipe.expire(self._job_key(task[0]), BACKEND_JOB_TTL_SECONDS)
+        pipe.zadd(self._queue_key, {task[0]: score})
+        pipe.execute()
+
+    def lease(self, worker_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.time()
+            result = self._lease(keys=[self._queue_key, self._leases_key, self._delayed_key],
+                                 args=[now, now + JOB_LEASE_SECONDS, worker_id, self._job_prefix, self._limits, SCHEDULER_SCAN_LIMIT,
+                                       BACKEND_JOB_TTL_SECONDS])
+            if result: return decode_task(result[1]), int(result[2])
+            if time.monotonic() >= deadline: return None
+            time.sleep(JOB_BACKEND_POLL_SECONDS)
+
+    def requeue(self, task, worker_id, delay=0):
+        """Gibt einen geleasten Auftrag mit neuem Sortierwert zurück in die Warteschlange (zählt nicht als Versuch),
+        frühestens nach `delay` Sekunden wieder leasbar."""
+        self._requeue(keys=[self._job_key(task[0]), self._queue_key, self._leases_key, self._delayed_key],
+                      args=[worker_id, encode_task(task), task_scheduling(task)[2], task[0], time.time() + delay if delay > 0 else 0,
+                            BACKEND_JOB_TTL_SECONDS])
+
+    def cancel_queued(self, job_id):
+        if not (self._redis.zrem(self._queue_key, job_id) or self._redis.zrem(self._delayed_key, job_id)): return False
+        pipe = self._redis.pipeline()
+        pipe.hset(self._job_key(job_id), mapping={"state": "done", "cancel": 1})
+        pipe.expire(self._job_key(job_id), JOB_STATUS_TTL_SECONDS * 2) # Wie bei complete()
+        pipe.execute()
+        return True
+
+    def heartbeat(self, job_ids, worker_id):
+        """Verlängert die Leases und liefert die Jobs, die inzwischen einem anderen Worker gehören."""
+        pipe = self._redis.pipeline()
+        for job_id in job_ids: pipe.hget(self._job_key(job_id), "owner")
+        owners = dict(zip(job_ids, pipe.execute()))
+        mine = [job_id for job_id, owner in owners.items() if owner == worker_id]
+        if mine: self._redis.zadd(self._leases_key, {job_id: time.time() + JOB_LEASE_SECONDS for job_id in mine}, xx=True)
+        return {job_id for job_id, owner in owners.items() if owner != worker_id}
+
+    def publish_status(self, job_id, snapshot, worker_id):
+        return bool(self._update_if_owner(keys=[self._job_key(job_id)], args=[worker_id, "status", json.dumps(snapshot)]))
+
+    def store_finished(self, job_id, snapshot):
+        pipe = self._redis.pipeline()
+        pipe.hset(self._job_key(job_id), mapping={"state": "done", "status": json.dumps(snapshot)})
+        pipe.expire(self._job_key(job_id), JOB_STATUS_TTL_SECONDS * 2)
+        pipe.execute()
+
+    def complete(self, job_id, worker_id):
+        if not self._update_if_owner(keys=[self._job_key(job_id)], args=[worker_id, "state", "done"]): return
+        pipe = self._redis.pipeline()
+        pipe.zrem(self._leases_key, job_id)
+        pipe.expire(self._job_key(job_id), JOB_STATUS_TTL_SECONDS * 2)
+        pipe.execute()
+
+    def request_cancel(self, job_id):
+        if self._redis.hget(self._job_key(job_id), "state") not in ("queued", "leased"): return False
+        self._redis.hset(self._job_key(job_id), "cancel", 1)
+        return True
+
+    def cancelled_jobs(self, job_ids):
+        pipe = self._redis.pipeline()
+        for job_id in job_ids: pipe.hget(self._job_key(job_id), "cancel")
+        return {job_id for job_id, flag in zip(job_ids, pipe.execute()) if flag == "1"}
+
+    def active_jobs(self, job_ids):
+        """Jobs, die noch warten oder geleast sind."""
+        pipe = self._redis.pipeline()
+        for job_id in job_ids: pipe.hget(self._job_key(job_id), "state")
+        return {job_id for job_id, state in zip(job_ids, pipe.execute()) if state in ("queued", "leased")}
+
+    def get_status(self, job_id):
+        raw = self._redis.hget(self._job_key(job_id), "status")
+        return json.loads(raw) if raw else None
+
+    def queue_position(self, job_id):
+        pipe = self._redis.pipeline()
+        pipe.zrank(self._queue_key, job_id)
+        pipe.zcard(self._queue_key)
+        rank, total = pipe.execute()
+        return (rank + 1, total) if rank is not None else None
+
+    def first_queued_score(self):
+        first = self._redis.zrange(self._queue_key, 0, 0, withscores=True)
+        return first[0][1] if first else None
+
+    def queued_count(self):
+        return self._redis.zcard(self._queue_key) + self._redis.zcard(self._delayed_key)
+
+    def purge(self, before): pass # Abgeschlossene Jobs laufen per EXPIRE ab
+
+    def next_sequence(self, name, floor):
+        return int(self._next_sequence(keys=[self._sequence_prefix + name], args=[floor]))
+
+    def update_state(self, name, update):
+        """Atomares Lesen-Ändern-Schreiben eines kleinen Zustands (optimistisch per WATCH/MULTI)."""
+        key = self._state_prefix + name
+        with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    state, result = update(json.loads(raw) if raw else None)
+                    pipe.multi()
+                    pipe.set(key, json.dumps(state), ex=BACKEND_STATE_TTL_SECONDS)
+                    pipe.execute()
+                    return result
+                except self._watch_error:
+                    continue # Gleichzeitig geändert, mit neuem Stand wiederholen
+
+
+def create_job_backend():
+    try:
+        if JOB_BACKEND == 'sqlite':
+            backend = SQLiteJobBackend(JOB_BACKEND_DB_PATH)
+            logging.info(f"Job-Backend: SQLite ({JOB_BACKEND_DB_PATH})")
+            return backend
+        if JOB_BACKEND == 'redis':
+            backend = RedisJobBackend(REDIS_URL)
+            logging.info(f"Job-Backend: Redis ({urllib.parse.urlparse(REDIS_URL).hostname})")
+            return backend
+    except Exception as e:
+        logging.error(f"Job-Backend '{JOB_BACKEND}' nicht verfügbar: {e}. Verwende In-Process Warteschlange "
+                      "(Aufträge werden NICHT zwischen Workern geteilt, nur mit einem Gunicorn-Worker betreiben).")
+    return MemoryJobBackend()
+
+job_backend = create_job_backend()
+
+
+class JobBackendSync:
+    """Verbindet den lokalen Job-Store mit dem Job-Backend.
+
+    Eigene (von diesem Prozess geleaste) Jobs werden regelmäßig veröffentlicht, ihr Lease
+    verlängert und Abbruchwünsche aus dem Backend an ihr `cancel_event` weitergegeben.
+    Jobs anderer Worker werden beim Abruf aus dem Backend in den lokalen Job-Store gespiegelt.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._owned = {} # job_id -> JobContext
+        self._lost = set() # Jobs, deren Lease ein anderer Worker übernommen hat
+        self._published = {} # job_id -> zuletzt veröffentlichte Version
+        self._refreshed = {} # job_id -> Zeitpunkt der letzten Spiegelung
+        self._local = set() # Nicht geleaste, aber in diesem Prozess geführte Einträge (Batches)
+
+    def adopt(self, ctx, attempts):
+        """Übernimmt einen geleasten Auftrag. Liefert False, wenn er nicht (mehr) bearbeitet werden soll."""
+        job_id = ctx.job_id
+        if job_id not in job_store:
+            snapshot = self.backend.get_status(job_id)
+            if snapshot: job_store.apply_snapshot(job_id, snapshot) # Logs des vorherigen Versuchs übernehmen
+            else: job_store.create(job_id, log_entry="Auftrag eingereiht.")
+        with self._lock: self._owned[job_id] = ctx
+        if attempts > JOB_MAX_ATTEMPTS:
+            update_status(job_id, error=f"Auftrag nach {JOB_MAX_ATTEMPTS} abgebrochenen Versuchen aufgegeben.", running=False)
+            return False
+        if attempts > 1:
+            update_status(job_id, log_entry=f"Auftrag nach Ausfall eines Workers erneut übernommen (Versuch {attempts}/{JOB_MAX_ATTEMPTS}).")
+        if self.backend.cancelled_jobs([job_id]):
+            update_status(job_id, error="Auftrag wurde abgebrochen.", running=False)
+            return False
+        return True
+
+    def release(self, job_id):
+        """Veröffentlicht den finalen Status eines eigenen Jobs und gibt das Lease frei."""
+        with self._lock:
+            ctx = self._owned.pop(job_id, None)
+            lost = job_id in self._lost
+            self._lost.discard(job_id)
+            self._published.pop(job_id, None)
+        if ctx is None or lost: return
+        worker_id = current_worker_id()
+        if self.backend.shared:
+            snapshot = job_store.export(job_id)
+            if snapshot is not None: self.backend.publish_status(job_id, snapshot, worker_id)
+        self.backend.complete(job_id, worker_id) # Gibt auch das Limit für Plattform/Client frei
+
+    def requeue(self, ctx, delay=0):
+        """Gibt einen eigenen Job zurück in die Warteschlange (z.B. zurückgestellt oder gedrosselt, dann erst nach
+        `delay` Sekunden wieder leasbar); ein anderer Worker kann ihn leasen."""
+        with self._lock:
+            self._owned.pop(ctx.job_id, None)
+            lost = ctx.job_id in self._lost
+            self._lost.discard(ctx.job_id)
+            self._published.pop(ctx.job_id, None)
+        if lost: return
+        worker_id = current_worker_id()
+        if self.backend.shared:
+            snapshot = job_store.export(ctx.job_id)
+            if snapshot is not None: self.backend.publish_status(ctx.job_id, snapshot, worker_id)
+        self.backend.requeue(ctx.to_task(), worker_id, delay)
+
+    def cancel_local(self, job_id):
+        """Bricht einen Job ab, den dieser Prozess bearbeitet. Liefert False, wenn er hier nicht läuft."""
+        with self._lock: ctx = self._owned.get(job_id)
+        if ctx is None: return False
+        ctx.cancel_event.set()
+        return True
+
+    def is_remote(self, job_id):
+        return self.backend.shared and job_id not in self._owned and job_id not in self._local
+
+    def keep_local(self, job_id, local=True):
+        if local: self._local.add(job_id)
+        else: self._local.discard(job_id)
+
+    def refresh(self, job_id):
+        """Spiegelt den Status eines Jobs anderer Worker aus dem Backend. Liefert False, wenn der Job unbekannt ist."""
+        if not self.is_remote(job_id): return job_id in job_store
+        now = time.monotonic()
+        if job_id in job_store and now - self._refreshed.get(job_id, 0) < REMOTE_STATUS_REFRESH_SECONDS / 2: return True
+        self._refreshed[job_id] = now
+        snapshot = self.backend.get_status(job_id)
+        if snapshot is None: return job_id in job_store
+        job_store.apply_snapshot(job_id, snapshot)
+        return True
+
+    def forget(self, job_id):
+        self._refreshed.pop(job_id, None)
+        self._local.discard(job_id)
+
+    def _publish(self, job_id, worker_id):
+        snapshot = job_store.export(job_id)
+        if snapshot is None or self._published.get(job_id) == snapshot["version"]: return
+        if self.backend.publish_status(job_id, snapshot, worker_id): self._published[job_id] = snapshot["version"]
+
+    def run(self):
+        logging.info("Job-Backend Sync Thread gestartet.")
+        last_heartbeat = 0.0
+        while True:
+            time.sleep(JOB_STATUS_PUBLISH_SECONDS)
+            try:
+                with self._lock: owned = {job_id: ctx for job_id, ctx in self._owned.items() if job_id not in self._lost}
+                if not owned: continue
+                worker_id = current_worker_id()
+                for job_id in owned: self._publish(job_id, worker_id)
+                if time.monotonic() - last_heartbeat >= JOB_LEASE_SECONDS / 3:
+                    last_heartbeat = time.monotonic()
+                    for job_id in self.backend.heartbeat(list(owned), worker_id):
+                        logging.warning(f"[{job_id}] Lease verloren (Auftrag von anderem Worker übernommen), breche lokale Bearbeitung ab.")
+                        with self._lock: self._lost.add(job_id)
+                        owned[job_id].cancel_event.set()
+                for job_id in self.backend.cancelled_jobs(list(owned)):
+                    if not owned[job_id].cancel_event.is_set():
+                        logging.info(f"[{job_id}] Abbruch über das Job-Backend angefordert.")
+                        owned[job_id].cancel_event.set()
+            except Exception as e:
+                logging.error(f"Fehler im Job-Backend Sync Thread: {e}", exc_info=True)
+
+job_sync = JobBackendSync(job_backend)
+
+
+# --- Rate-Limiting je Plattform (Token-Bucket, Zustand im Job-Backend) ---
+class PlatformThrottledError(Exception):
+    """Die Plattform drosselt (HTTP 429/403) oder das Rate-Limit ist erschöpft: später erneut versuchen."""
+
+    def __init__(self, platform, delay, status=None):
+        super().__init__(f"{platform} drosselt Anfragen, neuer Versuch in {delay:.0f}s")
+        self.platform = platform
+        self.delay = delay
+        self.status = status # HTTP-Status der Plattform, None = eigenes Rate-Limit
+
+def throttle_status(err_str):
+    """429 bei Drosselung durch die Plattform, 403 bei möglicher Drosselung, sonst None."""
+    lowered = err_str.lower()
+    if "http error 429" in lowered or "too many requests" in lowered or "rate-limit" in lowered or "rate limit" in lowered: return 429
+    if "HTTP Error 403" in err_str: return 403
+    return None
+
+def retry_after_from_error(error):
+    """Retry-After (Sekunden) des HTTP-Fehlers hinter einem yt-dlp DownloadError, sonst None."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or getattr(error, 'headers', None)
+        value = headers.get('Retry-After') if headers else None
+        if value:
+            try: return max(0.0, float(value))
+            except ValueError: pass
+            try: return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError): return None
+        exc_info = getattr(error, 'exc_info', None)
+        error = (exc_info[1] if exc_info else None) or error.__cause__ or error.__context__
+    return None
+
+class PlatformRateLimiter:
+    """Token-Bucket je Plattform für Extraktion und Download, über das Job-Backend zwischen Workern geteilt.
+
+    Bei einer Drosselung halbiert sich die Rate und steigt innerhalb von RATE_LIMIT_RECOVERY_SECONDS
+    linear wieder auf den Sollwert; bis Retry-After bzw. zum exponentiellen Backoff ist die Plattform gesperrt.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def base_rate(platform):
+        return PLATFORM_RATE_LIMITS.get(platform, RATE_LIMIT_PER_MINUTE) / 60.0 # Tokens pro Sekunde
+
+    @staticmethod
+    def _refill(state, base, now):
+        recovered = (now - state["penalized"]) * base / RATE_LIMIT_RECOVERY_SECONDS
+        rate = min(base, state["rate"] + recovered) if base > 0 else 0.0
+        state["tokens"] = min(RATE_LIMIT_BURST, state["tokens"] + max(0.0, now - state["updated"]) * rate)
+        state["updated"] = now
+        return rate
+
+    def _initial(self, base, now):
+        return {"tokens": RATE_LIMIT_BURST, "updated": now, "rate": base, "penalized": 0, "blocked_until": 0, "strikes": 0}
+
+    def _take(self, platform):
+        """Nimmt ein Token. Liefert 0 oder die Wartezeit in Sekunden bis zum nächsten freien Token."""
+        now, base = time.time(), self.base_rate(platform)
+
+        def update(state):
+            state = state or self._initial(base, now)
+            rate = self._refill(state, base, now)
+            if now < state["blocked_until"]: return state, state["blocked_until"] - now
+            if base <= 0: return state, 0.0 # Unbegrenzt, nur Sperren nach Drosselung gelten
+            if state["tokens"] < 1: return state, (1 - state["tokens"]) / rate
+            state["tokens"] -= 1
+            if rate >= base: state["strikes"] = 0 # Vollständig erholt, Backoff beginnt wieder von vorn
+            return state, 0.0
+        return self.backend.update_state(f"rate:{platform}", update)
+
+    def acquire(self, platform, cancel_event=None):
+        """Wartet auf ein Token; dauert das länger als RATE_LIMIT_MAX_WAIT_SECONDS, gibt es PlatformThrottledError."""
+        while True:
+            wait = self._take(platform)
+            if wait <= 0: return
+            if wait > RATE_LIMIT_MAX_WAIT_SECONDS: raise PlatformThrottledError(platform, jittered_delay(wait))
+            METRIC_RATE_LIMIT.inc(platform=platform, event="waited")
+            if cancel_event is not None and cancel_event.wait(wait): return # Abbruch prüft der Aufrufer
+            if cancel_event is None: time.sleep(wait)
+
+    def penalize(self, platform, retry_after=None):
+        """Registriert eine Drosselung durch die Plattform und liefert die Wartezeit (mit Jitter) für den Job."""
+        now, base = time.time(), self.base_rate(platform)
+        METRIC_RATE_LIMIT.inc(platform=platform, event="throttled")
+
+        def update(state):
+            state = state or self._initial(base, now)
+            rate = self._refill(state, base, now)
+            if now >= state["blocked_until"]: # Gleichzeitige Fehler anderer Worker zählen nicht erneut
+                state["strikes"] += 1
+                backoff = min(RATE_LIMIT_MAX_BACKOFF_SECONDS, RATE_LIMIT_BACKOFF_SECONDS * 2 ** (state["strikes"] - 1))
+                state.update(rate=rate / 2, penalized=now, tokens=0.0, blocked_until=now + max(backoff, retry_after or 0))
+            return state, state["blocked_until"] - now
+        return jittered_delay(self.backend.update_state(f"rate:{platform}", update))
+
+def jittered_delay(delay):
+    # Zufälliger Aufschlag, damit gedrosselte Jobs nicht alle gleichzeitig wiederkommen
+    return delay * random.uniform(1.0, 1.5) + random.uniform(0.0, 1.0)
+
+rate_limiter = PlatformRateLimiter(job_backend)
+
+def wait_for_status_change(job_id, since_version, timeout):
+    """Wie JobStore.wait_for_change; Jobs anderer Worker werden währenddessen regelmäßig nachgeladen."""
+    deadline = time.monotonic() + timeout
+    while True:
+        remote = job_sync.is_remote(job_id)
+        remaining = deadline - time.monotonic()
+        if job_store.wait_for_change(job_id, since_version, min(remaining, REMOTE_STATUS_REFRESH_SECONDS) if remote else remaining): return True
+        if not remote or time.monotonic() >= deadline: return False
+        job_sync.refresh(job_id)
 
 # --- Hilfsfunktionen (Backend - unverändert) ---
 def generate_random_part(length=RANDOM_NAME_LENGTH):
     characters = string.ascii_lowercase + string.digits
     return ''.join(random.choice(characters) for _ in range(length))
 
+def to_base36(number):
+    digits = string.digits + string.ascii_lowercase
+    result = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+        if not number: return result
+
 def generate_s3_object_name(extension):
-    year_part = datetime.now().strftime("%y")
-    random_part = generate_random_part()
+    """Jahr (2 Ziffern) + fortlaufende Base36-ID aus dem Job-Backend.
+
+    Die ID ist max(letzte ID + 1, Zehntelsekunden seit Jahresbeginn): innerhalb eines Backends
+    eindeutig und auch nach einem Neustart ohne gespeicherten Zähler praktisch immer frei.
+    Mit 6 Stellen nie gleich lang wie die alten Zufallsnamen (4 Zeichen).
+    """
+    now = datetime.now()
+    year_part = now.strftime("%y")
+    floor = int((now - datetime(now.year, 1, 1)).total_seconds() * 10)
+    sequence = job_backend.next_sequence(f"s3_name:{year_part}", floor)
     if not extension.startswith('.'): extension = '.' + extension
-    return f"{year_part}{random_part}{extension.lower()}"
+    return f"{year_part}{to_base36(sequence).rjust(S3_NAME_ID_LENGTH, '0')}{extension.lower()}"
 
 def strip_ansi_codes(text):
     return ANSI_ESCAPE_REGEX.sub('', text)
@@ -121,41 +1303,11 @@ def format_size(size_bytes):
    s = round(size_bytes / p, 2) if p > 0 else 0
    return f"{s} {size_name[i]}"
 
-# --- Status Update Funktion (leicht angepasst für Manager Dict) ---
+# --- Status Update Funktion ---
 def update_status(job_id, message=None, progress=None, log_entry=None, error=None, result_url=None, running=None, status_code=None):
-    with task_lock:
-        if job_id not in job_statuses:
-            logging.warning(f"Versuch, Status für unbekannten Job {job_id} zu aktualisieren.")
-            return
-        current_job_status = dict(job_statuses[job_id])
-        current_job_status["last_update"] = time.time()
-        if message is not None: current_job_status["message"] = message
-        if progress is not None: current_job_status["progress"] = max(0.0, min(100.0, float(progress)))
-        if log_entry is not None:
-            clean_log = strip_ansi_codes(str(log_entry))
-            if "logs" not in current_job_status or not isinstance(current_job_status["logs"], list):
-                 current_job_status["logs"] = []
-            log_list = list(current_job_status["logs"])
-            log_list.append(f"{datetime.now().strftime('%H:%M:%S')} - {clean_log}")
-            max_logs = 100
-            current_job_status["logs"] = log_list[-max_logs:]
-        if error is not None:
-            current_job_status["error"] = strip_ansi_codes(str(error))
-            current_job_status["running"] = False
-            current_job_status["message"] = f"Fehler: {current_job_status['error']}"
-            current_job_status["status"] = "error"
-            logging.error(f"Job Error [{job_id}]: {current_job_status['error']}")
-        if result_url is not None: current_job_status["result_url"] = result_url
-        if running is not None:
-            current_job_status["running"] = bool(running)
-            if not current_job_status["running"]:
-                if not current_job_status.get("error"):
-                    if current_job_status.get("status") not in ["error", "queued", "completed"]:
-                        current_job_status["status"] = "completed"
-                        current_job_status["message"] = current_job_status.get("message", "Abgeschlossen!")
-        if status_code is not None:
-            current_job_status["status"] = status_code
-        job_statuses[job_id] = current_job_status
+    if not job_store.update(job_id, message=message, progress=progress, log_entry=log_entry, error=error,
+                            result_url=result_url, running=running, status_code=status_code):
+        logging.warning(f"Versuch, Status für unbekannten Job {job_id} zu aktualisieren.")
 
 # --- Callback-Erzeuger (unverändert) ---
 def create_status_callback(job_id):
@@ -168,8 +1320,79 @@ def create_progress_callback(job_id):
         update_status(job_id, progress=value)
     return callback
 
+# --- Gedrosselte Fortschritts-Updates ---
+class ProgressCoalescer:
+    """Sammelt Fortschrittswerte eines Jobs und schreibt höchstens N Updates pro Sekunde.
+
+    Zwischenwerte werden zusammengeführt (der neueste Wert gewinnt), mit flush()
+    wird der letzte Stand sofort geschrieben (z.B. bei 'finished'/'error').
+    """
+    __slots__ = ("job_id", "min_interval", "_pending", "_last_flush", "_lock")
+
+    def __init__(self, job_id, updates_per_second=None):
+        self.job_id = job_id
+        self.min_interval = 1.0 / (updates_per_second or PROGRESS_UPDATES_PER_SECOND)
+        self._pending = {}
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def push(self, **fields):
+        now = time.monotonic()
+        with self._lock:
+            self._pending.update(fields)
+            if now - self._last_flush < self.min_interval: return
+            pending, self._pending = self._pending, {}
+            self._last_flush = now
+        self._write(pending)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if pending: self._write(pending)
+
+    def _write(self, fields):
+        progress = fields.get("progress")
+        if progress is not None: fields["progress"] = max(0.0, min(100.0, float(progress)))
+        else: fields.pop("progress", None)
+        job_store.set_fields(self.job_id, **fields)
+
 # --- Kernfunktionen ---
-def download_track(job_id, url, platform, format_preference, mp3_bitrate, mp4_quality, codec_preference, output_path="."):
+def build_h264_format_selector(mp4_quality):
+    """yt-dlp Formatauswahl für H.264 (avc1) Video mit AAC (mp4a) Audio in der gewünschten Höhe."""
+    if "Medium" in mp4_quality: height_filter = "[height<=?720]"
+    elif "Low" in mp4_quality: height_filter = "[height<=?480]"
+    else: height_filter = ""
+    return (f"bestvideo[vcodec^=avc1]{height_filter}+bestaudio[acodec^=mp4a]"
+            f"/best[vcodec^=avc1][acodec^=mp4a]{height_filter}")
+
+def get_stream_source(info_dict, final_extension, needs_ffmpeg_conversion, mp3_bitrate):
+    """Prüft, ob das ausgewählte Format ohne lokale Datei direkt zu S3 gestreamt werden kann.
+
+    Gibt eine Beschreibung der Quelle zurück oder None, wenn lokal heruntergeladen werden muss
+    (getrennte Video-/Audiospuren, Fragment-Protokolle oder nachfolgende H.264 Konvertierung).
+    """
+    if info_dict.get('requested_formats') or not info_dict.get('url'): return None
+    protocol = info_dict.get('protocol') or ''
+    headers = dict(info_dict.get('http_headers') or {})
+    if final_extension == '.mp3':
+        if protocol not in ('http', 'https', 'm3u8', 'm3u8_native'): return None
+        if info_dict.get('cookies'): headers['Cookie'] = info_dict['cookies']
+        return {'kind': 'ffmpeg_mp3', 'url': info_dict['url'], 'http_headers': headers,
+                'acodec': info_dict.get('acodec'), 'mp3_bitrate': mp3_bitrate, 'filesize': None}
+    if needs_ffmpeg_conversion or protocol not in ('http', 'https') or info_dict.get('ext') != 'mp4': return None
+    return {'kind': 'http', 'url': info_dict['url'], 'http_headers': headers,
+            'filesize': info_dict.get('filesize')}
+
+
+def download_track(job_id, url, platform, format_preference, mp3_bitrate, mp4_quality, codec_preference, output_path=".", stream_sink=None, on_info=None,
+                   cancel_event=None, retry_on_403=False, failure=None):
+    """Lädt die Datei herunter. Ist `stream_sink` ein Dict und das Format direkt streambar, wird
+    stattdessen die Quelle darin abgelegt und (None, Titel, Endung) zurückgegeben.
+    `on_info` wird mit dem extrahierten info_dict aufgerufen; gibt es True zurück, entfällt der Download.
+    Ein gesetztes `cancel_event` bricht den Download beim nächsten Fortschritts-Callback ab.
+    Drosselt die Plattform (429, mit `retry_on_403` auch 403), wird PlatformThrottledError ausgelöst.
+    Ist `failure` ein Dict, werden vorübergehende Fehler (Netzwerk, 5xx) dort abgelegt statt den Job scheitern zu lassen."""
     track_title = None; final_extension = None
     status_callback = create_status_callback(job_id)
     progress_callback = create_progress_callback(job_id)
@@ -179,32 +1402,43 @@ def download_track(job_id, url, platform, format_preference, mp3_bitrate, mp4_qu
     os.makedirs(output_path, exist_ok=True)
 
     last_reported_progress = -1
+    progress_coalescer = ProgressCoalescer(job_id)
+    counted_bytes = {} # Dateiname -> bereits in METRIC_DOWNLOADED_BYTES verbuchte Bytes
+
+    def _check_cancelled(d=None):
+        if cancel_event is not None and cancel_event.is_set(): raise yt_dlp.utils.DownloadCancelled("Job wurde abgebrochen.")
 
     def _progress_hook_logic(d):
         nonlocal last_reported_progress
+        _check_cancelled()
+        if d['status'] in ('downloading', 'finished') and d.get('downloaded_bytes'):
+            filename = d.get('filename', '')
+            METRIC_DOWNLOADED_BYTES.inc(max(0, d['downloaded_bytes'] - counted_bytes.get(filename, 0)))
+            counted_bytes[filename] = max(counted_bytes.get(filename, 0), d['downloaded_bytes'])
         if d['status'] == 'downloading':
-            filename = strip_ansi_codes(d.get('info_dict', {}).get('title', d.get('filename', 'Datei')))
-            percent_str = strip_ansi_codes(d.get('_percent_str', 'N/A')).strip()
-            speed_str = strip_ansi_codes(d.get('_speed_str', 'N/A')).strip()
-            eta_str = strip_ansi_codes(d.get('_eta_str', 'N/A')).strip()
-            total_bytes_str = strip_ansi_codes(d.get('_total_bytes_str', 'N/A')).strip()
-            percent_float = None
-            try:
-                percent_str_cleaned = percent_str.replace('%','').strip()
-                percent_float = float(percent_str_cleaned)
-                if progress_callback: progress_callback(percent_float)
-            except ValueError:
-                percent_float = 0.0
+            # Rohwerte von yt-dlp direkt verwenden statt '_percent_str' & Co. zu parsen
+            downloaded_bytes = d.get('downloaded_bytes') or 0
+            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
+            speed = d.get('speed'); eta = d.get('eta')
+            percent_float = (downloaded_bytes * 100.0 / total_bytes) if total_bytes else None
+            progress_coalescer.push(progress=percent_float, downloaded_bytes=downloaded_bytes,
+                                    total_bytes=total_bytes, speed=speed, eta=eta)
+            if percent_float is None: return
             current_prog = int(percent_float)
-            if current_prog != -1 and (current_prog == 0 or current_prog == 100 or abs(current_prog - last_reported_progress) >= 5):
-                 status_msg = f"Download: {filename} - {percent_str} von {total_bytes_str} @ {speed_str}, ETA: {eta_str}"
+            if current_prog != last_reported_progress and (current_prog == 100 or last_reported_progress < 0 or current_prog - last_reported_progress >= DOWNLOAD_LOG_PROGRESS_STEP):
+                 filename = strip_ansi_codes(d.get('info_dict', {}).get('title', d.get('filename', 'Datei')))
+                 speed_str = f"{format_size(speed)}/s" if speed else "N/A"
+                 eta_str = f"{int(eta)}s" if eta is not None else "N/A"
+                 status_msg = f"Download: {filename} - {percent_float:.1f}% von {format_size(total_bytes)} @ {speed_str}, ETA: {eta_str}"
                  if status_callback: status_callback(status_msg)
                  last_reported_progress = current_prog
         elif d['status'] == 'finished':
+            progress_coalescer.flush()
             filename = strip_ansi_codes(d.get('filename', 'Datei'))
             if status_callback: status_callback(f"Download von {os.path.basename(filename)} beendet, prüfe Nachbearbeitung...")
             last_reported_progress = -1
         elif d['status'] == 'error':
+            progress_coalescer.flush()
             filename = strip_ansi_codes(d.get('filename', 'Datei'))
             if status_callback: status_callback(f"Fehler beim Download von {os.path.basename(filename)}.")
             last_reported_progress = -1
@@ -225,10 +1459,11 @@ def download_track(job_id, url, platform, format_preference, mp3_bitrate, mp4_qu
         'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
         'noplaylist': True, 'quiet': True, 'noprogress': True,
         'ffmpeg_location': None, 'logger': logging.getLogger('yt_dlp'),
-        'progress_hooks': [_progress_hook_logic],
+        'progress_hooks': [_progress_hook_logic], 'postprocessor_hooks': [_check_cancelled],
         'restrictfilenames': True, 'writethumbnail': False, 'no_color': True,
         'postprocessors': [],
         'cookiefile': os.getenv('COOKIE_FILE_PATH') or None,
+        'continuedl': True, # .part Dateien eines früheren Versuchs per HTTP Range fortsetzen
     }
     if ydl_opts['cookiefile']: logging.info(f"[{job_id}] Verwende Cookie-Datei: {ydl_opts['cookiefile']}")
     else: logging.info(f"[{job_id}] Keine Cookie-Datei konfiguriert.")
@@ -277,13 +1512,29 @@ def download_track(job_id, url, platform, format_preference, mp3_bitrate, mp4_qu
          update_status(job_id, error=f"Ungültige Kombination: {platform}/{format_preference}", running=False)
          return None, None, None
 
+    if needs_ffmpeg_conversion and H264_FORMAT_STRATEGY == 'prefer':
+        # Zuerst H.264/AAC-Varianten anfragen, dann reicht meist ein Remux statt einer Neukodierung
+        quality = mp4_quality if platform == "YouTube" else "Best"
+        ydl_opts['format'] = build_h264_format_selector(quality) + '/' + ydl_opts['format']
+        logging.info(f"[{job_id}] Bevorzuge H.264/AAC Formate: {ydl_opts['format']}")
+
     downloaded_file_path = None; actual_downloaded_filename = None
-    original_download_path = None
 
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             status_callback("Extrahiere Informationen...")
-            info_dict = ydl.extract_info(url, download=False); track_title = info_dict.get('title', 'Unbekannter Titel')
+            # Rohes Ergebnis (vor der Formatauswahl) aus dem Cache oder einmalig extrahieren;
+            # Formatauswahl und Download arbeiten danach ohne zweite Extraktion damit.
+            raw_info = info_cache.get(url) if info_cache is not None else None
+            info_from_cache = raw_info is not None
+            if info_from_cache:
+                logging.info(f"[{job_id}] Verwende zwischengespeicherte Metadaten für {url}.")
+            else:
+                rate_limiter.acquire(platform, cancel_event); _check_cancelled()
+                with timed_phase("extract"): raw_info = ydl.extract_info(url, download=False, process=False)
+                if info_cache is not None: info_cache.put(url, raw_info)
+            info_dict = ydl.process_ie_result(copy_raw_info(raw_info), download=False)
+            track_title = info_dict.get('title', 'Unbekannter Titel')
             if platform in ["Instagram", "Twitter"] and not track_title:
                 track_title = f"{platform}_Video_{info_dict.get('id', generate_random_part(6))}"
                 logging.info(f"[{job_id}] Kein Titel gefunden, verwende generierten Titel: {track_title}")
@@ -291,29 +1542,41 @@ def download_track(job_id, url, platform, format_preference, mp3_bitrate, mp4_qu
                  track_title = URL_REGEX.sub('', track_title).strip()
                  if not track_title: track_title = f"{platform}_Video_{info_dict.get('id', generate_random_part(6))}"
 
-            sanitized_title_for_filename = ydl.prepare_filename(info_dict)
-            base_name_from_title = os.path.splitext(os.path.basename(sanitized_title_for_filename))[0]
-
             if platform == "SoundCloud" or (platform == "YouTube" and format_preference == 'mp3'): final_extension = '.mp3'
             elif platform in ["YouTube", "TikTok", "Instagram", "Twitter"]: final_extension = '.mp4'
             else: final_extension = '.mp4' if format_preference == 'mp4' else '.mp3'; logging.warning(f"[{job_id}] Unerwarteter Fall bei Endungsbestimmung, verwende {final_extension}")
 
+            if on_info is not None and on_info(info_dict):
+                return None, track_title, final_extension
+
+            if stream_sink is not None:
+                stream_source = get_stream_source(info_dict, final_extension, needs_ffmpeg_conversion, mp3_bitrate)
+                if stream_source:
+                    stream_source['cookiefile'] = ydl_opts['cookiefile']
+                    stream_sink.update(stream_source)
+                    status_callback(f"Streame '{track_title}' direkt zu S3 (ohne lokale Zwischenspeicherung)...")
+                    logging.info(f"[{job_id}] Streaming-Upload ({stream_source['kind']}, Protokoll {info_dict.get('protocol')}).")
+                    return None, track_title, final_extension
+                logging.info(f"[{job_id}] Format nicht direkt streambar (Protokoll {info_dict.get('protocol')}), lade lokal herunter.")
+
+            rate_limiter.acquire(platform, cancel_event); _check_cancelled()
             status_callback(f"Downloade '{track_title}'...")
-            ydl.download([url])
+            result_info = None
+            with timed_phase("download"):
+                try: result_info = ydl.process_ie_result(raw_info, download=True)
+                except yt_dlp.utils.DownloadError as cached_e:
+                    if not info_from_cache: raise
+                    # z.B. abgelaufene Format-URLs: Eintrag verwerfen und mit frischer Extraktion laden
+                    logging.warning(f"[{job_id}] Download mit zwischengespeicherten Metadaten fehlgeschlagen ({strip_ansi_codes(str(cached_e))[:200]}), extrahiere neu.")
+                    info_cache.forget(url)
+                    rate_limiter.acquire(platform, cancel_event); _check_cancelled() # Neue Extraktion + Download
+                    ydl.download([url])
 
-            downloaded_file_path = None
             possible_extensions = [final_extension]
             if final_extension == '.mp4': possible_extensions.extend(['.webm', '.mkv', '.mov', '.avi'])
-            found_file = None; latest_mtime = 0
-            for f in os.listdir(output_path):
-                file_base, file_ext = os.path.splitext(f)
-                if file_base.lower().startswith(base_name_from_title.lower()) and file_ext.lower() in possible_extensions:
-                    current_path = os.path.join(output_path, f)
-                    current_mtime = os.path.getmtime(current_path)
-                    if current_mtime > latest_mtime:
-                        found_file = current_path; latest_mtime = current_mtime
+            found_file = find_downloaded_file(result_info, output_path, possible_extensions)
             if found_file:
-                downloaded_file_path = found_file; original_download_path = downloaded_file_path
+                downloaded_file_path = found_file
                 actual_downloaded_filename = os.path.basename(downloaded_file_path)
                 status_callback(f"Download abgeschlossen: {actual_downloaded_filename}")
                 logging.info(f"[{job_id}] Datei heruntergeladen: {downloaded_file_path}")
@@ -323,76 +1586,46 @@ def download_track(job_id, url, platform, format_preference, mp3_bitrate, mp4_qu
                 update_status(job_id, error=error_msg, running=False)
                 return None, None, None
 
-            if needs_ffmpeg_conversion and downloaded_file_path:
-                status_callback("Starte H.264 Kompatibilitäts-Konvertierung (kann dauern)...")
-                logging.info(f"[{job_id}] Starte explizite FFmpeg H.264 Konvertierung für: {downloaded_file_path}")
-                base_name, _ = os.path.splitext(downloaded_file_path)
-                converted_file_path = f"{base_name}_h264.mp4"; final_extension = '.mp4'
-                ffmpeg_command = ['ffmpeg', '-i', downloaded_file_path, '-y'] + FFMPEG_COMPAT_ARGS + [converted_file_path]
-                logging.info(f"[{job_id}] FFmpeg Befehl: {' '.join(ffmpeg_command)}")
-                try:
-                    process = subprocess.run(ffmpeg_command, capture_output=True, text=True, check=True)
-                    logging.info(f"[{job_id}] FFmpeg Konvertierung erfolgreich abgeschlossen.")
-                    logging.debug(f"[{job_id}] FFmpeg stderr:\n{process.stderr}")
-                    status_callback("H.264 Konvertierung erfolgreich.")
-                    downloaded_file_path = converted_file_path
-                    actual_downloaded_filename = os.path.basename(downloaded_file_path)
-                    if original_download_path and os.path.exists(original_download_path) and original_download_path != downloaded_file_path:
-                        try: os.remove(original_download_path); logging.info(f"[{job_id}] Ursprüngliche Datei '{os.path.basename(original_download_path)}' nach Konvertierung gelöscht.")
-                        except OSError as del_err: logging.warning(f"[{job_id}] Konnte ursprüngliche Datei '{os.path.basename(original_download_path)}' nicht löschen: {del_err}")
-                except subprocess.CalledProcessError as e:
-                    error_msg = f"Fehler bei der H.264 Konvertierung mit FFmpeg."
-                    logging.error(f"[{job_id}] {error_msg} Rückgabecode: {e.returncode}")
-                    logging.error(f"[{job_id}] FFmpeg stderr:\n{e.stderr}")
-                    status_callback(f"{error_msg} Details im Log.")
-                    update_status(job_id, error=error_msg, running=False)
-                    # Aufräumen: Lösche die (möglicherweise unvollständige) konvertierte Datei
-                    if os.path.exists(converted_file_path):
-                        try:
-                            os.remove(converted_file_path)
-                        except OSError:
-                            pass
-                    return None, None, None
-                except Exception as e:
-                    error_msg = f"Allgemeiner Fehler während der FFmpeg Konvertierung: {e}"
-                    logging.exception(f"[{job_id}] {error_msg}") # Log traceback
-                    status_callback(error_msg)
-                    update_status(job_id, error=error_msg, running=False)
-                    # --- KORREKTUR HIER ---
-                    # Aufräumen
-                    if os.path.exists(converted_file_path):
-                        try: # Korrekt eingerückt
-                            os.remove(converted_file_path)
-                        except OSError: # Korrekt eingerückt
-                            pass # Korrekt eingerückt
-                    # --- ENDE KORREKTUR ---
-                    return None, None, None
-
+    except yt_dlp.utils.DownloadCancelled:
+        logging.info(f"[{job_id}] Download abgebrochen.")
+        update_status(job_id, error="Job wurde abgebrochen.", running=False)
+        return None, None, None
+    except PlatformThrottledError:
+        raise
     except yt_dlp.utils.DownloadError as e:
         err_str = strip_ansi_codes(str(e))
-        if "Unsupported URL" in err_str: error_msg = "Download-Fehler: Nicht unterstützte URL."
-        elif "Video unavailable" in err_str: error_msg = "Download-Fehler: Video nicht verfügbar."
-        elif "Private video" in err_str: error_msg = "Download-Fehler: Video ist privat."
-        elif "HTTP Error 403" in err_str: error_msg = "Download-Fehler: Zugriff verweigert (403)."
-        elif "HTTP Error 404" in err_str: error_msg = "Download-Fehler: Nicht gefunden (404)."
+        status = throttle_status(err_str)
+        if status == 429 or (status == 403 and retry_on_403):
+            logging.warning(f"[{job_id}] {platform} drosselt Anfragen (HTTP {status}): {err_str[:200]}")
+            raise PlatformThrottledError(platform, rate_limiter.penalize(platform, retry_after_from_error(e)), status) from e
+        error_category = "download_other"
+        if "Unsupported URL" in err_str: error_msg = "Download-Fehler: Nicht unterstützte URL."; error_category = "unsupported_url"
+        elif "Video unavailable" in err_str: error_msg = "Download-Fehler: Video nicht verfügbar."; error_category = "unavailable"
+        elif "Private video" in err_str: error_msg = "Download-Fehler: Video ist privat."; error_category = "private"
+        elif "HTTP Error 403" in err_str: error_msg = "Download-Fehler: Zugriff verweigert (403)."; error_category = "http_403"
+        elif "HTTP Error 404" in err_str: error_msg = "Download-Fehler: Nicht gefunden (404)."; error_category = "http_404"
         elif "Login is required" in err_str or "age-restricted" in err_str:
-             error_msg = "Download-Fehler: Inhalt erfordert Login oder ist altersbeschränkt."
+             error_msg = "Download-Fehler: Inhalt erfordert Login oder ist altersbeschränkt."; error_category = "login_required"
              if not ydl_opts.get('cookiefile'): error_msg += " (Cookie-Datei nicht konfiguriert)"
              else: error_msg += " (Cookie-Datei möglicherweise ungültig/abgelaufen)"
         elif "InstagramLoginRequiredError" in err_str:
-             error_msg = "Download-Fehler: Instagram erfordert Login für diesen Inhalt."
+             error_msg = "Download-Fehler: Instagram erfordert Login für diesen Inhalt."; error_category = "instagram_login"
              if not ydl_opts.get('cookiefile'): error_msg += " (Cookie-Datei nicht konfiguriert)"
         elif "TwitterLoginRequiredError" in err_str:
-             error_msg = "Download-Fehler: Twitter/X erfordert Login für diesen Inhalt."
+             error_msg = "Download-Fehler: Twitter/X erfordert Login für diesen Inhalt."; error_category = "twitter_login"
              if not ydl_opts.get('cookiefile'): error_msg += " (Cookie-Datei nicht konfiguriert)"
         else: error_msg = f"Download-Fehler: {err_str[:200]}"
+        METRIC_ERRORS.inc(category=error_category)
         status_callback(error_msg); logging.error(f"[{job_id}] Download-Fehler für {url}: {err_str}", exc_info=False)
-        update_status(job_id, error=error_msg, running=False)
+        if failure is not None and error_category == "download_other" and TRANSIENT_DOWNLOAD_ERROR_REGEX.search(err_str):
+            failure.update(transient=True, error=error_msg)
+        else: update_status(job_id, error=error_msg, running=False)
         return None, None, None
     except Exception as e:
         error_msg = f"Allgemeiner Fehler beim Download/Vorbereitung: {strip_ansi_codes(str(e))}"
         status_callback(error_msg); logging.exception(f"[{job_id}] {error_msg}") # Log traceback
-        update_status(job_id, error=error_msg, running=False)
+        if failure is not None and isinstance(e, OSError): failure.update(transient=True, error=error_msg)
+        else: update_status(job_id, error=error_msg, running=False)
         return None, None, None
 
     if downloaded_file_path:
@@ -402,420 +1635,2062 @@ def download_track(job_id, url, platform, format_preference, mp3_bitrate, mp4_qu
     return downloaded_file_path, track_title, final_extension
 
 
+def find_downloaded_file(result_info, output_path, possible_extensions):
+    """Endgültiger Pfad laut yt-dlp (`requested_downloads` nach der Nachbearbeitung).
+
+    Fehlt er (z.B. nach erneutem ydl.download), wird die größte passende Datei im
+    Job-Verzeichnis genommen, das nur Dateien dieses Jobs enthält.
+    """
+    for requested in reversed((result_info or {}).get('requested_downloads') or []):
+        path = requested.get('filepath')
+        if path and os.path.isfile(path): return path
+    with os.scandir(output_path) as entries:
+        candidates = [entry.path for entry in entries if entry.is_file() and os.path.splitext(entry.name)[1].lower() in possible_extensions]
+    return max(candidates, key=os.path.getsize) if candidates else None
+
+def job_work_dir(job_id):
+    """Eigenes Arbeitsverzeichnis je Job unterhalb von JOB_WORK_DIR."""
+    return os.path.join(JOB_WORK_DIR, job_id)
+
+def sweep_work_dir(min_age=0):
+    """Räumt verwaiste Job-Verzeichnisse und lose Dateien (.part, alte Downloads) auf.
+
+    Verzeichnisse von Jobs, die laut geteiltem Job-Backend noch laufen (anderer Worker), bleiben erhalten.
+    Mit `min_age` (periodischer Lauf) bleiben außerdem Einträge, die jünger sind, und die Verzeichnisse
+    lokal noch nicht abgeschlossener Jobs (z.B. zur Wiederholung eingereiht).
+    """
+    removed, freed_bytes = 0, 0
+    now = time.time()
+    with os.scandir(JOB_WORK_DIR) as entries:
+        for entry in list(entries):
+            try:
+                if min_age and (now - entry.stat(follow_symlinks=False).st_mtime < min_age
+                                or job_store.get_field(entry.name, "status", "error") not in ("completed", "error")): continue
+                if entry.is_dir(follow_symlinks=False):
+                    status = job_backend.get_status(entry.name) if job_backend.shared else None
+                    if status and status.get("status") not in ("completed", "error"): continue
+                    size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(entry.path) for name in names)
+                    shutil.rmtree(entry.path)
+                else:
+                    size = entry.stat(follow_symlinks=False).st_size
+                    os.remove(entry.path)
+                removed += 1; freed_bytes += size
+            except Exception as e:
+                logging.warning(f"Konnte '{entry.path}' beim Aufräumen nicht entfernen: {e}")
+    if removed: logging.info(f"Arbeitsverzeichnis aufgeräumt: {removed} verwaiste Einträge, {format_size(freed_bytes)} freigegeben.")
+
+
+# --- FFmpeg Hilfsfunktionen ---
+class JobCancelledError(Exception):
+    """Wird ausgelöst, wenn ein Job während der Verarbeitung abgebrochen wurde."""
+
+
+def probe_media(file_path):
+    """Liest Container, Dauer und Codec-Informationen (Video/Audio) einer Datei per ffprobe.
+
+    Gibt ein Dict mit 'duration', 'video' und 'audio' zurück (die Stream-Einträge
+    enthalten 'codec', 'profile' und 'pix_fmt') oder None, falls ffprobe fehlschlägt.
+    """
+    try:
+        result = subprocess.run(['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format',
+                                 '-show_entries', 'stream=codec_type,codec_name,profile,pix_fmt', file_path],
+                                capture_output=True, text=True, check=True, timeout=30)
+        data = json.loads(result.stdout or '{}')
+    except (FileNotFoundError, subprocess.SubprocessError, ValueError) as e:
+        logging.warning(f"Konnte '{os.path.basename(file_path)}' nicht mit ffprobe analysieren: {e}")
+        return None
+    probe = {"duration": None, "video": None, "audio": None}
+    try: probe["duration"] = float(data.get('format', {}).get('duration')) or None
+    except (TypeError, ValueError): pass
+    for stream in data.get('streams', []):
+        codec_type = stream.get('codec_type')
+        if codec_type in ("video", "audio") and probe[codec_type] is None:
+            probe[codec_type] = {"codec": stream.get('codec_name'), "profile": stream.get('profile'), "pix_fmt": stream.get('pix_fmt')}
+    return probe
+
+
+def choose_h264_strategy(probe):
+    """Wählt den günstigsten Weg zu einer kompatiblen H.264/AAC MP4.
+
+    'remux': Video und Audio passen bereits, nur Stream-Kopie mit +faststart.
+    'audio': Video passt, nur das Audio wird nach AAC kodiert.
+    'transcode': Vollständige Neukodierung mit FFMPEG_COMPAT_ARGS.
+    """
+    if not probe or not probe.get("video"): return "transcode"
+    video = probe["video"]; audio = probe.get("audio")
+    video_ok = (video.get("codec") == "h264" and video.get("pix_fmt") in H264_COMPAT_PIX_FMTS
+                and video.get("profile") in H264_COMPAT_PROFILES)
+    if not video_ok: return "transcode"
+    if audio is None or audio.get("codec") == "aac": return "remux"
+    return "audio"
+
+
+def run_ffmpeg(job_id, ffmpeg_args, duration=None, timeout=None, cancel_event=None, label="FFmpeg"):
+    """Führt FFmpeg aus und meldet den Fortschritt laufend an den Job.
+
+    Liest die Ausgabe von `-progress pipe:1` zeilenweise, rechnet `out_time`
+    gegen `duration` in Prozent um und behält von stderr nur die letzten
+    FFMPEG_STDERR_MAX_LINES Zeilen. Bei Überschreitung von `timeout` wird
+    subprocess.TimeoutExpired, bei gesetztem `cancel_event` JobCancelledError
+    und bei Rückgabecode != 0 subprocess.CalledProcessError ausgelöst.
+    """
+    command = ['ffmpeg', '-hide_banner', '-nostats', '-progress', 'pipe:1'] + list(ffmpeg_args)
+    logging.info(f"[{job_id}] FFmpeg Befehl: {' '.join(command)}")
+    progress_coalescer = ProgressCoalescer(job_id)
+    stderr_tail = deque(maxlen=FFMPEG_STDERR_MAX_LINES)
+    last_logged_percent = -1
+    abort_reason = None
+
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, errors='replace', bufsize=1)
+
+    def _drain_stderr():
+        for line in process.stderr: stderr_tail.append(line.rstrip())
+
+    finished = threading.Event() # Kein process.poll() im Watchdog: wait_with_rusage soll den Prozess einsammeln
+
+    def _watchdog():
+        nonlocal abort_reason
+        deadline = time.monotonic() + timeout if timeout else None
+        while not finished.is_set():
+            if cancel_event is not None and cancel_event.wait(0.5):
+                abort_reason = "cancelled"
+            elif cancel_event is None:
+                finished.wait(0.5)
+            if abort_reason is None and deadline is not None and time.monotonic() > deadline:
+                abort_reason = "timeout"
+            if abort_reason is not None:
+                if not finished.is_set(): process.kill()
+                return
+
+    stderr_thread = threading.Thread(target=_drain_stderr, daemon=True, name=f"FFmpegStderr-{job_id[:8]}")
+    watchdog_thread = threading.Thread(target=_watchdog, daemon=True, name=f"FFmpegWatchdog-{job_id[:8]}")
+    stderr_thread.start(); watchdog_thread.start()
+    try:
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key == 'out_time_us' and duration:
+                try: out_time = int(value) / 1_000_000
+                except ValueError: continue
+                percent = max(0.0, min(100.0, out_time * 100.0 / duration))
+                progress_coalescer.push(progress=percent)
+                if int(percent) - last_logged_percent >= FFMPEG_LOG_PROGRESS_STEP:
+                    last_logged_percent = int(percent)
+                    update_status(job_id, message=f"{label}: {last_logged_percent}%")
+            elif key == 'progress' and value == 'end':
+                progress_coalescer.push(progress=100.0)
+        wait_with_rusage(process)
+    finally:
+        finished.set()
+        if process.poll() is None: process.kill(); process.wait()
+        progress_coalescer.flush()
+        stderr_thread.join(timeout=5); watchdog_thread.join(timeout=5)
+
+    stderr_text = '\n'.join(stderr_tail)
+    if abort_reason == "cancelled":
+        raise JobCancelledError(f"{label} abgebrochen.")
+    if abort_reason == "timeout":
+        raise subprocess.TimeoutExpired(command, timeout, stderr=stderr_text)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr_text)
+    return stderr_text
+
+
+# --- H.264 Konvertierung (eigene Pipeline-Stufe) ---
+def convert_to_h264(job_id, downloaded_file_path, cancel_event=None):
+    """Konvertiert eine heruntergeladene Datei nach H.264/AAC. Gibt den neuen Pfad oder None bei Fehler zurück."""
+    status_callback = create_status_callback(job_id)
+    base_name, _ = os.path.splitext(downloaded_file_path)
+    converted_file_path = f"{base_name}_h264.mp4"
+    probe = probe_media(downloaded_file_path)
+    strategy = choose_h264_strategy(probe)
+    if probe:
+        video = probe.get("video") or {}; audio = probe.get("audio") or {}
+        logging.info(f"[{job_id}] ffprobe: Video={video.get('codec')}/{video.get('profile')}/{video.get('pix_fmt')}, Audio={audio.get('codec')}")
+    if strategy == "remux":
+        status_callback("Quelle ist bereits H.264/AAC: Umverpacken ohne Neukodierung (Stream-Kopie)...")
+        codec_args = FFMPEG_REMUX_ARGS
+    elif strategy == "audio":
+        status_callback("Video ist bereits H.264: Nur Audio wird nach AAC konvertiert...")
+        codec_args = FFMPEG_AUDIO_ONLY_ARGS
+    else:
+        status_callback("Starte H.264 Kompatibilitäts-Konvertierung (kann dauern)...")
+        codec_args = FFMPEG_COMPAT_ARGS + ['-threads', str(FFMPEG_THREADS_PER_JOB)]
+    logging.info(f"[{job_id}] Starte FFmpeg H.264 Kompatibilitäts-Schritt ({strategy}) für: {downloaded_file_path}")
+    ffmpeg_args = ['-i', downloaded_file_path, '-y'] + codec_args + [converted_file_path]
+    update_status(job_id, progress=0)
+    try:
+        stderr_tail = run_ffmpeg(job_id, ffmpeg_args, duration=probe.get("duration") if probe else None,
+                                 timeout=FFMPEG_TIMEOUT_SECONDS or None, cancel_event=cancel_event, label="H.264 Konvertierung")
+        logging.info(f"[{job_id}] FFmpeg Konvertierung ({strategy}) erfolgreich abgeschlossen.")
+        logging.debug(f"[{job_id}] FFmpeg stderr (Ende):\n{stderr_tail}")
+        status_callback(f"H.264 Konvertierung erfolgreich (Pfad: {strategy}).")
+        if os.path.exists(downloaded_file_path) and downloaded_file_path != converted_file_path:
+            try: os.remove(downloaded_file_path); logging.info(f"[{job_id}] Ursprüngliche Datei '{os.path.basename(downloaded_file_path)}' nach Konvertierung gelöscht.")
+            except OSError as del_err: logging.warning(f"[{job_id}] Konnte ursprüngliche Datei '{os.path.basename(downloaded_file_path)}' nicht löschen: {del_err}")
+        return converted_file_path
+    except subprocess.CalledProcessError as e:
+        error_msg = f"Fehler bei der H.264 Konvertierung mit FFmpeg."; METRIC_ERRORS.inc(category="transcode_failed")
+        logging.error(f"[{job_id}] {error_msg} Rückgabecode: {e.returncode}")
+        logging.error(f"[{job_id}] FFmpeg stderr (Ende):\n{e.stderr}")
+        status_callback(f"{error_msg} Details im Log.")
+        update_status(job_id, error=error_msg, running=False)
+    except subprocess.TimeoutExpired as e:
+        error_msg = f"H.264 Konvertierung nach {FFMPEG_TIMEOUT_SECONDS}s abgebrochen (Zeitlimit)."; METRIC_ERRORS.inc(category="transcode_timeout")
+        logging.error(f"[{job_id}] {error_msg}")
+        logging.error(f"[{job_id}] FFmpeg stderr (Ende):\n{e.stderr}")
+        status_callback(error_msg)
+        update_status(job_id, error=error_msg, running=False)
+    except JobCancelledError:
+        error_msg = "Job wurde abgebrochen."
+        logging.info(f"[{job_id}] H.264 Konvertierung abgebrochen.")
+        update_status(job_id, error=error_msg, running=False)
+    except Exception as e:
+        error_msg = f"Allgemeiner Fehler während der FFmpeg Konvertierung: {e}"; METRIC_ERRORS.inc(category="transcode_other")
+        logging.exception(f"[{job_id}] {error_msg}") # Log traceback
+        status_callback(error_msg)
+        update_status(job_id, error=error_msg, running=False)
+    # Aufräumen: Lösche die (möglicherweise unvollständige) konvertierte Datei
+    if os.path.exists(converted_file_path):
+        try:
+            os.remove(converted_file_path)
+        except OSError:
+            pass
+    return None
+
+
+# --- S3 Client Cache ---
+# boto3 Clients sind thread-sicher, ihre Erstellung (Credentials, Endpoint-Auflösung,
+# Laden der Service-Modelle) aber teuer. Daher ein Client pro Konfiguration für den ganzen Prozess.
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+def get_s3_client(aws_access_key_id, aws_secret_access_key, region_name, endpoint_url=None):
+    secret_hash = hashlib.sha256((aws_secret_access_key or '').encode('utf-8')).hexdigest()
+    cache_key = (endpoint_url, region_name, aws_access_key_id, secret_hash)
+    s3_client = _s3_clients.get(cache_key)
+    if s3_client is not None: return s3_client
+    with _s3_clients_lock:
+        s3_client = _s3_clients.get(cache_key)
+        if s3_client is None:
+            s3_client_args = { 'aws_access_key_id': aws_access_key_id, 'aws_secret_access_key': aws_secret_access_key, 'region_name': region_name }
+            if endpoint_url: s3_client_args['endpoint_url'] = endpoint_url
+            client_config = BotoConfig(max_pool_connections=S3_MAX_POOL_CONNECTIONS, tcp_keepalive=True)
+            # Sessions sind nicht thread-sicher, daher eigene Session unter dem Lock
+            s3_client = boto3.session.Session().client('s3', config=client_config, **s3_client_args)
+            _s3_clients[cache_key] = s3_client
+            logging.info(f"Neuer S3 Client erstellt (Endpoint={endpoint_url or 'Default'}, Region={region_name}, Pool={S3_MAX_POOL_CONNECTIONS}).")
+    return s3_client
+
+
+# --- Eindeutige Objektnamen: bedingter Upload (If-None-Match: *) oder HEAD-Probe ---
+class ObjectNameTakenError(Exception):
+    """Bedingter Upload abgelehnt: Unter dem Namen liegt bereits ein Objekt."""
+
+class ConditionalWriteUnsupportedError(Exception):
+    """Der S3 Anbieter lehnt bedingte Uploads (If-None-Match) ab."""
+
+_conditional_write_unsupported = set() # Endpoints, die If-None-Match mit 'NotImplemented' ablehnen
+
+def use_conditional_writes(endpoint_url):
+    if S3_CONDITIONAL_WRITES == 'auto': return (endpoint_url or '') not in _conditional_write_unsupported
+    return S3_CONDITIONAL_WRITES == 'true'
+
+def mark_conditional_writes_unsupported(endpoint_url):
+    if S3_CONDITIONAL_WRITES == 'auto': _conditional_write_unsupported.add(endpoint_url or '')
+
+def probe_s3_name(job_id, s3_client, bucket_name, object_name):
+    """HEAD-Probe: True, wenn unter dem Namen noch kein Objekt liegt."""
+    try:
+        with timed_phase("s3_name_probe"): s3_client.head_object(Bucket=bucket_name, Key=object_name)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+            METRIC_S3_NAME_CHECKS.inc(method="probe", result="free")
+            return True
+        raise
+    METRIC_S3_NAME_CHECKS.inc(method="probe", result="taken")
+    logging.warning(f"[{job_id}] S3 Name '{object_name}' existiert bereits.")
+    return False
+
+def raise_for_conditional_write(error):
+    """Übersetzt die Fehler eines bedingten Uploads (412/409 bzw. 501) in eigene Ausnahmen."""
+    error_code = error.response.get('Error', {}).get('Code', '')
+    if error_code in ('PreconditionFailed', '412', 'ConditionalRequestConflict', '409'): raise ObjectNameTakenError(str(error)) from error
+    if error_code in ('NotImplemented', '501'): raise ConditionalWriteUnsupportedError(str(error)) from error
+
+
+# --- Multipart Upload mit Fortschritt ---
+class UploadProgress:
+    """Zählt hochgeladene Bytes (thread-sicher) und meldet Fortschritt und Durchsatz an den Job.
+
+    Der Upload belegt den Bereich `progress_start`..`progress_end` des Fortschrittsbalkens.
+    """
+
+    def __init__(self, job_id, total_bytes, progress_start=50.0, progress_end=100.0):
+        self.job_id = job_id
+        self.total_bytes = total_bytes
+        self.progress_start = progress_start
+        self.progress_end = progress_end
+        self.uploaded_bytes = 0
+        self.start_time = time.monotonic()
+        self._last_logged_percent = -1
+        self._lock = threading.Lock()
+        self._coalescer = ProgressCoalescer(job_id)
+        job_store.set_fields(job_id, uploaded_bytes=0, total_bytes=total_bytes, speed=None, eta=None)
+
+    def __call__(self, bytes_amount):
+        METRIC_UPLOADED_BYTES.inc(bytes_amount)
+        with self._lock:
+            self.uploaded_bytes += bytes_amount
+            uploaded = self.uploaded_bytes
+        elapsed = max(time.monotonic() - self.start_time, 1e-6)
+        speed = uploaded / elapsed
+        if not self.total_bytes:
+            # Unbekannte Gesamtgröße (Streaming): nur Bytes und Durchsatz melden
+            self._coalescer.push(uploaded_bytes=uploaded, speed=speed)
+            if uploaded // UPLOAD_LOG_BYTES_STEP > self._last_logged_percent:
+                self._last_logged_percent = uploaded // UPLOAD_LOG_BYTES_STEP
+                update_status(self.job_id, message=f"Upload: {format_size(uploaded)} @ {format_size(speed)}/s")
+            return
+        percent = min(100.0, uploaded * 100.0 / self.total_bytes)
+        eta = int((self.total_bytes - uploaded) / speed) if speed > 0 else None
+        self._coalescer.push(progress=self.progress_start + (self.progress_end - self.progress_start) * percent / 100.0,
+                             uploaded_bytes=uploaded, speed=speed, eta=eta)
+        if int(percent) - self._last_logged_percent >= UPLOAD_LOG_PROGRESS_STEP:
+            self._last_logged_percent = int(percent)
+            update_status(self.job_id, message=f"Upload: {self._last_logged_percent}% von {format_size(self.total_bytes)} @ {format_size(speed)}/s")
+
+    def flush(self):
+        self._coalescer.flush()
+
+
+def _upload_part_with_retry(job_id, s3_client, bucket_name, object_name, upload_id, part_number, read_body, size,
+                            progress=None, cancel_event=None, abort_event=None):
+    """Lädt einen Teil hoch und wiederholt nur diesen Teil bei Fehlern (exponentielles Backoff).
+
+    `read_body` liefert die Bytes des Teils (aus der Datei oder aus dem Puffer beim Streaming).
+    """
+    for attempt in range(1, S3_PART_MAX_ATTEMPTS + 1):
+        if cancel_event is not None and cancel_event.is_set():
+            raise JobCancelledError("Upload abgebrochen.")
+        if abort_event is not None and abort_event.is_set():
+            raise RuntimeError(f"Teil {part_number} übersprungen, Upload wird abgebrochen.")
+        try:
+            response = s3_client.upload_part(Bucket=bucket_name, Key=object_name, UploadId=upload_id,
+                                             PartNumber=part_number, Body=read_body())
+            if progress: progress(size)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        except (ClientError, BotoCoreError, OSError) as e:
+            if attempt >= S3_PART_MAX_ATTEMPTS: raise
+            delay = min(30.0, 2 ** attempt) + random.uniform(0, 1)
+            logging.warning(f"[{job_id}] Upload von Teil {part_number} fehlgeschlagen (Versuch {attempt}/{S3_PART_MAX_ATTEMPTS}), neuer Versuch in {delay:.1f}s: {e}")
+            if cancel_event is None: time.sleep(delay)
+            elif cancel_event.wait(delay): raise JobCancelledError("Upload abgebrochen.") # Abbruch beendet das Warten sofort
+
+
+def _read_file_range(file_path, offset, size):
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _read_chunk(reader, size):
+    """Liest genau `size` Bytes aus einem Stream (weniger nur am Ende des Streams)."""
+    buffer = bytearray()
+    while len(buffer) < size:
+        data = reader.read(size - len(buffer))
+        if not data: break
+        buffer += data
+    return bytes(buffer)
+
+
+def multipart_upload_file(job_id, s3_client, file_path, bucket_name, object_name, extra_args, progress=None, cancel_event=None,
+                          complete_args=None):
+    """Lädt eine Datei in parallelen Teilen hoch. Fehlgeschlagene Teile werden einzeln wiederholt,
+    bereits hochgeladene Teile bleiben erhalten. Bei endgültigem Fehler wird der Upload abgebrochen.
+    `complete_args` gehen an CompleteMultipartUpload (z.B. IfNoneMatch)."""
+    file_size = os.path.getsize(file_path)
+    part_size = max(S3_MULTIPART_CHUNKSIZE, math.ceil(file_size / S3_MAX_PARTS))
+    parts = [(number, offset, min(part_size, file_size - offset))
+             for number, offset in enumerate(range(0, file_size, part_size), start=1)]
+    upload_id = s3_client.create_multipart_upload(Bucket=bucket_name, Key=object_name, **extra_args)['UploadId']
+    logging.info(f"[{job_id}] Multipart Upload gestartet: {len(parts)} Teile à {format_size(part_size)}, {S3_MAX_CONCURRENCY} parallel.")
+    abort_event = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY, thread_name_prefix=f"S3Part-{job_id[:8]}") as executor:
+            futures = [executor.submit(_upload_part_with_retry, job_id, s3_client, bucket_name, object_name, upload_id,
+                                       number, functools.partial(_read_file_range, file_path, offset, size), size,
+                                       progress, cancel_event, abort_event)
+                       for number, offset, size in parts]
+            try:
+                completed_parts = [future.result() for future in futures]
+            except BaseException:
+                abort_event.set() # Restliche Teile nicht mehr starten
+                raise
+        s3_client.complete_multipart_upload(Bucket=bucket_name, Key=object_name, UploadId=upload_id,
+                                            MultipartUpload={'Parts': completed_parts}, **(complete_args or {}))
+    except BaseException:
+        try: s3_client.abort_multipart_upload(Bucket=bucket_name, Key=object_name, UploadId=upload_id)
+        except Exception as abort_e: logging.warning(f"[{job_id}] Konnte Multipart Upload nicht abbrechen: {abort_e}")
+        raise
+
+
+class FFmpegStreamReader:
+    """Liest die Ausgabe eines FFmpeg-Prozesses (stdout) als Datenstrom.
+
+    Am Ende des Stroms wird der Rückgabecode geprüft, damit ein abgebrochener
+    FFmpeg-Lauf nicht als vollständige Datei hochgeladen wird.
+    """
+
+    def __init__(self, job_id, command):
+        self.command = command
+        self.stderr_tail = deque(maxlen=FFMPEG_STDERR_MAX_LINES)
+        self.process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True, name=f"FFmpegStderr-{job_id[:8]}")
+        self._stderr_thread.start()
+
+    def _drain_stderr(self):
+        for line in self.process.stderr: self.stderr_tail.append(line.decode('utf-8', 'replace').rstrip())
+
+    def read(self, size):
+        data = self.process.stdout.read(size)
+        if not data:
+            wait_with_rusage(self.process); self._stderr_thread.join(timeout=5)
+            if self.process.returncode != 0:
+                raise subprocess.CalledProcessError(self.process.returncode, self.command, stderr='\n'.join(self.stderr_tail))
+        return data
+
+    def close(self):
+        if self.process.poll() is None: self.process.kill()
+        self.process.wait(); self.process.stdout.close()
+
+
+@contextlib.contextmanager
+def open_stream_source(job_id, stream_source):
+    """Öffnet die von get_stream_source beschriebene Quelle als lesbaren Datenstrom."""
+    if stream_source['kind'] == 'ffmpeg_mp3':
+        command = ['ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'error']
+        if stream_source['http_headers']:
+            command += ['-headers', ''.join(f"{k}: {v}\r\n" for k, v in stream_source['http_headers'].items())]
+        command += ['-i', stream_source['url'], '-vn']
+        if stream_source['mp3_bitrate'] != "Best": command += ['-b:a', stream_source['mp3_bitrate']]
+        elif stream_source['acodec'] == 'mp3': command += ['-c:a', 'copy']
+        else: command += ['-q:a', '0']
+        command += ['-f', 'mp3', 'pipe:1']
+        logging.info(f"[{job_id}] FFmpeg Streaming-Befehl: ffmpeg ... -i <URL> {' '.join(command[command.index('-vn'):])}")
+        reader = FFmpegStreamReader(job_id, command)
+        try: yield reader
+        finally: reader.close()
+    else:
+        ydl_opts = {'quiet': True, 'no_color': True, 'cookiefile': stream_source.get('cookiefile'),
+                    'logger': logging.getLogger('yt_dlp')}
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            response = ydl.urlopen(yt_dlp.networking.Request(stream_source['url'], headers=stream_source['http_headers']))
+            try: yield response
+            finally: response.close()
+
+
+class HashingReader:
+    """Berechnet beim Lesen den SHA-256 des Datenstroms (für den Dedup-Cache)."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size):
+        data = self.reader.read(size)
+        self.sha256.update(data)
+        return data
+
+
+def stream_upload_to_s3(job_id, s3_client, reader, bucket_name, object_name, extra_args, progress=None, cancel_event=None,
+                        complete_args=None):
+    """Lädt einen Datenstrom unbekannter Länge hoch, ohne ihn lokal zu speichern.
+
+    Kleine Ströme (unter einer Teilgröße) gehen per PutObject hoch, größere als Multipart Upload.
+    Es sind höchstens S3_MAX_CONCURRENCY Teile gleichzeitig im Speicher. `complete_args` gehen an
+    PutObject bzw. CompleteMultipartUpload. Gibt die Anzahl Bytes zurück.
+    """
+    part_size = S3_MULTIPART_CHUNKSIZE
+    chunk = _read_chunk(reader, part_size)
+    if len(chunk) < part_size:
+        s3_client.put_object(Bucket=bucket_name, Key=object_name, Body=chunk, **extra_args, **(complete_args or {}))
+        if progress: progress(len(chunk))
+        return len(chunk)
+
+    upload_id = s3_client.create_multipart_upload(Bucket=bucket_name, Key=object_name, **extra_args)['UploadId']
+    logging.info(f"[{job_id}] Streaming Multipart Upload gestartet: Teile à {format_size(part_size)}, {S3_MAX_CONCURRENCY} parallel.")
+    abort_event = threading.Event()
+    slots = threading.BoundedSemaphore(S3_MAX_CONCURRENCY)
+    total_bytes = 0
+
+    def _on_part_done(future):
+        slots.release()
+        if not future.cancelled() and future.exception() is not None: abort_event.set()
+
+    try:
+        with ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY, thread_name_prefix=f"S3Part-{job_id[:8]}") as executor:
+            futures = []
+            try:
+                while chunk and not abort_event.is_set():
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise JobCancelledError("Upload abgebrochen.")
+                    if len(futures) >= S3_MAX_PARTS:
+                        raise RuntimeError(f"Stream überschreitet {S3_MAX_PARTS} Teile à {format_size(part_size)}.")
+                    slots.acquire() # Begrenzt den Speicherbedarf auf S3_MAX_CONCURRENCY Teile
+                    future = executor.submit(_upload_part_with_retry, job_id, s3_client, bucket_name, object_name, upload_id,
+                                             len(futures) + 1, functools.partial(bytes, chunk), len(chunk),
+                                             progress, cancel_event, abort_event)
+                    future.add_done_callback(_on_part_done)
+                    futures.append(future); total_bytes += len(chunk)
+                    chunk = _read_chunk(reader, part_size)
+                completed_parts = [future.result() for future in futures]
+            except BaseException:
+                abort_event.set() # Restliche Teile nicht mehr starten
+                raise
+        s3_client.complete_multipart_upload(Bucket=bucket_name, Key=object_name, UploadId=upload_id,
+                                            MultipartUpload={'Parts': completed_parts}, **(complete_args or {}))
+    except BaseException:
+        try: s3_client.abort_multipart_upload(Bucket=bucket_name, Key=object_name, UploadId=upload_id)
+        except Exception as abort_e: logging.warning(f"[{job_id}] Konnte Multipart Upload nicht abbrechen: {abort_e}")
+        raise
+    return total_bytes
+
+
+def get_content_type(file_extension):
+    lowered_extension = file_extension.lower()
+    if lowered_extension == '.mp4': return 'video/mp4'
+    elif lowered_extension == '.mp3': return 'audio/mpeg'
+    elif lowered_extension in ['.mov']: return 'video/quicktime'
+    elif lowered_extension in ['.avi']: return 'video/x-msvideo'
+    elif lowered_extension in ['.webm']: return 'video/webm'
+    return 'application/octet-stream'
+
+
 # --- upload_to_s3 mit verbessertem Logging ---
-def upload_to_s3(job_id, file_path, object_name, file_extension, bucket_name, aws_access_key_id, aws_secret_access_key, region_name, endpoint_url=None):
+def upload_to_s3(job_id, file_path, object_name, file_extension, bucket_name, aws_access_key_id, aws_secret_access_key, region_name, endpoint_url=None, cancel_event=None, stream_source=None, if_none_match=False,
+                 failure=None):
+    """Lädt `file_path` hoch oder, wenn `stream_source` gesetzt ist, die Quelle direkt als Datenstrom.
+    Beim Streaming werden Größe und SHA-256 in stream_source['uploaded_bytes'] / ['content_hash'] abgelegt.
+    Mit `if_none_match` wird nur geschrieben, wenn der Name frei ist; sonst ObjectNameTakenError
+    (bzw. ConditionalWriteUnsupportedError, wenn der Anbieter das nicht kann).
+    Ist `failure` ein Dict, werden vorübergehende Fehler (5xx, SlowDown, Verbindung) dort abgelegt statt den Job scheitern zu lassen."""
     status_callback = create_status_callback(job_id)
-    logging.info(f"[{job_id}] Starte upload_to_s3 für Datei: {file_path}")
+    logging.info(f"[{job_id}] Starte upload_to_s3 für {'Stream' if stream_source else 'Datei'}: {file_path or stream_source['kind']}")
 
-    if not file_path or not os.path.exists(file_path):
+    if stream_source is None and (not file_path or not os.path.exists(file_path)):
         error_msg = f"Upload-Fehler: Lokale Quelldatei nicht gefunden: '{file_path}'";
         status_callback(error_msg); logging.error(f"[{job_id}] {error_msg}")
         update_status(job_id, error=error_msg, running=False)
         return False
 
-    content_type = 'application/octet-stream'; lowered_extension = file_extension.lower()
-    if lowered_extension == '.mp4': content_type = 'video/mp4'
-    elif lowered_extension == '.mp3': content_type = 'audio/mpeg'
-    elif lowered_extension in ['.mov']: content_type = 'video/quicktime'
-    elif lowered_extension in ['.avi']: content_type = 'video/x-msvideo'
-    elif lowered_extension in ['.webm']: content_type = 'video/webm'
-
+    content_type = get_content_type(file_extension)
     provider = "AWS S3" if not endpoint_url else "S3-kompatiblen Speicher"
-    status_callback(f"Starte Upload von '{os.path.basename(file_path)}' ({content_type}) zu {provider} Bucket '{bucket_name}' als '{object_name}'...")
+    source_name = os.path.basename(file_path) if file_path else "Stream"
+    status_callback(f"Starte Upload von '{source_name}' ({content_type}) zu {provider} Bucket '{bucket_name}' als '{object_name}'...")
     logging.info(f"[{job_id}] Upload Parameter: Bucket={bucket_name}, Key={object_name}, ContentType={content_type}, Endpoint={endpoint_url or 'Default'}")
 
-    s3_client_args = { 'aws_access_key_id': aws_access_key_id, 'aws_secret_access_key': aws_secret_access_key, 'region_name': region_name }
-    if endpoint_url: s3_client_args['endpoint_url'] = endpoint_url
-
     try:
-        s3_client = boto3.client('s3', **s3_client_args)
+        s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key, region_name, endpoint_url)
         extra_args = {'ContentType': content_type}
-        logging.info(f"[{job_id}] Rufe s3_client.upload_file auf...")
-        response = s3_client.upload_file(file_path, bucket_name, object_name, ExtraArgs=extra_args)
-        success_msg = f"Upload erfolgreich abgeschlossen!";
+        complete_args = {'IfNoneMatch': '*'} if if_none_match else {}
+        if stream_source is not None:
+            progress = UploadProgress(job_id, stream_source.get('filesize'))
+            with open_stream_source(job_id, stream_source) as reader:
+                reader = HashingReader(reader)
+                file_size = stream_upload_to_s3(job_id, s3_client, reader, bucket_name, object_name, extra_args,
+                                                progress=progress, cancel_event=cancel_event, complete_args=complete_args)
+            stream_source['uploaded_bytes'] = file_size
+            stream_source['content_hash'] = reader.sha256.hexdigest()
+        else:
+            file_size = os.path.getsize(file_path)
+            progress = UploadProgress(job_id, file_size)
+            if file_size >= S3_MULTIPART_THRESHOLD:
+                multipart_upload_file(job_id, s3_client, file_path, bucket_name, object_name, extra_args,
+                                      progress=progress, cancel_event=cancel_event, complete_args=complete_args)
+            elif if_none_match: # upload_file reicht If-None-Match nicht durch
+                with open(file_path, 'rb') as f:
+                    s3_client.put_object(Bucket=bucket_name, Key=object_name, Body=f, **extra_args, **complete_args)
+                progress(file_size)
+            else:
+                logging.info(f"[{job_id}] Rufe s3_client.upload_file auf...")
+                s3_client.upload_file(file_path, bucket_name, object_name, ExtraArgs=extra_args, Callback=progress,
+                                      Config=TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD, use_threads=False))
+        progress.flush()
+        elapsed = max(time.monotonic() - progress.start_time, 1e-6)
+        success_msg = f"Upload erfolgreich abgeschlossen! ({format_size(file_size)} in {elapsed:.1f}s, {format_size(file_size / elapsed)}/s)";
         status_callback(success_msg); logging.info(f"[{job_id}] {success_msg}")
         return True
+    except JobCancelledError:
+        error_msg = "Job wurde abgebrochen."
+        logging.info(f"[{job_id}] Upload abgebrochen.")
+        update_status(job_id, error=error_msg, running=False)
+        return False
     except NoCredentialsError:
-        error_msg = "S3 Upload Fehler: AWS Credentials nicht gefunden oder ungültig.";
+        error_msg = "S3 Upload Fehler: AWS Credentials nicht gefunden oder ungültig."; METRIC_ERRORS.inc(category="s3_credentials")
         status_callback(error_msg); logging.error(f"[{job_id}] {error_msg}")
         update_status(job_id, error=error_msg, running=False)
         return False
     except ClientError as e:
+        if if_none_match: raise_for_conditional_write(e)
         error_code = e.response.get('Error', {}).get('Code', 'Unknown')
         error_message = e.response.get('Error', {}).get('Message', 'Keine Details')
         full_error = strip_ansi_codes(str(e))
-        error_msg = f"S3 Client Fehler beim Upload (Code: {error_code}): {error_message}";
+        error_msg = f"S3 Client Fehler beim Upload (Code: {error_code}): {error_message}"; METRIC_ERRORS.inc(category="s3_client_error")
         status_callback(error_msg); logging.error(f"[{job_id}] {error_msg} - Volle Fehlermeldung: {full_error}", exc_info=False)
-        update_status(job_id, error=error_msg, running=False)
+        http_status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        if failure is not None and (http_status >= 500 or error_code in ('SlowDown', 'RequestTimeout', 'InternalError', 'ServiceUnavailable')):
+            failure.update(transient=True, error=error_msg)
+        else: update_status(job_id, error=error_msg, running=False)
         return False
     except Exception as e:
-        error_msg = f"Allgemeiner Fehler beim S3 Upload: {strip_ansi_codes(str(e))}";
+        error_msg = f"Allgemeiner Fehler beim S3 Upload: {strip_ansi_codes(str(e))}"; METRIC_ERRORS.inc(category="upload_other")
         status_callback(error_msg);
         logging.error(f"[{job_id}] {error_msg}", exc_info=True)
-        update_status(job_id, error=error_msg, running=False)
+        if failure is not None and isinstance(e, (BotoCoreError, OSError)): failure.update(transient=True, error=error_msg)
+        else: update_status(job_id, error=error_msg, running=False)
         return False
 
-# --- History Funktionen (Backend - unverändert) ---
-def load_history():
-    if not ENABLE_HISTORY: return []
-    try:
-        if os.path.exists(HISTORY_FILE):
-            if os.path.getsize(HISTORY_FILE) == 0: logging.warning(f"{HISTORY_FILE} ist leer."); return []
-            with open(HISTORY_FILE, 'r', encoding='utf-8') as f: history = json.load(f)
-            return history if isinstance(history, list) else []
-        else: return []
-    except json.JSONDecodeError as e: logging.error(f"Fehler Laden History (JSON ungültig): {e}."); return []
-    except Exception as e: logging.error(f"Fehler Laden History (Allgemein): {e}"); return []
-
-def save_history(history_data):
-    if not ENABLE_HISTORY: return True
+# --- History (SQLite/WAL, Index auf source_url) ---
+HISTORY_FIELDS = ("timestamp", "platform", "title", "source_url", "s3_url")
+
+class HistoryStore:
+    """Verlauf als Append-only Tabelle. Neue Einträge haben die höchste ID (neueste zuerst = ORDER BY id DESC)."""
+
+    def __init__(self, path):
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, platform TEXT,
+                title TEXT, source_url TEXT, s3_url TEXT);
+            CREATE INDEX IF NOT EXISTS idx_history_source_url ON history (source_url);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        # Seiten-Cache für /history. Die Version liegt in `meta` und wird in jeder Schreibtransaktion
+        # erhöht, damit alle Gunicorn-Worker Änderungen sehen und dieselben ETags liefern.
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)", (uuid.uuid4().hex[:8],))
+        self._epoch = self._conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0] # Neue DB: alte ETags ungültig
+        self.version = 0
+        self._page_cache = OrderedDict()
+        self._refresh_version()
+
+    def migrate_json(self, json_path):
+        """Übernimmt einmalig den alten JSON-Verlauf. Die JSON-Datei bleibt unverändert liegen."""
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone(): return 0
+        entries = []
+        if os.path.exists(json_path) and os.path.getsize(json_path) > 0:
+            with open(json_path, 'r', encoding='utf-8') as f: entries = json.load(f)
+            if not isinstance(entries, list): entries = []
+        rows = [(e.get('timestamp') or '', e.get('platform'), e.get('title'), e.get('source_url') or e.get('soundcloud_url'), e.get('s3_url'))
+                for e in reversed(entries) if isinstance(e, dict)] # JSON: neueste zuerst
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Erneut in der Transaktion prüfen: mehrere Gunicorn-Worker können gleichzeitig starten
+                if self._conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                    self._conn.execute("ROLLBACK")
+                    return 0
+                self._conn.executemany("INSERT INTO history (timestamp, platform, title, source_url, s3_url) VALUES (?, ?, ?, ?, ?)", rows)
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (datetime.now().isoformat(),))
+                self._bump_version()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK"); raise
+        return len(rows)
+
+    def add(self, platform, title, source_url, s3_url):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._write("INSERT INTO history (timestamp, platform, title, source_url, s3_url) VALUES (?, ?, ?, ?, ?)",
+                        (timestamp, platform, title, source_url, s3_url))
+
+    def _write(self, sql, params=()):
+        """Führt eine Änderung zusammen mit der Versionserhöhung in einer Transaktion aus (Lock halten)."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(sql, params)
+            self._bump_version()
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK"); raise
+
+    def _bump_version(self):
+        self._conn.execute("INSERT INTO meta (key, value) VALUES ('version', 1) ON CONFLICT(key) DO UPDATE SET value = value + 1")
+
+    def _refresh_version(self):
+        """Liest die Version aus der DB und verwirft den Seiten-Cache, falls sie sich geändert hat (Lock halten)."""
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        version = int(row[0]) if row else 0
+        if version != self.version:
+            self.version = version
+            self._page_cache.clear()
+        return version
+
+    def page(self, limit=None, offset=0, before_id=None, platform=None, since=None, until=None):
+        """Einträge neueste zuerst. `before_id` ist der Cursor (ID des letzten Eintrags der Vorseite),
+        `since`/`until` filtern nach Zeitstempel ('YYYY-MM-DD' oder 'YYYY-MM-DD HH:MM:SS')."""
+        conditions = []; params = []
+        if before_id is not None: conditions.append("id < ?"); params.append(before_id)
+        if platform: conditions.append("platform = ?"); params.append(platform)
+        if since: conditions.append("timestamp >= ?"); params.append(since)
+        if until: conditions.append("timestamp <= ?"); params.append(until + " 23:59:59" if len(until) == 10 else until)
+        query = "SELECT id, timestamp, platform, title, source_url, s3_url FROM history"
+        if conditions: query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id DESC"
+        if limit is not None: query += " LIMIT ? OFFSET ?"; params += [limit, offset]
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(zip(("id",) + HISTORY_FIELDS, row)) for row in rows]
+
+    def page_response(self, limit, offset=0, before_id=None, platform=None, since=None, until=None):
+        """Gibt (ETag, JSON-Body) einer Seite zurück. Seiten werden bis zur nächsten Änderung im Speicher gehalten."""
+        cache_key = (limit, offset, before_id, platform, since, until)
+        with self._lock:
+            version = self._refresh_version()
+            cached = self._page_cache.get(cache_key)
+            if cached is not None:
+                self._page_cache.move_to_end(cache_key)
+                return cached
+        entries = self.page(limit + 1, offset, before_id, platform, since, until) # +1: Gibt es eine weitere Seite?
+        has_more = len(entries) > limit; entries = entries[:limit]
+        body = json.dumps({"entries": entries, "next_cursor": entries[-1]["id"] if has_more else None}, ensure_ascii=False)
+        etag = self._etag(version, cache_key)
+        with self._lock:
+            if version == self.version: # Zwischenzeitlich geschrieben? Dann nicht cachen.
+                self._page_cache[cache_key] = (etag, body)
+                if len(self._page_cache) > HISTORY_PAGE_CACHE_ENTRIES: self._page_cache.popitem(last=False)
+        return etag, body
+
+    def current_etag(self, limit, offset=0, before_id=None, platform=None, since=None, until=None):
+        with self._lock: version = self._refresh_version()
+        return self._etag(version, (limit, offset, before_id, platform, since, until))
+
+    def _etag(self, version, cache_key):
+        return f"h{self._epoch}-{version}-" + hashlib.sha1(repr(cache_key).encode()).hexdigest()[:12]
+
+    def find_by_source_url(self, source_url):
+        with self._lock:
+            row = self._conn.execute("SELECT timestamp, platform, title, source_url, s3_url FROM history WHERE source_url = ? ORDER BY id DESC LIMIT 1",
+                                     (source_url,)).fetchone()
+        return dict(zip(HISTORY_FIELDS, row)) if row else None
+
+    def clear(self):
+        with self._lock:
+            self._write("DELETE FROM history")
+
+
+history_store = None
+if ENABLE_HISTORY:
     try:
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f: json.dump(history_data, f, indent=4, ensure_ascii=False)
-        logging.info(f"History gespeichert: {HISTORY_FILE}")
-        return True
-    except Exception as e: logging.error(f"Fehler Speichern History: {e}"); return False
+        history_store = HistoryStore(HISTORY_DB_PATH)
+        migrated = history_store.migrate_json(HISTORY_FILE)
+        if migrated: logging.info(f"{migrated} Einträge aus {HISTORY_FILE} nach {HISTORY_DB_PATH} übernommen.")
+    except (sqlite3.Error, OSError, json.JSONDecodeError) as e:
+        logging.error(f"History-Datenbank konnte nicht geöffnet/migriert werden ({HISTORY_DB_PATH}): {e}")
+        history_store = None
 
 def add_history_entry(platform, title, source_url, s3_url):
     if not ENABLE_HISTORY: return True
-    history = load_history()
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    entry = {"timestamp": timestamp, "platform": platform, "title": title, "source_url": source_url, "s3_url": s3_url}
-    history.insert(0, entry)
-    return save_history(history)
+    if history_store is None: return False
+    try:
+        history_store.add(platform, title, source_url, s3_url)
+        return True
+    except sqlite3.Error as e: logging.error(f"Fehler Speichern History: {e}"); return False
 
 def clear_history_file():
      if not ENABLE_HISTORY: return True
+     if history_store is None: return False
      try:
-          if os.path.exists(HISTORY_FILE): os.remove(HISTORY_FILE); logging.info("History-Datei gelöscht.")
+          history_store.clear(); logging.info("History gelöscht.")
           return True
-     except Exception as e: logging.error(f"Fehler Löschen History-Datei: {e}"); return False
-
-# --- Statistik Funktionen (Backend - unverändert) ---
-def load_stats():
-    default_stats = {'total_jobs': 0, 'successful_jobs': 0, 'total_duration_seconds': 0.0, 'total_size_bytes': 0}
+     except sqlite3.Error as e: logging.error(f"Fehler Löschen History: {e}"); return False
+
+# --- Prometheus Metriken (/metrics, Textformat ohne zusätzliche Abhängigkeit) ---
+METRICS_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+METRICS_REGISTRY = []
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs: return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class MetricCounter:
+    def __init__(self, name, help_text, label_names=(), metric_type="counter"):
+        self.name = name; self.help_text = help_text; self.label_names = tuple(label_names)
+        self.metric_type = metric_type
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS_REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock: self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock: return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        values = self.collect()
+        if not values and not self.label_names: values = {(): 0}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class MetricGauge(MetricCounter):
+    """Gauge mit inc/dec oder einer `collect`-Funktion, die beim Abruf {Label-Tupel: Wert} liefert."""
+
+    def __init__(self, name, help_text, label_names=(), collect=None):
+        super().__init__(name, help_text, label_names, metric_type="gauge")
+        if collect is not None: self.collect = collect
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class MetricHistogram:
+    def __init__(self, name, help_text, label_names=(), buckets=METRICS_DURATION_BUCKETS):
+        self.name = name; self.help_text = help_text; self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {} # Label-Tupel -> [Bucket-Zähler..., +Inf, Summe]
+        self._lock = threading.Lock()
+        METRICS_REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None: series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock: series_items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS_REGISTRY: lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _queue_depths():
+    depths = {}
+    for stage, (_, stage_queue) in PIPELINE_STAGES.items():
+        depths[(stage,)] = job_backend.queued_count() if stage == "download" else stage_queue.qsize()
+    return depths
+
+
+METRIC_PHASE_DURATION = MetricHistogram("medien_dl_phase_duration_seconds", "Dauer einzelner Job-Phasen.", ("phase",))
+METRIC_QUEUE_DEPTH = MetricGauge("medien_dl_queue_depth", "Wartende Jobs je Pipeline-Stufe.", ("stage",), collect=_queue_depths)
+METRIC_IN_FLIGHT = MetricGauge("medien_dl_jobs_in_flight", "Gerade bearbeitete Jobs je Pipeline-Stufe.", ("stage",))
+METRIC_JOBS = MetricCounter("medien_dl_jobs_total", "Abgeschlossene Jobs nach Ergebnis.", ("platform", "status"))
+METRIC_DOWNLOADED_BYTES = MetricCounter("medien_dl_downloaded_bytes_total", "Von den Plattformen heruntergeladene Bytes.")
+METRIC_UPLOADED_BYTES = MetricCounter("medien_dl_uploaded_bytes_total", "Zu S3 hochgeladene Bytes.")
+METRIC_TRANSCODE_CPU = MetricCounter("medien_dl_transcode_cpu_seconds_total", "CPU-Zeit (user+sys) der FFmpeg-Prozesse.")
+METRIC_RATE_LIMIT = MetricCounter("medien_dl_rate_limit_events_total", "Rate-Limit je Plattform: gewartet, gedrosselt, verzögert eingereiht.", ("platform", "event"))
+METRIC_RETRIES = MetricCounter("medien_dl_job_retries_total", "Automatische Wiederholungen nach vorübergehenden Fehlern, nach zuletzt abgeschlossener Phase.", ("phase",))
+METRIC_SCHEDULER = MetricCounter("medien_dl_scheduler_events_total", "Zurückgestellte und abgebrochene Aufträge.", ("event",))
+METRIC_S3_NAME_CHECKS = MetricCounter("medien_dl_s3_name_checks_total", "Prüfungen freier S3 Objektnamen (HEAD-Probe oder bedingter Upload).", ("method", "result"))
+METRIC_INFO_CACHE = MetricCounter("medien_dl_info_cache_requests_total", "Abfragen des Metadaten-Caches (hit/miss).", ("result",))
+METRIC_ERRORS = MetricCounter("medien_dl_errors_total", "Fehler nach Kategorie.", ("category",))
+
+
+def wait_with_rusage(process):
+    """Wartet auf einen Kindprozess und verbucht dessen CPU-Zeit (os.wait4). Gibt den Rückgabecode zurück."""
     try:
-        if os.path.exists(STATS_FILE):
-            if os.path.getsize(STATS_FILE) == 0: logging.warning(f"{STATS_FILE} ist leer."); return default_stats
-            with open(STATS_FILE, 'r', encoding='utf-8') as f: stats = json.load(f)
-            for key, default_value in default_stats.items():
-                if key not in stats: stats[key] = default_value
-            return stats
-        else: return default_stats
-    except json.JSONDecodeError as e: logging.error(f"Fehler Laden Statistik (JSON ungültig): {e}."); return default_stats
-    except Exception as e: logging.error(f"Fehler Laden Statistik (Allgemein): {e}"); return default_stats
-
-def save_stats(stats_data):
+        _, wait_status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError: # Bereits von Popen eingesammelt, CPU-Zeit nicht mehr verfügbar
+        return process.wait()
+    process.returncode = os.waitstatus_to_exitcode(wait_status)
+    METRIC_TRANSCODE_CPU.inc(rusage.ru_utime + rusage.ru_stime)
+    return process.returncode
+
+
+# --- Statistik: Zähler pro Thread im Speicher, periodisch nach stats.json geschrieben ---
+STATS_PHASES = ("extract", "download", "transcode", "upload")
+STATS_LATENCY_BOUNDS = [round(0.1 * 1.2 ** i, 3) for i in range(66)] # Histogramm-Obergrenzen in Sekunden (0,1s bis ~3h, +20% je Bucket)
+STATS_TOTAL_KEYS = ('total_jobs', 'successful_jobs', 'total_duration_seconds', 'total_size_bytes')
+
+class StatsShard:
+    """Zähler eines einzelnen Threads. Wird nur vom eigenen Thread geschrieben."""
+    __slots__ = ("totals", "platforms", "latency")
+
+    def __init__(self):
+        self.totals = {'total_jobs': 0, 'successful_jobs': 0, 'total_duration_seconds': 0.0, 'total_size_bytes': 0}
+        self.platforms = {} # Plattform -> Zähler wie `totals`
+        self.latency = {phase: [0] * (len(STATS_LATENCY_BOUNDS) + 1) for phase in STATS_PHASES}
+
+    def merge(self, other, sign=1):
+        for key, value in other.totals.items(): self.totals[key] += sign * value
+        for platform, counters in dict(other.platforms).items():
+            target = self.platforms.setdefault(platform, {key: 0 for key in STATS_TOTAL_KEYS})
+            for key, value in counters.items(): target[key] += sign * value
+        for phase, counts in other.latency.items():
+            target = self.latency[phase]
+            for i, count in enumerate(counts): target[i] += sign * count
+
+    def to_dict(self):
+        data = dict(self.totals)
+        data['platforms'] = self.platforms
+        data['latency_bounds'] = STATS_LATENCY_BOUNDS
+        data['phase_latency'] = self.latency
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        shard = cls()
+        for key in STATS_TOTAL_KEYS: shard.totals[key] = data.get(key, shard.totals[key])
+        for platform, counters in (data.get('platforms') or {}).items():
+            shard.platforms[platform] = {key: counters.get(key, 0) for key in STATS_TOTAL_KEYS}
+        if data.get('latency_bounds') == STATS_LATENCY_BOUNDS: # Bei geänderter Bucket-Einteilung verwerfen
+            for phase, counts in (data.get('phase_latency') or {}).items():
+                if phase in shard.latency and len(counts) == len(shard.latency[phase]): shard.latency[phase] = list(counts)
+        return shard
+
+
+def latency_percentile(counts, percentile):
+    """Näherungswert (Bucket-Obergrenze) für das Perzentil eines Latenz-Histogramms."""
+    total = sum(counts)
+    if not total: return None
+    rank = total * percentile / 100.0; seen = 0
+    for i, count in enumerate(counts):
+        seen += count
+        if seen >= rank: return STATS_LATENCY_BOUNDS[i] if i < len(STATS_LATENCY_BOUNDS) else STATS_LATENCY_BOUNDS[-1]
+    return STATS_LATENCY_BOUNDS[-1]
+
+
+class StatsAggregator:
+    """Sammelt Statistiken ohne gemeinsames Lock im Job-Pfad.
+
+    Jeder Thread zählt in seinen eigenen StatsShard; beim Lesen werden die Shards
+    mit dem zuletzt geladenen Stand zusammengeführt. Geschrieben wird nur periodisch
+    (flush) und beim Beenden, nicht mehr nach jedem Job. Beim Schreiben wird nur der
+    Zuwachs seit dem letzten flush auf den aktuellen Dateistand addiert, so dass mehrere
+    Gunicorn-Worker dieselbe Datei fortschreiben können.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._base = StatsShard.from_dict(self._load())
+        self._local = threading.local()
+        self._shards = []
+        self._register_lock = threading.Lock() # Nur beim ersten Zugriff eines Threads
+        self._flush_lock = threading.Lock()
+        self._flushed_local = StatsShard() # Eigene Zähler, die bereits in der Datei stehen
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                if os.path.getsize(self.path) == 0: logging.warning(f"{self.path} ist leer."); return {}
+                with open(self.path, 'r', encoding='utf-8') as f: stats = json.load(f)
+                return stats if isinstance(stats, dict) else {}
+            return {}
+        except json.JSONDecodeError as e: logging.error(f"Fehler Laden Statistik (JSON ungültig): {e}."); return {}
+        except Exception as e: logging.error(f"Fehler Laden Statistik (Allgemein): {e}"); return {}
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = StatsShard()
+            with self._register_lock: self._shards = self._shards + [shard] # Copy-on-write für Leser
+        return shard
+
+    def record_job(self, platform, duration_seconds, file_size_bytes, success):
+        shard = self._shard()
+        counters = shard.platforms.get(platform)
+        if counters is None: counters = shard.platforms[platform] = {key: 0 for key in STATS_TOTAL_KEYS}
+        for target in (shard.totals, counters):
+            target['total_jobs'] += 1
+            if success:
+                target['successful_jobs'] += 1
+                target['total_duration_seconds'] += duration_seconds
+                target['total_size_bytes'] += file_size_bytes
+
+    def record_phase(self, phase, seconds):
+        self._shard().latency[phase][bisect.bisect_left(STATS_LATENCY_BOUNDS, seconds)] += 1
+
+    def _local_totals(self):
+        local = StatsShard()
+        for shard in self._shards: local.merge(shard)
+        return local
+
+    def snapshot(self):
+        merged = StatsShard(); merged.merge(self._base)
+        merged.merge(self._local_totals()); merged.merge(self._flushed_local, -1)
+        return merged
+
+    def flush(self):
+        with self._flush_lock:
+            local = self._local_totals()
+            pending = StatsShard(); pending.merge(local); pending.merge(self._flushed_local, -1)
+            if pending.to_dict() == StatsShard().to_dict(): return True
+            try:
+                with open(self.path + '.lock', 'w') as lock_file:
+                    if fcntl is not None: fcntl.flock(lock_file, fcntl.LOCK_EX) # Andere Worker-Prozesse warten
+                    base = StatsShard.from_dict(self._load())
+                    base.merge(pending)
+                    with open(self.path, 'w', encoding='utf-8') as f: json.dump(base.to_dict(), f, indent=4, ensure_ascii=False)
+                self._base, self._flushed_local = base, local
+                return True
+            except Exception as e: logging.error(f"Fehler Speichern Statistik: {e}"); return False
+
+
+stats_aggregator = StatsAggregator(STATS_FILE)
+atexit.register(stats_aggregator.flush)
+
+@contextlib.contextmanager
+def timed_phase(phase):
+    """Misst die Dauer einer Job-Phase für /metrics und die Latenz-Perzentile in /stats."""
+    start = time.monotonic()
+    try: yield
+    finally:
+        elapsed = time.monotonic() - start
+        METRIC_PHASE_DURATION.observe(elapsed, phase=phase)
+        if phase in STATS_PHASES: stats_aggregator.record_phase(phase, elapsed)
+
+def stats_flush_loop():
+    while True:
+        time.sleep(STATS_FLUSH_INTERVAL_SECONDS)
+        stats_aggregator.flush()
+
+# --- Dedup-Cache: Bereits hochgeladene Medien wiederverwenden ---
+# Medien-IDs direkt aus der URL (ohne yt-dlp Aufruf). Gleiches Format wie "<extractor_key>:<id>" von yt-dlp.
+MEDIA_URL_PATTERNS = [
+    ('youtube', re.compile(r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([A-Za-z0-9_-]{11})')),
+    ('twitter', re.compile(r'(?:twitter\.com|x\.com)/(?:[^/]+/)?status(?:es)?/(\d+)')),
+    ('instagram', re.compile(r'instagram\.com/(?:[^/]+/)?(?:reels?|p|tv)/([A-Za-z0-9_-]+)')),
+    ('tiktok', re.compile(r'tiktok\.com/(?:@[^/]+/video|v|embed(?:/v2)?)/(\d+)')),
+]
+
+def normalize_source_url(url):
+    """Vereinheitlicht eine URL für den Alias-Index (Host ohne www./m., ohne Query und Fragment)."""
+    parsed = urllib.parse.urlparse(url.strip())
+    host = parsed.netloc.lower()
+    for prefix in ('www.', 'm.', 'mobile.'):
+        if host.startswith(prefix): host = host[len(prefix):]
+    return f"{host}{parsed.path.rstrip('/')}"
+
+def media_key_from_url(url):
+    for extractor, pattern in MEDIA_URL_PATTERNS:
+        match = pattern.search(url)
+        if match: return f"{extractor}:{match.group(1)}"
+    return None
+
+def media_key_from_info(info_dict):
+    extractor = info_dict.get('extractor_key') or info_dict.get('extractor')
+    media_id = info_dict.get('id')
+    return f"{extractor.lower()}:{media_id}" if extractor and media_id else None
+
+def build_variant_key(platform, format_preference, mp3_bitrate, mp4_quality, codec_preference):
+    """Beschreibt die angeforderte Ausgabe; nur gleiche Varianten dürfen wiederverwendet werden."""
+    if platform == "SoundCloud" or (platform == "YouTube" and format_preference == 'mp3'): return f"mp3:{mp3_bitrate}"
+    quality = mp4_quality if platform == "YouTube" else "Best"
+    return f"mp4:{quality}:{'h264' if codec_preference == 'h264' else 'original'}"
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''): sha256.update(chunk)
+    return sha256.hexdigest()
+
+def build_public_url(object_name):
+    s3_public_url_base = os.getenv('S3_PUBLIC_URL_BASE')
+    if not s3_public_url_base: return None
+    return s3_public_url_base.rstrip('/') + '/' + urllib.parse.quote(object_name)
+
+
+class DedupCache:
+    """Persistenter Index (SQLite): (Medien-ID, Variante, Bucket) -> S3 Objekt und Inhalts-Hash.
+
+    `url_aliases` merkt sich, welche normalisierte URL zu welcher Medien-ID gehört, damit auch
+    URLs ohne erkennbare ID (z.B. SoundCloud) beim nächsten Mal ohne yt-dlp aufgelöst werden.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS media_objects (
+                media_key TEXT NOT NULL, variant TEXT NOT NULL, bucket TEXT NOT NULL,
+                object_name TEXT NOT NULL, title TEXT, content_hash TEXT, size_bytes INTEGER,
+                created_at REAL NOT NULL, PRIMARY KEY (media_key, variant, bucket));
+            CREATE INDEX IF NOT EXISTS idx_media_objects_hash ON media_objects (content_hash, bucket);
+            CREATE TABLE IF NOT EXISTS url_aliases (url TEXT PRIMARY KEY, media_key TEXT NOT NULL);
+        """)
+
+    def resolve_url(self, url):
+        media_key = media_key_from_url(url)
+        if media_key: return media_key
+        with self._lock:
+            row = self._conn.execute("SELECT media_key FROM url_aliases WHERE url = ?", (normalize_source_url(url),)).fetchone()
+        return row[0] if row else None
+
+    def remember_alias(self, url, media_key):
+        if media_key_from_url(url): return # Über das URL-Muster ohnehin auflösbar
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO url_aliases (url, media_key) VALUES (?, ?)",
+                               (normalize_source_url(url), media_key))
+
+    def lookup(self, media_key, variant, bucket_name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT object_name, title, content_hash, size_bytes FROM media_objects WHERE media_key = ? AND variant = ? AND bucket = ?",
+                (media_key, variant, bucket_name)).fetchone()
+        return dict(zip(("object_name", "title", "content_hash", "size_bytes"), row)) if row else None
+
+    def find_by_hash(self, content_hash, bucket_name):
+        with self._lock:
+            row = self._conn.execute("SELECT object_name FROM media_objects WHERE content_hash = ? AND bucket = ? LIMIT 1",
+                                     (content_hash, bucket_name)).fetchone()
+        return row[0] if row else None
+
+    def store(self, media_key, variant, bucket_name, object_name, title, content_hash, size_bytes):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media_objects (media_key, variant, bucket, object_name, title, content_hash, size_bytes, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (media_key, variant, bucket_name, object_name, title, content_hash, size_bytes, time.time()))
+
+    def forget(self, media_key, variant, bucket_name):
+        with self._lock:
+            self._conn.execute("DELETE FROM media_objects WHERE media_key = ? AND variant = ? AND bucket = ?",
+                               (media_key, variant, bucket_name))
+
+
+dedup_cache = None
+if ENABLE_DEDUP_CACHE:
     try:
-        with open(STATS_FILE, 'w', encoding='utf-8') as f: json.dump(stats_data, f, indent=4, ensure_ascii=False)
-        return True
-    except Exception as e: logging.error(f"Fehler Speichern Statistik: {e}"); return False
-
-def update_stats(duration_seconds, file_size_bytes, success):
-    stats = load_stats()
-    stats['total_jobs'] = stats.get('total_jobs', 0) + 1
-    if success:
-        stats['successful_jobs'] = stats.get('successful_jobs', 0) + 1
-        stats['total_duration_seconds'] = stats.get('total_duration_seconds', 0.0) + duration_seconds
-        stats['total_size_bytes'] = stats.get('total_size_bytes', 0) + file_size_bytes
-    save_stats(stats)
-
-# --- Haupt-Verarbeitungsfunktion mit verbessertem Logging/Error Handling ---
-def run_download_upload_task(job_id, url, platform, format_preference, mp3_bitrate, mp4_quality,
-                               codec_preference, access_key, secret_key, bucket_name, region_name, endpoint_url):
-    start_time = time.time()
-    downloaded_file = None; track_title = None; file_extension = None
-    s3_object_name = None; public_url = None; s3_client = None
-    process_ok = False # Wird nur True, wenn *alles* klappt
-    final_error_message = None
-    file_size_bytes = 0
+        dedup_cache = DedupCache(DEDUP_CACHE_PATH)
+        logging.info(f"Dedup-Cache aktiv: {DEDUP_CACHE_PATH}")
+    except sqlite3.Error as e:
+        logging.error(f"Dedup-Cache konnte nicht geöffnet werden ({DEDUP_CACHE_PATH}): {e}. Fahre ohne Cache fort.")
+
+# --- Metadaten-Cache: rohe yt-dlp info_dicts mit TTL ---
+def copy_raw_info(raw_info):
+    """Kopie eines rohen info_dict, die yt-dlp bei der Formatauswahl verändern darf (Formate werden mitkopiert)."""
+    info = dict(raw_info)
+    if info.get('formats'): info['formats'] = [dict(fmt) for fmt in info['formats']]
+    return info
+
+
+class InfoCache:
+    """LRU-Cache im Speicher (mit TTL) für rohe yt-dlp info_dicts, optional zusätzlich in SQLite.
+
+    Gespeichert wird das Ergebnis von extract_info(process=False), also vor der Formatauswahl,
+    so dass ein Eintrag für jede Format- und Qualitätsvariante passt. Schlüssel ist die Medien-ID
+    aus der URL, sonst die vollständige URL inkl. Query (z.B. watch?v=...). Live-Streams und
+    Weiterleitungen (`_type` url/playlist) werden nicht gespeichert.
+    """
+
+    def __init__(self, ttl_seconds, max_entries, path=None):
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # Schlüssel -> (Ablaufzeit, JSON)
+        self._conn = None
+        if path:
+            if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS info_cache (url TEXT PRIMARY KEY, info TEXT NOT NULL, expires REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS idx_info_cache_expires ON info_cache (expires);
+            """)
+
+    @staticmethod
+    def _key(url):
+        return media_key_from_url(url) or url.strip()
+
+    def _remember(self, key, payload, expires):
+        self._entries[key] = (expires, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries: self._entries.popitem(last=False)
+
+    def get(self, url):
+        key = self._key(url)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                payload = entry[1]
+            else:
+                self._entries.pop(key, None)
+                row = self._conn.execute("SELECT expires, info FROM info_cache WHERE url = ? AND expires > ?", (key, now)).fetchone() if self._conn else None
+                if row is None:
+                    METRIC_INFO_CACHE.inc(result="miss")
+                    return None
+                self._remember(key, row[1], row[0])
+                payload = row[1]
+        METRIC_INFO_CACHE.inc(result="hit")
+        return json.loads(payload)
+
+    def put(self, url, raw_info):
+        if not raw_info or raw_info.get('_type', 'video') != 'video' or raw_info.get('is_live') or raw_info.get('live_status') in ('is_live', 'is_upcoming', 'post_live'):
+            return
+        try: payload = json.dumps(yt_dlp.YoutubeDL.sanitize_info({k: v for k, v in raw_info.items() if not k.startswith('__')}))
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Metadaten für {url} nicht cachebar: {e}")
+            return
+        key = self._key(url)
+        now = time.time()
+        with self._lock:
+            self._remember(key, payload, now + self._ttl)
+            if self._conn is not None:
+                self._conn.execute("INSERT OR REPLACE INTO info_cache (url, info, expires) VALUES (?, ?, ?)", (key, payload, now + self._ttl))
+                self._conn.execute("DELETE FROM info_cache WHERE expires <= ?", (now,))
 
+    def forget(self, url):
+        key = self._key(url)
+        with self._lock:
+            self._entries.pop(key, None)
+            if self._conn is not None: self._conn.execute("DELETE FROM info_cache WHERE url = ?", (key,))
+
+
+info_cache = None
+if INFO_CACHE_TTL_SECONDS > 0:
+    try:
+        info_cache = InfoCache(INFO_CACHE_TTL_SECONDS, INFO_CACHE_ENTRIES, INFO_CACHE_PATH or None)
+        logging.info(f"Metadaten-Cache aktiv: TTL {INFO_CACHE_TTL_SECONDS}s, {INFO_CACHE_ENTRIES} Einträge im Speicher" + (f", Datenbank {INFO_CACHE_PATH}" if INFO_CACHE_PATH else ""))
+    except sqlite3.Error as e:
+        logging.error(f"Metadaten-Cache Datenbank konnte nicht geöffnet werden ({INFO_CACHE_PATH}): {e}. Nur im Speicher.")
+        info_cache = InfoCache(INFO_CACHE_TTL_SECONDS, INFO_CACHE_ENTRIES)
+
+# --- Single-Flight: Gleichzeitige identische Anfragen teilen sich einen Job ---
+class InflightJobs:
+    """Ordnet (Medien-ID, Variante, Bucket) dem wartenden/laufenden Job zu.
+
+    Weitere Anfragen für denselben Schlüssel hängen sich an diesen Job an (gleiche Job-ID,
+    gleicher Status-Stream, gleiche Ergebnis-URL), statt einen eigenen Job einzureihen.
+    Die Zuordnung gilt nur innerhalb eines Prozesses: Mit sqlite/redis und mehreren Gunicorn-Workern
+    kann dieselbe Anfrage auf einem anderen Worker noch einen eigenen Job starten (der Dedup-Cache
+    fängt das Ergebnis danach ab).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._job_by_key = {}
+        self._key_by_job = {}
+
+    def claim(self, key, job_id):
+        """Registriert `job_id` für `key`. Läuft bereits ein Job für `key`, wird dessen ID zurückgegeben."""
+        with self._lock:
+            existing = self._job_by_key.get(key)
+            if existing is not None and existing in job_store and job_store.get_field(existing, "status") in ("queued", "running"):
+                return existing
+            if existing is not None: self._key_by_job.pop(existing, None) # Aufgeräumt oder abgeschlossen: Eintrag ersetzen
+            self._job_by_key[key] = job_id
+            self._key_by_job[job_id] = key
+            return None
+
+    def release(self, job_id):
+        with self._lock:
+            key = self._key_by_job.pop(job_id, None)
+            if key is not None and self._job_by_key.get(key) == job_id: del self._job_by_key[key]
+
+inflight_jobs = InflightJobs()
+
+# --- Batches: Mehrere URLs oder eine Playlist unter einer Batch-ID ---
+def expand_playlist(playlist_url):
+    """Löst eine Playlist/ein Set mit einem einzigen flachen extract_info in einzelne Einträge auf.
+
+    Liefert (Titel, [{"url", "title", "duration"}, ...]). Eine URL ohne Einträge wird als einzelnes Medium übernommen.
+    """
+    ydl_opts = {'extract_flat': 'in_playlist', 'skip_download': True, 'quiet': True, 'no_warnings': True,
+                'no_color': True, 'logger': logging.getLogger('yt_dlp'), 'cookiefile': os.getenv('COOKIE_FILE_PATH') or None}
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with timed_phase("extract"): info = ydl.extract_info(playlist_url, download=False)
+    if not info: return None, []
+    if info.get('entries') is None: return info.get('title'), [{"url": playlist_url, "title": info.get('title'), "duration": info.get('duration')}]
+    items = []
+    for entry in info['entries']:
+        entry_url = (entry or {}).get('webpage_url') or (entry or {}).get('url')
+        if entry_url and entry_url.startswith(("http://", "https://")):
+            items.append({"url": entry_url, "title": entry.get('title'), "duration": entry.get('duration')})
+    logging.info(f"Playlist '{info.get('title')}' ({playlist_url}): {len(items)} Einträge.")
+    return info.get('title'), items
+
+
+class BatchTracker:
+    """Fasst die Kind-Jobs eines Batches in einem eigenen Eintrag im Job-Store zusammen.
+
+    Der Batch ist ein normaler Job-Datensatz mit Feld `children`, Fortschritt (Mittelwert der
+    Kinder) und Zustand werden periodisch aktualisiert. Kinder, deren Status bereits
+    aufgeräumt wurde, behalten ihren zuletzt gesehenen Zustand.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._batches = {} # batch_id -> Liste der Kind-Einträge (laufende Batches)
+
+    def create(self, batch_id, children, title=None):
+        label = f"'{title}' " if title else ""
+        job_store.create(batch_id, log_entry=f"Batch {label}mit {len(children)} Aufträgen eingereiht.",
+                         status="running", running=True, message="Batch eingereiht...", children=[dict(c) for c in children])
+        job_sync.keep_local(batch_id)
+        with self._lock: self._batches[batch_id] = children
+        self.refresh(batch_id)
+
+    def refresh(self, batch_id):
+        children = self._batches.get(batch_id)
+        if children is None: return
+        finished_now = []
+        for child in children:
+            if child["status"] in ("completed", "error") or not child["job_id"]: continue
+            job_sync.refresh(child["job_id"])
+            snapshot = job_store.snapshot(child["job_id"])
+            if snapshot is None: continue
+            for name in ("status", "progress", "result_url", "error"): child[name] = snapshot[name]
+            if child["status"] in ("completed", "error") and not snapshot["running"]: finished_now.append(child)
+            elif child["status"] in ("completed", "error"): child["status"] = "running" # Abschluss noch nicht final
+        total = len(children)
+        failed = sum(1 for c in children if c["status"] == "error")
+        done = sum(1 for c in children if c["status"] in ("completed", "error"))
+        progress = round(sum(100.0 if c["status"] in ("completed", "error") else (c["progress"] or 0.0) for c in children) / max(1, total), 1)
+        fields = {"progress": progress, "children": [dict(c) for c in children],
+                  "message": f"{done}/{total} Aufträge abgeschlossen" + (f", {failed} fehlgeschlagen." if failed else ".")}
+        if done == total:
+            fields.update(running=False, status="error" if failed == total else "completed")
+            if failed == total: fields["error"] = "Alle Aufträge des Batches sind fehlgeschlagen."
+        changed = {name: value for name, value in fields.items() if job_store.get_field(batch_id, name) != value}
+        for child in finished_now:
+            outcome = "fertig" if child["status"] == "completed" else f"Fehler: {child['error']}"
+            update_status(batch_id, log_entry=f"{child['title'] or child['url']}: {outcome}")
+        if changed: job_store.set_fields(batch_id, **changed)
+        if changed or finished_now:
+            if job_backend.shared: job_backend.store_finished(batch_id, job_store.export(batch_id)) # Für andere Worker sichtbar
+        if done == total:
+            with self._lock: self._batches.pop(batch_id, None)
+            logging.info(f"Batch [{batch_id}] beendet: {total - failed}/{total} erfolgreich.")
+
+    def run(self):
+        logging.info("Batch Thread gestartet.")
+        while True:
+            time.sleep(BATCH_REFRESH_SECONDS)
+            with self._lock: batch_ids = list(self._batches)
+            for batch_id in batch_ids:
+                try: self.refresh(batch_id)
+                except Exception as e: logging.error(f"Fehler beim Aktualisieren von Batch {batch_id}: {e}", exc_info=True)
+
+batch_tracker = BatchTracker()
+
+# --- Pipeline: Download -> Konvertierung -> Upload ---
+STAGE_REQUEUED = "requeued" # Rückgabe einer Stufe: Auftrag liegt wieder in der Warteschlange des Job-Backends
+
+class JobContext:
+    """Zustand eines Jobs, der zwischen den Pipeline-Stufen weitergereicht wird."""
+    __slots__ = ("job_id", "url", "platform", "format_preference", "mp3_bitrate", "mp4_quality",
+                 "codec_preference", "access_key", "secret_key", "bucket_name", "region_name",
+                 "endpoint_url", "start_time", "downloaded_file", "track_title", "file_extension",
+                 "file_size_bytes", "needs_transcode", "process_ok", "cancel_event", "stream_source",
+                 "variant", "media_key", "content_hash", "cached_object", "client_id", "enqueued_at", "queue_score",
+                 "deferred", "retry_state", "failure")
+
+    def __init__(self, job_id, url, platform, format_preference, mp3_bitrate, mp4_quality,
+                 codec_preference, access_key, secret_key, bucket_name, region_name, endpoint_url,
+                 client_id=None, enqueued_at=None, queue_score=None, retry_state=None):
+        self.job_id = job_id
+        self.url = url
+        self.platform = platform
+        self.format_preference = format_preference
+        self.mp3_bitrate = mp3_bitrate
+        self.mp4_quality = mp4_quality
+        self.codec_preference = codec_preference
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket_name = bucket_name
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+        self.start_time = time.time()
+        self.downloaded_file = None
+        self.track_title = None
+        self.file_extension = None
+        self.file_size_bytes = 0
+        self.needs_transcode = False
+        self.process_ok = False # Wird nur True, wenn *alles* klappt
+        self.cancel_event = threading.Event()
+        self.stream_source = None # Gesetzt, wenn direkt von der Quelle zu S3 gestreamt wird
+        self.variant = build_variant_key(platform, format_preference, mp3_bitrate, mp4_quality, codec_preference)
+        self.media_key = None # "<extractor>:<id>" nach der Extraktion
+        self.content_hash = None
+        self.cached_object = None # Treffer im Dedup-Cache
+        self.client_id = client_id # Für das Limit je Client
+        self.enqueued_at = enqueued_at
+        self.queue_score = queue_score
+        self.deferred = False # Nach der Extraktion zurückgestellt (großer Auftrag, kleinere warten)
+        self.retry_state = dict(retry_state or {}) # Zähler über Wiedereinreihungen hinweg (z.B. Drosselungen)
+        self.failure = {} # Vorübergehender Fehler dieses Versuchs (siehe retry_after_failure)
+
+    def to_task(self):
+        """Auftrags-Tupel für das Job-Backend (Gegenstück zu JobContext(*task))."""
+        return (self.job_id, self.url, self.platform, self.format_preference, self.mp3_bitrate, self.mp4_quality,
+                self.codec_preference, self.access_key, self.secret_key, self.bucket_name, self.region_name,
+                self.endpoint_url, self.client_id, self.enqueued_at, self.queue_score, self.retry_state)
+
+
+def save_checkpoint(ctx, phase, **fields):
+    """Hält die zuletzt abgeschlossene Phase (extracted, downloaded, transcoded, uploaded) im Arbeitsverzeichnis fest."""
+    path = os.path.join(job_work_dir(ctx.job_id), CHECKPOINT_FILE_NAME)
+    checkpoint = {"phase": phase, "title": ctx.track_title, "ext": ctx.file_extension, "media_key": ctx.media_key, **fields}
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f: json.dump(checkpoint, f)
+        os.replace(path + ".tmp", path)
+        ctx.retry_state["phase"] = phase
+    except OSError as e:
+        logging.warning(f"[{ctx.job_id}] Konnte Checkpoint '{phase}' nicht schreiben: {e}")
+
+def load_checkpoint(job_id):
+    """Checkpoint eines früheren Versuchs auf diesem Host; None, wenn keiner da ist oder das Artefakt fehlt."""
+    work_dir = job_work_dir(job_id)
+    try:
+        with open(os.path.join(work_dir, CHECKPOINT_FILE_NAME), encoding="utf-8") as f: checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get("file"):
+        checkpoint["file"] = os.path.join(work_dir, checkpoint["file"])
+        if not os.path.exists(checkpoint["file"]): return None
+    return checkpoint
+
+def resume_from_checkpoint(ctx, checkpoint):
+    """Setzt einen Job nach der Phase des Checkpoints fort. Liefert die nächste Stufe wie ein Stufen-Handler."""
+    job_id = ctx.job_id; phase = checkpoint["phase"]
+    ctx.track_title, ctx.file_extension, ctx.media_key = checkpoint["title"], checkpoint["ext"], checkpoint.get("media_key")
+    logging.info(f"[{job_id}] Checkpoint '{phase}' gefunden, setze dort fort.")
+    update_status(job_id, log_entry=f"Setze nach Phase '{phase}' fort, bereits erledigte Schritte entfallen.", progress=50)
+    if phase == "uploaded":
+        ctx.file_size_bytes, ctx.content_hash = checkpoint.get("size", 0), checkpoint.get("content_hash")
+        return publish_upload_result(ctx, checkpoint["object_name"])
+    ctx.downloaded_file = checkpoint["file"]
+    ctx.needs_transcode = phase == "downloaded" and checkpoint.get("needs_transcode", False)
+    if ctx.needs_transcode:
+        update_status(job_id, message="Warte auf freien Konvertierungs-Slot...")
+        return "transcode"
+    return "upload"
+
+def retry_after_failure(ctx):
+    """Reiht einen Job nach einem vorübergehenden Fehler mit exponentiellem Backoff wieder ein, solange JOB_RETRIES
+    nicht erschöpft ist; sonst scheitert er mit der Fehlermeldung. Das Arbeitsverzeichnis bleibt dabei erhalten."""
+    job_id = ctx.job_id
+    retries = ctx.retry_state.get("retries", 0)
+    if retries >= JOB_RETRIES or ctx.cancel_event.is_set():
+        update_status(job_id, error=ctx.failure["error"], running=False)
+        return None
+    ctx.retry_state["retries"] = retries + 1
+    phase = ctx.retry_state.get("phase", "none")
+    delay = jittered_delay(min(JOB_RETRY_MAX_BACKOFF_SECONDS, JOB_RETRY_BACKOFF_SECONDS * 2 ** retries))
+    logging.warning(f"[{job_id}] Vorübergehender Fehler ({ctx.failure['error']}), Wiederholung {retries + 1}/{JOB_RETRIES} in {delay:.0f}s ab Phase '{phase}'.")
+    update_status(job_id, message=f"Vorübergehender Fehler, neuer Versuch in {delay:.0f}s...", running=False, status_code="queued",
+                  log_entry=f"Vorübergehender Fehler, Wiederholung {retries + 1}/{JOB_RETRIES} in {delay:.0f}s (letzte abgeschlossene Phase: {phase}).")
+    METRIC_RETRIES.inc(phase=phase)
+    job_sync.requeue(ctx, delay)
+    return STAGE_REQUEUED
+
+
+def requeue_throttled(ctx, throttled):
+    """Reiht einen gedrosselten Job verzögert wieder ein; nach RATE_LIMIT_MAX_QUEUE_SECONDS wird er aufgegeben."""
+    job_id = ctx.job_id
+    counter = "throttled_403" if throttled.status == 403 else "throttled"
+    ctx.retry_state[counter] = ctx.retry_state.get(counter, 0) + 1
+    if time.time() - (ctx.enqueued_at or ctx.start_time) + throttled.delay > RATE_LIMIT_MAX_QUEUE_SECONDS:
+        error_msg = f"Download-Fehler: {ctx.platform} drosselt Anfragen, Auftrag nach {RATE_LIMIT_MAX_QUEUE_SECONDS // 60} Minuten aufgegeben."
+        if throttled.status == 403: error_msg = "Download-Fehler: Zugriff verweigert (403)."
+        METRIC_ERRORS.inc(category="http_403" if throttled.status == 403 else "rate_limited")
+        logging.error(f"[{job_id}] {error_msg}")
+        update_status(job_id, error=error_msg, running=False)
+        return None
+    logging.info(f"[{job_id}] {throttled}, Auftrag wird verzögert wieder eingereiht.")
+    update_status(job_id, message=f"{ctx.platform} drosselt Anfragen, neuer Versuch in {throttled.delay:.0f}s...",
+                  log_entry=f"{throttled}.", running=False, status_code="queued")
+    METRIC_RATE_LIMIT.inc(platform=ctx.platform, event="requeued") # Arbeitsverzeichnis bleibt: .part Dateien werden fortgesetzt
+    job_sync.requeue(ctx, throttled.delay)
+    return STAGE_REQUEUED
+
+
+def stage_download(ctx):
+    """Pipeline-Stufe 1 (I/O-lastig): Informationen extrahieren und Datei herunterladen."""
+    job_id = ctx.job_id
     update_status(job_id, message="Starte Verarbeitung...", running=True, status_code="running")
-    logging.info(f"[{job_id}] Worker startet Task für URL: {url}")
+    logging.info(f"[{job_id}] Worker startet Task für URL: {ctx.url}")
+    logging.info(f"[{job_id}] Starte Download-Phase...")
+    stream_sink = {} if STREAM_UPLOADS else None
+    checkpoint = load_checkpoint(job_id)
+    if checkpoint and checkpoint["phase"] != "extracted": return resume_from_checkpoint(ctx, checkpoint)
+
+    def _on_info(info_dict):
+        ctx.media_key = media_key_from_info(info_dict)
+        save_checkpoint(ctx, "extracted")
+        return _check_dedup_cache(info_dict) or _should_defer(info_dict)
+
+    def _check_dedup_cache(info_dict):
+        if dedup_cache is None or not ctx.media_key: return False
+        try:
+            dedup_cache.remember_alias(ctx.url, ctx.media_key)
+            ctx.cached_object = dedup_cache.lookup(ctx.media_key, ctx.variant, ctx.bucket_name)
+        except sqlite3.Error as cache_e:
+            logging.warning(f"[{job_id}] Dedup-Cache nicht verfügbar: {cache_e}")
+        return ctx.cached_object is not None
+
+    def _should_defer(info_dict):
+        # Mit echter Dauer/Größe neu einsortieren; wartet davor ein kleinerer Auftrag, kommt dieser zuerst dran
+        if ctx.enqueued_at is None or SCHEDULER_MAX_DEFER_SECONDS <= 0: return False
+        cost = estimate_job_cost(ctx.platform, ctx.format_preference, ctx.codec_preference, info_dict.get('duration'),
+                                 info_dict.get('filesize') or info_dict.get('filesize_approx'))
+        score = queue_score(ctx.enqueued_at, cost)
+        if score <= (ctx.queue_score or 0) + 1: return False
+        ctx.queue_score = score
+        first_queued = job_backend.first_queued_score()
+        ctx.deferred = first_queued is not None and first_queued < score
+        return ctx.deferred
 
     try:
-        # --- Download Phase ---
-        logging.info(f"[{job_id}] Starte Download-Phase...")
-        downloaded_file, track_title, file_extension = download_track(
-            job_id, url, platform, format_preference, mp3_bitrate, mp4_quality, codec_preference, DOWNLOAD_DIR)
-
-        with task_lock:
-            job_failed_during_download = job_statuses.get(job_id, {}).get("error") is not None
-
-        if job_failed_during_download:
-            logging.error(f"[{job_id}] Fehler während Download/Konvertierung erkannt. Breche Verarbeitung ab.")
-        elif not (downloaded_file and track_title and file_extension):
-             final_error_message = "Download/Konvertierung fehlgeschlagen (unerwarteter Zustand)."
-             logging.error(f"[{job_id}] {final_error_message}")
-             update_status(job_id, error=final_error_message, running=False)
+        ctx.downloaded_file, ctx.track_title, ctx.file_extension = download_track(
+            job_id, ctx.url, ctx.platform, ctx.format_preference, ctx.mp3_bitrate, ctx.mp4_quality, ctx.codec_preference, job_work_dir(job_id),
+            stream_sink=stream_sink, on_info=_on_info, cancel_event=ctx.cancel_event,
+            retry_on_403=ctx.retry_state.get("throttled_403", 0) < RATE_LIMIT_MAX_403_RETRIES, failure=ctx.failure)
+    except PlatformThrottledError as throttled:
+        return requeue_throttled(ctx, throttled)
+    ctx.stream_source = stream_sink or None
+
+    if ctx.failure: return retry_after_failure(ctx)
+
+    if job_store.get_field(job_id, "error") is not None:
+        logging.error(f"[{job_id}] Fehler während Download erkannt. Breche Verarbeitung ab.")
+        return None
+    if ctx.deferred:
+        logging.info(f"[{job_id}] Großer Auftrag, kleinere Aufträge warten: zurückgestellt (bis zu {SCHEDULER_MAX_DEFER_SECONDS}s).")
+        update_status(job_id, message="Zurückgestellt, kleinere Aufträge werden vorgezogen...", running=False, status_code="queued")
+        METRIC_SCHEDULER.inc(event="deferred")
+        shutil.rmtree(job_work_dir(job_id), ignore_errors=True) # Der nächste Versuch kann auf einem anderen Worker laufen
+        job_sync.requeue(ctx)
+        return STAGE_REQUEUED
+    if ctx.cached_object:
+        logging.info(f"[{job_id}] Dedup-Cache Treffer für {ctx.media_key} ({ctx.variant}): {ctx.cached_object['object_name']}")
+        ctx.process_ok = True
+        update_status(job_id, log_entry="Bereits verarbeitet, verwende vorhandene Datei aus dem Speicher.")
+        publish_result_url(job_id, ctx.cached_object['object_name'])
+        return None
+    if not ((ctx.downloaded_file or ctx.stream_source) and ctx.track_title and ctx.file_extension):
+        final_error_message = "Download fehlgeschlagen (unerwarteter Zustand)."
+        logging.error(f"[{job_id}] {final_error_message}")
+        update_status(job_id, error=final_error_message, running=False)
+        return None
+
+    ctx.needs_transcode = (ctx.codec_preference == 'h264' and ctx.platform in ["YouTube", "TikTok", "Instagram", "Twitter"])
+    if not ctx.stream_source:
+        save_checkpoint(ctx, "downloaded", file=os.path.basename(ctx.downloaded_file), needs_transcode=ctx.needs_transcode)
+    if ctx.needs_transcode and not ctx.stream_source:
+        update_status(job_id, message="Warte auf freien Konvertierungs-Slot...")
+        return "transcode"
+    return "upload"
+
+
+def stage_transcode(ctx):
+    """Pipeline-Stufe 2 (CPU-lastig): H.264 Konvertierung mit FFmpeg."""
+    with timed_phase("transcode"): converted_file = convert_to_h264(ctx.job_id, ctx.downloaded_file, ctx.cancel_event)
+    if not converted_file:
+        if job_store.get_field(ctx.job_id, "error") is None:
+            update_status(ctx.job_id, error="Konvertierung fehlgeschlagen (unerwarteter Zustand).", running=False)
+        return None
+    ctx.downloaded_file = converted_file
+    ctx.file_extension = '.mp4'
+    save_checkpoint(ctx, "transcoded", file=os.path.basename(converted_file))
+    update_status(ctx.job_id, message="Warte auf freien Upload-Slot...")
+    return "upload"
+
+
+def stage_upload(ctx):
+    """Pipeline-Stufe 3 (I/O-lastig): Eindeutigen S3-Namen finden, hochladen und Verlauf schreiben."""
+    job_id = ctx.job_id; downloaded_file = ctx.downloaded_file; file_extension = ctx.file_extension
+    bucket_name = ctx.bucket_name; s3_object_name = None
+    logging.info(f"[{job_id}] Download erfolgreich: {downloaded_file or 'Stream'}. Starte Upload-Phase...")
+    try:
+        if ctx.stream_source:
+            filesize = ctx.stream_source.get('filesize')
+            logging.info(f"[{job_id}] Dateigröße: {format_size(filesize) if filesize else 'unbekannt'} (Streaming)")
+        elif os.path.exists(downloaded_file):
+            ctx.file_size_bytes = os.path.getsize(downloaded_file)
+            logging.info(f"[{job_id}] Dateigröße: {format_size(ctx.file_size_bytes)}")
         else:
-            # --- Upload Phase (nur wenn Download OK) ---
-            logging.info(f"[{job_id}] Download erfolgreich: {downloaded_file}. Starte Upload-Phase...")
-            try:
-                if os.path.exists(downloaded_file):
-                    file_size_bytes = os.path.getsize(downloaded_file)
-                    logging.info(f"[{job_id}] Dateigröße: {format_size(file_size_bytes)}")
-                else:
-                    logging.warning(f"[{job_id}] Heruntergeladene Datei {downloaded_file} existiert nicht mehr vor dem Upload?")
-            except OSError as size_e:
-                logging.warning(f"[{job_id}] Konnte Dateigröße nicht ermitteln: {size_e}")
+            logging.warning(f"[{job_id}] Heruntergeladene Datei {downloaded_file} existiert nicht mehr vor dem Upload?")
+    except OSError as size_e:
+        logging.warning(f"[{job_id}] Konnte Dateigröße nicht ermitteln: {size_e}")
 
-            update_status(job_id, message="Verbinde mit S3 Speicher...")
-            s3_client_args = { 'aws_access_key_id': access_key, 'aws_secret_access_key': secret_key, 'region_name': region_name }
-            if endpoint_url: s3_client_args['endpoint_url'] = endpoint_url
+    if downloaded_file and dedup_cache is not None:
+        try:
+            ctx.content_hash = hash_file(downloaded_file)
+            existing_object = dedup_cache.find_by_hash(ctx.content_hash, bucket_name)
+        except (OSError, sqlite3.Error) as hash_e:
+            logging.warning(f"[{job_id}] Inhalts-Hash/Dedup-Prüfung fehlgeschlagen: {hash_e}"); existing_object = None
+        if existing_object:
+            logging.info(f"[{job_id}] Identischer Inhalt bereits als '{existing_object}' gespeichert, Upload übersprungen.")
+            update_status(job_id, log_entry=f"Identischer Inhalt bereits vorhanden ({existing_object}), Upload übersprungen.", progress=100)
+            return publish_upload_result(ctx, existing_object)
+
+    update_status(job_id, message="Verbinde mit S3 Speicher...")
+    try:
+        s3_client = get_s3_client(ctx.access_key, ctx.secret_key, ctx.region_name, ctx.endpoint_url)
+        logging.info(f"[{job_id}] S3 Client bereit.")
+    except Exception as client_e:
+        final_error_message = f"Fehler bei S3 Client Erstellung: {client_e}"
+        logging.error(f"[{job_id}] {final_error_message}", exc_info=True)
+        update_status(job_id, error=final_error_message, running=False)
+        raise
+
+    # Der Name ist fortlaufend und damit praktisch immer frei. Ein bedingter Upload prüft das ohne
+    # zusätzlichen Roundtrip; nur Anbieter ohne If-None-Match brauchen vorher eine HEAD-Probe.
+    upload_success = False
+    for attempt in range(1, MAX_FILENAME_RETRIES + 1):
+        candidate_name = generate_s3_object_name(file_extension)
+        conditional = use_conditional_writes(ctx.endpoint_url)
+        if not conditional:
             try:
-                s3_client = boto3.client('s3', **s3_client_args)
-                logging.info(f"[{job_id}] S3 Client erfolgreich erstellt.")
-            except Exception as client_e:
-                final_error_message = f"Fehler bei S3 Client Erstellung: {client_e}"
+                if not probe_s3_name(job_id, s3_client, bucket_name, candidate_name): continue
+            except Exception as head_e:
+                final_error_message = f"Fehler bei S3 Namensprüfung ({candidate_name}): {head_e}"
                 logging.error(f"[{job_id}] {final_error_message}", exc_info=True)
                 update_status(job_id, error=final_error_message, running=False)
                 raise
 
-            update_status(job_id, message=f"Generiere eindeutigen S3 Dateinamen mit Endung '{file_extension}'...")
-            unique_name_found = False
-            for attempt in range(MAX_FILENAME_RETRIES):
-                candidate_name = generate_s3_object_name(file_extension)
-                logging.debug(f"[{job_id}] Prüfe S3 Name (Versuch {attempt+1}/{MAX_FILENAME_RETRIES}): {candidate_name}")
-                try:
-                    s3_client.head_object(Bucket=bucket_name, Key=candidate_name)
-                    logging.warning(f"[{job_id}] S3 Name '{candidate_name}' existiert bereits.")
-                except ClientError as e:
-                    if e.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
-                        s3_object_name = candidate_name; unique_name_found = True
-                        logging.info(f"[{job_id}] Eindeutiger S3 Name gefunden: {s3_object_name}")
-                        break
-                    else:
-                        final_error_message = f"S3 Fehler bei Namensprüfung ({candidate_name}): {e}"
-                        logging.error(f"[{job_id}] {final_error_message}", exc_info=True)
-                        update_status(job_id, error=final_error_message, running=False)
-                        raise
-                except Exception as head_e:
-                    final_error_message = f"Allgemeiner Fehler bei S3 Namensprüfung ({candidate_name}): {head_e}"
-                    logging.error(f"[{job_id}] {final_error_message}", exc_info=True)
-                    update_status(job_id, error=final_error_message, running=False)
-                    raise
-
-            if not unique_name_found:
-                final_error_message = f"Konnte keinen eindeutigen S3 Namen nach {MAX_FILENAME_RETRIES} Versuchen finden."
-                logging.error(f"[{job_id}] {final_error_message}")
-                update_status(job_id, error=final_error_message, running=False)
-            else:
-                update_status(job_id, message="Starte Upload...", progress=50)
-                logging.info(f"[{job_id}] Rufe upload_to_s3 auf für Datei '{downloaded_file}' nach '{bucket_name}/{s3_object_name}'")
+        update_status(job_id, message="Starte Upload...", progress=50)
+        logging.info(f"[{job_id}] Rufe upload_to_s3 auf für '{downloaded_file or 'Stream'}' nach '{bucket_name}/{candidate_name}' (bedingt: {conditional})")
+        try:
+            with timed_phase("upload"):
                 upload_success = upload_to_s3(
-                    job_id, downloaded_file, s3_object_name, file_extension, bucket_name,
-                    access_key, secret_key, region_name, endpoint_url
+                    job_id, downloaded_file, candidate_name, file_extension, bucket_name,
+                    ctx.access_key, ctx.secret_key, ctx.region_name, ctx.endpoint_url, ctx.cancel_event, ctx.stream_source,
+                    if_none_match=conditional, failure=ctx.failure
                 )
-                logging.info(f"[{job_id}] upload_to_s3 Aufruf beendet. Erfolg: {upload_success}")
+        except ObjectNameTakenError:
+            METRIC_S3_NAME_CHECKS.inc(method="conditional", result="taken")
+            logging.warning(f"[{job_id}] S3 Name '{candidate_name}' existiert bereits (Versuch {attempt}/{MAX_FILENAME_RETRIES}).")
+            continue
+        except ConditionalWriteUnsupportedError as e:
+            METRIC_S3_NAME_CHECKS.inc(method="conditional", result="unsupported")
+            mark_conditional_writes_unsupported(ctx.endpoint_url)
+            logging.warning(f"[{job_id}] S3 Anbieter unterstützt keine bedingten Uploads, weiche auf HEAD-Probe aus: {e}")
+            if S3_CONDITIONAL_WRITES == 'true':
+                update_status(job_id, error="S3 Anbieter unterstützt keine bedingten Uploads (S3_CONDITIONAL_WRITES=true).", running=False)
+                return None
+            continue
+        if conditional and upload_success: METRIC_S3_NAME_CHECKS.inc(method="conditional", result="free")
+        s3_object_name = candidate_name
+        break
+
+    if ctx.failure: return retry_after_failure(ctx) # Lokale Datei bleibt, der nächste Versuch lädt nur neu hoch
+    if s3_object_name is None:
+        final_error_message = f"Konnte keinen eindeutigen S3 Namen nach {MAX_FILENAME_RETRIES} Versuchen finden."
+        logging.error(f"[{job_id}] {final_error_message}")
+        update_status(job_id, error=final_error_message, running=False)
+        return None
+
+    if upload_success and ctx.stream_source:
+        ctx.file_size_bytes = ctx.stream_source.get('uploaded_bytes', 0)
+        ctx.content_hash = ctx.stream_source.get('content_hash')
+    logging.info(f"[{job_id}] upload_to_s3 Aufruf beendet. Erfolg: {upload_success}")
+
+    if job_store.get_field(job_id, "error") is not None:
+         logging.error(f"[{job_id}] Fehler während Upload erkannt. Breche Verarbeitung ab.")
+         return None
+    if not upload_success:
+         final_error_message = "Upload fehlgeschlagen (unerwarteter Zustand)."
+         logging.error(f"[{job_id}] {final_error_message}")
+         update_status(job_id, error=final_error_message, running=False)
+         return None
+
+    logging.info(f"[{job_id}] Upload erfolgreich.")
+    update_status(job_id, message="Upload erfolgreich!", progress=100)
+    save_checkpoint(ctx, "uploaded", object_name=s3_object_name, size=ctx.file_size_bytes, content_hash=ctx.content_hash)
+    return publish_upload_result(ctx, s3_object_name)
+
+
+def publish_result_url(job_id, object_name):
+    """Setzt Ergebnis-URL und Abschlussmeldung für ein (ggf. wiederverwendetes) S3 Objekt. Gibt die Public URL zurück."""
+    public_url = build_public_url(object_name)
+    if public_url:
+        update_status(job_id, result_url=public_url, message="Abgeschlossen!", progress=100)
+        logging.info(f"[{job_id}] Datei öffentlich erreichbar unter: {public_url}")
+    else:
+        update_status(job_id, message="Abgeschlossen! (Keine Public URL Base konfiguriert)", progress=100)
+        logging.warning(f"[{job_id}] Öffentliche URL kann nicht angezeigt werden (S3_PUBLIC_URL_BASE fehlt).")
+    return public_url
 
-                with task_lock:
-                    job_failed_during_upload = job_statuses.get(job_id, {}).get("error") is not None
 
-                if job_failed_during_upload:
-                     logging.error(f"[{job_id}] Fehler während Upload erkannt. Breche Verarbeitung ab.")
-                elif not upload_success:
-                     final_error_message = "Upload fehlgeschlagen (unerwarteter Zustand)."
-                     logging.error(f"[{job_id}] {final_error_message}")
-                     update_status(job_id, error=final_error_message, running=False)
-                else:
-                    logging.info(f"[{job_id}] Upload erfolgreich.")
-                    update_status(job_id, message="Upload erfolgreich!", progress=100)
-                    process_ok = True
-                    final_s3_url_for_history = f"s3://{bucket_name}/{s3_object_name}"
-                    s3_public_url_base = os.getenv('S3_PUBLIC_URL_BASE')
-                    if s3_public_url_base:
-                        safe_object_name = urllib.parse.quote(s3_object_name)
-                        public_url = s3_public_url_base.rstrip('/') + '/' + safe_object_name
-                        update_status(job_id, result_url=public_url, message="Abgeschlossen!")
-                        final_s3_url_for_history = public_url
-                        logging.info(f"[{job_id}] Datei öffentlich erreichbar unter: {public_url}")
-                    else:
-                        update_status(job_id, message="Abgeschlossen! (Keine Public URL Base konfiguriert)")
-                        logging.warning(f"[{job_id}] Öffentliche URL kann nicht angezeigt werden (S3_PUBLIC_URL_BASE fehlt).")
-
-                    if not add_history_entry(platform, track_title, url, final_s3_url_for_history):
-                         logging.warning(f"[{job_id}] Konnte Eintrag nicht zur History hinzufügen.")
-                         update_status(job_id, log_entry="WARNUNG: Konnte Eintrag nicht zur History hinzufügen.")
+def publish_upload_result(ctx, s3_object_name):
+    """Abschluss nach erfolgreichem Upload: Public URL, Dedup-Cache und Verlauf."""
+    job_id = ctx.job_id
+    ctx.process_ok = True
+    public_url = publish_result_url(job_id, s3_object_name)
+    final_s3_url_for_history = public_url or f"s3://{ctx.bucket_name}/{s3_object_name}"
 
-    except Exception as e:
-        logging.exception(f"[{job_id}] Unerwarteter Fehler im Hauptverarbeitungsblock für URL {url}:")
-        final_error_message = f"Unerwarteter Verarbeitungsfehler: {strip_ansi_codes(str(e))}"
+    if dedup_cache is not None and ctx.media_key:
         try:
-            with task_lock:
-                if job_id in job_statuses and not job_statuses[job_id].get("error"):
-                     update_status(job_id, error=final_error_message, running=False)
-        except Exception as inner_e:
-             logging.error(f"[{job_id}] Kritischer Fehler: Konnte Fehlerstatus nach Hauptfehler nicht setzen: {inner_e}")
-        process_ok = False
+            dedup_cache.store(ctx.media_key, ctx.variant, ctx.bucket_name, s3_object_name, ctx.track_title,
+                              ctx.content_hash, ctx.file_size_bytes)
+        except sqlite3.Error as cache_e:
+            logging.warning(f"[{job_id}] Konnte Dedup-Cache nicht aktualisieren: {cache_e}")
 
-    finally:
-        end_time = time.time()
-        duration = end_time - start_time
-        final_status_to_set = None
-        job_success_status = 'FEHLER'
+    if not add_history_entry(ctx.platform, ctx.track_title, ctx.url, final_s3_url_for_history):
+         logging.warning(f"[{job_id}] Konnte Eintrag nicht zur History hinzufügen.")
+         update_status(job_id, log_entry="WARNUNG: Konnte Eintrag nicht zur History hinzufügen.")
+    return None
 
-        try:
-            with task_lock:
-                # Stelle sicher, dass der Job noch existiert, bevor darauf zugegriffen wird
-                if job_id in job_statuses:
-                    current_job_status = job_statuses.get(job_id, {})
-                    if current_job_status.get("error"):
-                        final_status_to_set = "error"
-                        job_success_status = 'FEHLER'
-                        process_ok = False
-                    elif process_ok:
-                         final_status_to_set = "completed"
-                         job_success_status = 'OK'
-                    else:
-                        final_status_to_set = "error"
-                        job_success_status = 'FEHLER'
-                        if not current_job_status.get("error"):
-                            logging.warning(f"[{job_id}] Prozess nicht erfolgreich, aber kein expliziter Fehler gesetzt. Setze Status auf 'error'.")
-                            error_msg_fallback = "Verarbeitung fehlgeschlagen (Grund unklar)."
-                            current_job_status_dict = dict(current_job_status)
-                            current_job_status_dict["error"] = error_msg_fallback
-                            current_job_status_dict["message"] = f"Fehler: {error_msg_fallback}"
-                            current_job_status_dict["status"] = "error"
-                            current_job_status_dict["running"] = False
-                            job_statuses[job_id] = current_job_status_dict
-                else:
-                     logging.warning(f"[{job_id}] Job nicht mehr in job_statuses im finally-Block.")
-                     # Kein Status kann mehr gesetzt werden
 
-            # Setze finalen Status und running=False nur, wenn Job noch existiert
-            if job_id in job_statuses:
-                 update_status(job_id, status_code=final_status_to_set, running=False)
+def finalize_job(ctx):
+    """Setzt den finalen Status, schreibt die Statistik und räumt lokale Dateien auf."""
+    job_id = ctx.job_id
+    duration = time.time() - ctx.start_time
+    final_status_to_set = None
+    job_success_status = 'FEHLER'
 
-        except Exception as final_status_e:
-             logging.exception(f"[{job_id}] Fehler beim Setzen des finalen Job-Status:")
-             try:
-                 if job_id in job_statuses: update_status(job_id, running=False)
-             except: pass
+    try:
+        # Stelle sicher, dass der Job noch existiert, bevor darauf zugegriffen wird
+        if job_id in job_store:
+            if job_store.get_field(job_id, "error"):
+                final_status_to_set = "error"
+                job_success_status = 'FEHLER'
+                ctx.process_ok = False
+            elif ctx.process_ok:
+                 final_status_to_set = "completed"
+                 job_success_status = 'OK'
+            else:
+                final_status_to_set = "error"
+                job_success_status = 'FEHLER'
+                logging.warning(f"[{job_id}] Prozess nicht erfolgreich, aber kein expliziter Fehler gesetzt. Setze Status auf 'error'.")
+                error_msg_fallback = "Verarbeitung fehlgeschlagen (Grund unklar)."
+                job_store.set_fields(job_id, error=error_msg_fallback, message=f"Fehler: {error_msg_fallback}",
+                                     status="error", running=False)
+        else:
+             logging.warning(f"[{job_id}] Job nicht mehr im Job-Store beim Abschluss.")
+             # Kein Status kann mehr gesetzt werden
 
-        logging.info(f"Worker-Task für Job {job_id} (URL {url}) beendet. Status: {job_success_status}, Dauer: {duration:.2f}s")
+        # Setze finalen Status und running=False nur, wenn Job noch existiert
+        if job_id in job_store:
+             update_status(job_id, status_code=final_status_to_set, running=False)
 
-        try:
-            actual_file_size = file_size_bytes if process_ok else 0
-            update_stats(duration, actual_file_size, process_ok)
-        except Exception as stats_e:
-             logging.error(f"[{job_id}] Fehler beim Aktualisieren der Statistik: {stats_e}")
-
-        if downloaded_file and os.path.exists(downloaded_file):
-             try:
-                  logging.info(f"[{job_id}] Versuche, lokale Datei zu löschen: {downloaded_file}")
-                  os.remove(downloaded_file)
-                  logging.info(f"[{job_id}] Temporäre lokale Datei '{os.path.basename(downloaded_file)}' erfolgreich gelöscht.")
-                  if process_ok and job_id in job_statuses:
-                      try: update_status(job_id, log_entry=f"Lokale Datei '{os.path.basename(downloaded_file)}' aufgeräumt.")
-                      except: pass
-             except OSError as e:
-                  logging.error(f"[{job_id}] Fehler beim Löschen der temporären Datei '{os.path.basename(downloaded_file)}': {e}")
-                  if job_id in job_statuses:
-                      try: update_status(job_id, log_entry=f"WARNUNG: Lokale Datei nicht gelöscht: {e}")
-                      except: pass
-             except Exception as cleanup_e:
-                  logging.exception(f"[{job_id}] Unerwarteter Fehler beim Aufräumen der Datei {downloaded_file}:")
-                  if job_id in job_statuses:
-                      try: update_status(job_id, log_entry=f"WARNUNG: Fehler beim Datei-Cleanup: {cleanup_e}")
-                      except: pass
-
-
-# --- Worker Thread Funktion (unverändert) ---
-def worker_thread_target():
-    logging.info(f"Worker-Thread {threading.current_thread().name} gestartet und wartet auf Tasks...")
+    except Exception as final_status_e:
+         logging.exception(f"[{job_id}] Fehler beim Setzen des finalen Job-Status:")
+         try:
+             if job_id in job_store: update_status(job_id, running=False)
+         except: pass
+
+    inflight_jobs.release(job_id) # Neue Anfragen starten ab jetzt einen eigenen Job (bzw. treffen den Dedup-Cache)
+    try: job_sync.release(job_id) # Finalen Status für andere Worker veröffentlichen, Lease freigeben
+    except Exception as sync_e: logging.error(f"[{job_id}] Fehler beim Freigeben im Job-Backend: {sync_e}")
+    logging.info(f"Worker-Task für Job {job_id} (URL {ctx.url}) beendet. Status: {job_success_status}, Dauer: {duration:.2f}s")
+
+    try:
+        actual_file_size = ctx.file_size_bytes if ctx.process_ok else 0
+        stats_aggregator.record_job(ctx.platform, duration, actual_file_size, ctx.process_ok)
+        METRIC_JOBS.inc(platform=ctx.platform, status="completed" if ctx.process_ok else "error")
+    except Exception as stats_e:
+         logging.error(f"[{job_id}] Fehler beim Aktualisieren der Statistik: {stats_e}")
+
+    work_dir = job_work_dir(job_id) # Enthält Download, Zwischenstände (.part) und konvertierte Datei
+    if os.path.isdir(work_dir):
+         try:
+              logging.info(f"[{job_id}] Versuche, Arbeitsverzeichnis zu löschen: {work_dir}")
+              shutil.rmtree(work_dir)
+              logging.info(f"[{job_id}] Arbeitsverzeichnis '{job_id}' erfolgreich gelöscht.")
+              if ctx.process_ok and ctx.downloaded_file and job_id in job_store:
+                  try: update_status(job_id, log_entry=f"Lokale Datei '{os.path.basename(ctx.downloaded_file)}' aufgeräumt.")
+                  except: pass
+         except OSError as e:
+              logging.error(f"[{job_id}] Fehler beim Löschen des Arbeitsverzeichnisses '{work_dir}': {e}")
+              if job_id in job_store:
+                  try: update_status(job_id, log_entry=f"WARNUNG: Lokale Dateien nicht gelöscht: {e}")
+                  except: pass
+         except Exception as cleanup_e:
+              logging.exception(f"[{job_id}] Unerwarteter Fehler beim Aufräumen von {work_dir}:")
+              if job_id in job_store:
+                  try: update_status(job_id, log_entry=f"WARNUNG: Fehler beim Datei-Cleanup: {cleanup_e}")
+                  except: pass
+
+
+# Stufen-Name -> (Handler, Eingangs-Queue). Die Download-Stufe least Aufträge über job_backend
+# (Scheduler mit Priorität und Limits) statt aus einer Queue.
+# Die Queues zwischen den Stufen sind begrenzt: Ist die nächste Stufe ausgelastet,
+# blockiert die vorherige (Backpressure) statt beliebig viele Dateien anzuhäufen.
+transcode_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+upload_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+PIPELINE_STAGES = {
+    "download": (stage_download, None),
+    "transcode": (stage_transcode, transcode_queue),
+    "upload": (stage_upload, upload_queue),
+}
+
+
+# --- Worker Thread Funktion (eine Funktion für alle Pipeline-Stufen) ---
+def pipeline_worker_target(stage_name):
+    handler, input_queue = PIPELINE_STAGES[stage_name]
+    logging.info(f"Worker-Thread {threading.current_thread().name} ({stage_name}) gestartet und wartet auf Tasks...")
     while True:
-        task_data = None
+        ctx = None
         current_job_id = None
+        next_stage = None
         try:
-            task_data = task_queue.get()
-            current_job_id = task_data[0]
-            task_args = task_data[1:]
-            logging.info(f"Worker {threading.current_thread().name} holt neuen Task [{current_job_id}] aus der Queue für URL: {task_args[0][:50]}...")
-            run_download_upload_task(current_job_id, *task_args)
-            logging.info(f"Worker {threading.current_thread().name} hat Task [{current_job_id}] beendet.")
+            if stage_name == "download":
+                leased = job_backend.lease(current_worker_id(), JOB_BACKEND_POLL_SECONDS * 10)
+                if leased is None: continue
+                task_data, attempts = leased
+                ctx = JobContext(*task_data)
+                current_job_id = ctx.job_id
+                if not job_sync.adopt(ctx, attempts):
+                    finalize_job(ctx)
+                    continue
+            else:
+                ctx = input_queue.get()
+            current_job_id = ctx.job_id
+            logging.info(f"Worker {threading.current_thread().name} holt neuen Task [{current_job_id}] ({stage_name}) für URL: {ctx.url[:50]}...")
+            if ctx.cancel_event.is_set(): # Während des Wartens auf diese Stufe abgebrochen
+                if not job_store.get_field(current_job_id, "error"): update_status(current_job_id, error="Job wurde abgebrochen.", running=False)
+                finalize_job(ctx)
+                continue
+            METRIC_IN_FLIGHT.inc(stage=stage_name)
+            try: next_stage = handler(ctx)
+            finally: METRIC_IN_FLIGHT.dec(stage=stage_name)
+            logging.info(f"Worker {threading.current_thread().name} hat Stufe '{stage_name}' für Task [{current_job_id}] beendet.")
         except Exception as e:
             logging.exception(f"Schwerwiegender Fehler im Worker-Thread {threading.current_thread().name} für Job {current_job_id}:")
+            next_stage = None
             try:
                 if current_job_id:
                     error_msg = f"Schwerer Worker-Fehler: {e}"
-                    with task_lock:
-                        if current_job_id in job_statuses and not job_statuses[current_job_id].get("error"):
-                            update_status(current_job_id, error=error_msg, running=False, status_code="error")
-                        elif current_job_id in job_statuses:
-                             update_status(current_job_id, running=False)
+                    if current_job_id in job_store and not job_store.get_field(current_job_id, "error"):
+                        update_status(current_job_id, error=error_msg, running=False, status_code="error")
+                    elif current_job_id in job_store:
+                         update_status(current_job_id, running=False)
                 else:
                     logging.error("Konnte Job-Status nach schwerem Worker-Fehler nicht aktualisieren (keine Job-ID).")
             except Exception as inner_e:
                 logging.error(f"Konnte Job-Status nach schwerem Worker-Fehler nicht aktualisieren: {inner_e}")
-            time.sleep(5)
+            if not current_job_id: time.sleep(5)
+
+        if ctx is None or next_stage == STAGE_REQUEUED: continue
+        if next_stage:
+            PIPELINE_STAGES[next_stage][1].put(ctx) # Blockiert, solange die nächste Stufe ausgelastet ist
+        else:
+            finalize_job(ctx)
 
 
 # --- Flask Routen ---
 @app.route('/')
 def index():
-    global job_statuses
-    if not isinstance(job_statuses, type(manager.dict())):
-        job_statuses = manager.dict()
-        logging.warning("job_statuses wurde neu initialisiert (wahrscheinlich nach Reload).")
     return render_template('index.html', history_enabled=ENABLE_HISTORY)
 
+def is_valid_source_url(url, platform):
+    """Prüft, ob die URL zur gewählten Plattform passt (unbekannte Plattformen werden durchgelassen)."""
+    if not (url and url.startswith(("http://", "https://"))): return False
+    parsed_url = urllib.parse.urlparse(url)
+    domain = parsed_url.netloc.lower()
+    path = parsed_url.path.lower()
+    if platform == "SoundCloud" and "soundcloud.com" in domain: return True
+    elif platform == "YouTube" and ("youtube.com" in domain or "youtu.be" in domain): return True
+    elif platform == "TikTok" and "tiktok.com" in domain: return True
+    elif platform == "Instagram" and "instagram.com" in domain and ("/reel/" in path or "/p/" in path): return True
+    elif platform == "Twitter" and ("twitter.com" in domain or "x.com" in domain) and "/status/" in path: return True
+    elif platform not in SUPPORTED_PLATFORMS:
+         logging.warning(f"Unbekannte Plattform '{platform}' angegeben, versuche trotzdem mit URL '{url}'")
+         return True
+    return False
+
+def invalid_url_message(platform):
+    error_msg = f"Ungültige URL für {platform}."
+    if platform == "Instagram": error_msg += " Stelle sicher, dass es ein Reel- oder Post-Link ist (enthält /reel/ oder /p/)."
+    if platform == "Twitter": error_msg += " Stelle sicher, dass es ein Tweet-Link ist (enthält /status/)."
+    return error_msg
+
+def read_s3_config():
+    """S3 Zugangsdaten aus der Umgebung; None, wenn die Konfiguration unvollständig ist."""
+    s3_config = {"access_key": os.getenv('AWS_ACCESS_KEY_ID'), "secret_key": os.getenv('AWS_SECRET_ACCESS_KEY'),
+                 "bucket_name": os.getenv('AWS_S3_BUCKET_NAME'), "region_name": os.getenv('AWS_REGION'),
+                 "endpoint_url": os.getenv('S3_ENDPOINT_URL')}
+    if not (s3_config["access_key"] and s3_config["secret_key"] and s3_config["bucket_name"]): return None
+    return s3_config
+
+def client_id_from_request():
+    """Client für das Limit je Client: die Gegenstelle (hinter Proxies per TRUSTED_PROXY_COUNT aus X-Forwarded-For)."""
+    return request.remote_addr
+
+def submit_job(url, platform, yt_format, mp3_bitrate, mp4_quality, codec_preference, s3_config, client_id=None, duration=None):
+    """Reiht einen Auftrag ein (bzw. beantwortet ihn aus dem Dedup-Cache). Liefert (Antwort, HTTP-Status).
+
+    Der Sortierwert in der Warteschlange beruht auf einer Schätzung (bzw. `duration`, z.B. aus der Playlist)
+    und wird nach der Extraktion mit den echten Metadaten korrigiert.
+    """
+    bucket_name = s3_config["bucket_name"]
+    job_id = str(uuid.uuid4())
+    variant = build_variant_key(platform, yt_format, mp3_bitrate, mp4_quality, codec_preference)
+    media_key = media_key_from_url(url)
+    if dedup_cache is not None:
+        # Wiederholte Anfrage (auch andere URL-Form desselben Mediums): vorhandenes Objekt sofort zurückgeben
+        try:
+            media_key = dedup_cache.resolve_url(url)
+            cached = dedup_cache.lookup(media_key, variant, bucket_name) if media_key else None
+        except sqlite3.Error as cache_e:
+            logging.warning(f"Dedup-Cache nicht verfügbar: {cache_e}"); cached = None
+        if cached:
+            job_store.create(job_id, log_entry=f"Bereits verarbeitet: '{cached['title']}', verwende vorhandene Datei.",
+                             status="completed", running=False)
+            result_url = publish_result_url(job_id, cached['object_name'])
+            job_backend.store_finished(job_id, job_store.export(job_id))
+            logging.info(f"Dedup-Cache Treffer [{job_id}] für {url} ({media_key}, {variant}): {cached['object_name']}")
+            return {"message": "Bereits verarbeitet.", "job_id": job_id, "result_url": result_url, "cached": True}, 200
+    elif ENABLE_HISTORY:
+        try: entry = history_store.find_by_source_url(url) if history_store is not None else None
+        except sqlite3.Error as e: logging.error(f"Fehler bei History-Abfrage: {e}"); entry = None
+        if entry:
+            entry_platform = entry.get('platform') or 'Unbekannt'
+            return {"error": f"Dieser Link ({entry_platform}) wurde bereits verarbeitet (Verlauf aktiv)."}, 400
+
+    inflight_key = (media_key or url.strip(), variant, bucket_name) # Vollständige URL, Query kann das Medium bestimmen
+    existing_job_id = inflight_jobs.claim(inflight_key, job_id)
+    if existing_job_id:
+        update_status(existing_job_id, log_entry="Weitere identische Anfrage an diesen Auftrag angehängt.")
+        logging.info(f"Anfrage für {url} an laufenden Job [{existing_job_id}] angehängt.")
+        return {"message": "Gleicher Auftrag läuft bereits, Status wird geteilt.", "job_id": existing_job_id, "attached": True}, 202
+
+    enqueued_at = time.time()
+    score = queue_score(enqueued_at, estimate_job_cost(platform, yt_format, codec_preference, duration))
+    task_args = (url, platform, yt_format, mp3_bitrate, mp4_quality, codec_preference,
+                 s3_config["access_key"], s3_config["secret_key"], bucket_name, s3_config["region_name"], s3_config["endpoint_url"],
+                 client_id, enqueued_at, score)
+
+    job_store.create(job_id, log_entry="Auftrag eingereiht.")
+
+    job_backend.enqueue((job_id,) + task_args, job_store.export(job_id))
+    logging.info(f"Neuer Task [{job_id}] zur Queue hinzugefügt für {url}.")
+
+    return {"message": f"Auftrag eingereiht.", "job_id": job_id}, 202
+
 @app.route('/start_download', methods=['POST'])
 def start_download():
-    # (Logik unverändert)
     url = request.form.get('url'); platform = request.form.get('platform', DEFAULT_PLATFORM)
     yt_format = request.form.get('yt_format', DEFAULT_YT_FORMAT); mp3_bitrate = request.form.get('mp3_bitrate', DEFAULT_MP3_BITRATE)
     mp4_quality = request.form.get('mp4_quality', DEFAULT_MP4_QUALITY)
     codec_preference = request.form.get('codec_preference', 'original')
 
-    is_valid_url = False
-    if url and url.startswith(("http://", "https://")):
-        parsed_url = urllib.parse.urlparse(url)
-        domain = parsed_url.netloc.lower()
-        path = parsed_url.path.lower()
-        if platform == "SoundCloud" and "soundcloud.com" in domain: is_valid_url = True
-        elif platform == "YouTube" and ("youtube.com" in domain or "youtu.be" in domain): is_valid_url = True
-        elif platform == "TikTok" and "tiktok.com" in domain: is_valid_url = True
-        elif platform == "Instagram" and "instagram.com" in domain and ("/reel/" in path or "/p/" in path): is_valid_url = True
-        elif platform == "Twitter" and ("twitter.com" in domain or "x.com" in domain) and "/status/" in path: is_valid_url = True
-        elif platform not in SUPPORTED_PLATFORMS:
-             logging.warning(f"Unbekannte Plattform '{platform}' angegeben, versuche trotzdem mit URL '{url}'")
-             is_valid_url = True
-
-    if not is_valid_url:
-        error_msg = f"Ungültige URL für {platform}."
-        if platform == "Instagram": error_msg += " Stelle sicher, dass es ein Reel- oder Post-Link ist (enthält /reel/ oder /p/)."
-        if platform == "Twitter": error_msg += " Stelle sicher, dass es ein Tweet-Link ist (enthält /status/)."
-        return jsonify({"error": error_msg}), 400
-
-    if ENABLE_HISTORY:
-        history = load_history()
-        for entry in history:
-            entry_url = entry.get('source_url') or entry.get('soundcloud_url')
-            if entry_url == url:
-                entry_platform = entry.get('platform', 'Unbekannt')
-                return jsonify({"error": f"Dieser Link ({entry_platform}) wurde bereits verarbeitet (Verlauf aktiv)."}), 400
-
-    access_key = os.getenv('AWS_ACCESS_KEY_ID'); secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-    bucket_name = os.getenv('AWS_S3_BUCKET_NAME'); region_name = os.getenv('AWS_REGION')
-    endpoint_url = os.getenv('S3_ENDPOINT_URL')
-    if not (access_key and secret_key and bucket_name): return jsonify({"error": "S3 Konfiguration in .env unvollständig."}), 500
-
-    job_id = str(uuid.uuid4())
-    task_args = (url, platform, yt_format, mp3_bitrate, mp4_quality, codec_preference,
-                 access_key, secret_key, bucket_name, region_name, endpoint_url)
-
-    with task_lock:
-        job_statuses[job_id] = {
-            "running": False, "message": "In Warteschlange...", "progress": 0.0,
-            "logs": [f"{datetime.now().strftime('%H:%M:%S')} - Auftrag eingereiht."],
-            "error": None, "result_url": None, "start_time": time.time(),
-            "last_update": time.time(), "status": "queued"
-        }
-
-    task_queue.put((job_id,) + task_args)
-    logging.info(f"Neuer Task [{job_id}] zur Queue hinzugefügt für {url}.")
-
-    return jsonify({"message": f"Auftrag eingereiht.", "job_id": job_id}), 202
+    if not is_valid_source_url(url, platform):
+        return jsonify({"error": invalid_url_message(platform)}), 400
+
+    s3_config = read_s3_config()
+    if s3_config is None: return jsonify({"error": "S3 Konfiguration in .env unvollständig."}), 500
+
+    payload, status_code = submit_job(url, platform, yt_format, mp3_bitrate, mp4_quality, codec_preference, s3_config,
+                                      client_id=client_id_from_request())
+    return jsonify(payload), status_code
+
+@app.route('/start_batch', methods=['POST'])
+def start_batch():
+    """Mehrere URLs (`urls`: JSON-Liste oder eine URL pro Zeile) und/oder eine Playlist (`playlist_url`) unter einer Batch-ID.
+
+    Die Batch-ID funktioniert mit /status, /status/stream und /status/poll wie eine Job-ID.
+    """
+    data = request.get_json(silent=True) or request.form
+    platform = data.get('platform', DEFAULT_PLATFORM)
+    options = (data.get('yt_format', DEFAULT_YT_FORMAT), data.get('mp3_bitrate', DEFAULT_MP3_BITRATE),
+               data.get('mp4_quality', DEFAULT_MP4_QUALITY), data.get('codec_preference', 'original'))
+    urls = data.get('urls') or []
+    if isinstance(urls, str): urls = urls.splitlines()
+    items = [{"url": str(url).strip(), "title": None, "duration": None} for url in urls if str(url).strip()]
+    playlist_url = (data.get('playlist_url') or '').strip()
+    if not items and not playlist_url:
+        return jsonify({"error": "Keine URLs oder Playlist angegeben."}), 400
+
+    s3_config = read_s3_config()
+    if s3_config is None: return jsonify({"error": "S3 Konfiguration in .env unvollständig."}), 500
+
+    batch_title = None
+    if playlist_url:
+        if not playlist_url.startswith(("http://", "https://")): return jsonify({"error": "Ungültige Playlist-URL."}), 400
+        try:
+            rate_limiter.acquire(platform)
+            batch_title, entries = expand_playlist(playlist_url)
+        except PlatformThrottledError as throttled:
+            return jsonify({"error": f"{throttled}."}), 429, {"Retry-After": str(math.ceil(throttled.delay))}
+        except yt_dlp.utils.DownloadError as e:
+            err_str = strip_ansi_codes(str(e))
+            if throttle_status(err_str) == 429:
+                delay = rate_limiter.penalize(platform, retry_after_from_error(e))
+                return jsonify({"error": f"{platform} drosselt Anfragen, bitte in {delay:.0f}s erneut versuchen."}), 429, {"Retry-After": str(math.ceil(delay))}
+            return jsonify({"error": f"Playlist konnte nicht gelesen werden: {err_str}"}), 400
+        items.extend(entries)
+    unique_items = {} # Doppelte URLs nur einmal, Reihenfolge bleibt
+    for item in items: unique_items.setdefault(item["url"], item)
+    items = list(unique_items.values())
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Zu viele Einträge ({len(items)}), maximal {BATCH_MAX_ITEMS} pro Batch."}), 400
+
+    children = []
+    client_id = client_id_from_request()
+    for item in items:
+        child = {"job_id": None, "url": item["url"], "title": item["title"], "status": "error", "progress": 0.0,
+                 "result_url": None, "error": None}
+        if not is_valid_source_url(item["url"], platform):
+            child["error"] = invalid_url_message(platform)
+        else:
+            payload, _ = submit_job(item["url"], platform, *options, s3_config, client_id=client_id, duration=item["duration"])
+            child["job_id"], child["error"] = payload.get("job_id"), payload.get("error")
+            if child["job_id"]: child["status"] = "queued"
+        children.append(child)
+
+    batch_id = str(uuid.uuid4())
+    batch_tracker.create(batch_id, children, batch_title)
+    logging.info(f"Neuer Batch [{batch_id}] mit {len(children)} Aufträgen ({sum(1 for c in children if c['job_id'])} eingereiht).")
+    return jsonify({"message": "Batch eingereiht.", "batch_id": batch_id, "job_id": batch_id,
+                    "jobs": [{"url": c["url"], "job_id": c["job_id"], "error": c["error"]} for c in children]}), 202
+
+def cancel_job(job_id):
+    """Bricht einen wartenden oder laufenden Job bzw. alle Aufträge eines Batches ab. Liefert (Antwort, HTTP-Status).
+
+    Wartende Aufträge werden aus der Warteschlange entfernt. Laufende stoppen über ihr `cancel_event`
+    (yt-dlp, FFmpeg und Multipart Upload prüfen es); läuft der Job auf einem anderen Worker,
+    geht der Abbruch über das Job-Backend.
+    """
+    if not job_sync.refresh(job_id): return {"error": "Job nicht gefunden oder bereits aufgeräumt."}, 404
+    children = job_store.get_field(job_id, "children")
+    if children is not None:
+        cancelled = [child["job_id"] for child in children if child.get("job_id") and cancel_job(child["job_id"])[1] == 202]
+        return {"message": f"{len(cancelled)} Aufträge abgebrochen.", "job_id": job_id, "cancelled": cancelled}, 202
+    if job_backend.cancel_queued(job_id):
+        update_status(job_id, error="Job wurde abgebrochen.", running=False, status_code="error")
+        inflight_jobs.release(job_id)
+        job_backend.store_finished(job_id, job_store.export(job_id))
+    elif not (job_sync.cancel_local(job_id) or job_backend.request_cancel(job_id)):
+        return {"error": "Job ist bereits abgeschlossen."}, 409
+    METRIC_SCHEDULER.inc(event="cancelled")
+    logging.info(f"Abbruch für Job [{job_id}] angefordert.")
+    return {"message": "Job wird abgebrochen.", "job_id": job_id}, 202
+
+@app.route('/cancel', methods=['POST'])
+def cancel_route():
+    data = request.get_json(silent=True) or request.form
+    job_id = data.get('job_id') or request.args.get('job_id')
+    if not job_id: return jsonify({"error": "Job ID fehlt."}), 400
+    payload, status_code = cancel_job(job_id)
+    return jsonify(payload), status_code
 
 @app.route('/status')
 def get_status():
@@ -823,32 +3698,110 @@ def get_status():
     if not job_id:
         return jsonify({"error": "Job ID fehlt.", "running": False, "status": "error"}), 400
 
-    with task_lock:
-        if job_id not in job_statuses:
-             return jsonify({"error": "Job nicht gefunden oder bereits aufgeräumt.", "running": False, "status": "not_found"}), 404
-        current_status_copy = dict(job_statuses[job_id])
-        if current_status_copy.get("status") == "queued":
-            position = 1
-            total_queued = 0
-            current_job_start_time = current_status_copy.get("start_time", 0)
-            all_job_ids = list(job_statuses.keys())
-            for other_job_id in all_job_ids:
-                other_status = job_statuses.get(other_job_id)
-                if other_status and other_status.get("status") == "queued":
-                    total_queued += 1
-                    if other_job_id != job_id and other_status.get("start_time", 0) < current_job_start_time:
-                        position += 1
-            current_status_copy["position"] = position
-            current_status_copy["total_queued"] = total_queued
-        current_status_copy.pop("queue_size", None)
-        if "logs" in current_status_copy and not isinstance(current_status_copy["logs"], list):
-             current_status_copy["logs"] = list(current_status_copy["logs"])
-        return jsonify(current_status_copy)
+    job_sync.refresh(job_id)
+    current_status_copy = job_store.snapshot(job_id)
+    if current_status_copy is None:
+         return jsonify({"error": "Job nicht gefunden oder bereits aufgeräumt.", "running": False, "status": "not_found"}), 404
+    if current_status_copy.get("status") == "queued":
+        current_status_copy["position"], current_status_copy["total_queued"] = get_queue_position(job_id)
+    return jsonify(current_status_copy)
+
+def _build_status_delta(job_id, since_version, since_log_seq, last_position=None):
+    delta = job_store.delta(job_id, since_version, since_log_seq)
+    if delta is None: return None
+    if job_store.get_field(job_id, "status") == "queued":
+        position = get_queue_position(job_id)
+        if position != last_position:
+            delta["fields"]["position"], delta["fields"]["total_queued"] = position
+    return delta
+
+def _is_final_status(job_id):
+    return job_store.get_field(job_id, "status") in ("completed", "error") and not job_store.get_field(job_id, "running")
+
+def _parse_status_cursor(value):
+    # Format "<version>:<log_seq>" (z.B. aus dem Last-Event-ID Header)
+    try:
+        version, log_seq = (value or "0:0").split(":", 1)
+        return max(0, int(version)), max(0, int(log_seq))
+    except ValueError:
+        return 0, 0
+
+@app.route('/status/stream')
+def stream_status():
+    """Server-Sent Events: sendet nur geänderte Felder und neue Log-Zeilen eines Jobs."""
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return jsonify({"error": "Job ID fehlt.", "running": False, "status": "error"}), 400
+    since_version, since_log_seq = _parse_status_cursor(request.headers.get('Last-Event-ID'))
+
+    def generate():
+        version, log_seq = since_version, since_log_seq
+        last_position = None
+        stream_deadline = time.monotonic() + STATUS_STREAM_MAX_SECONDS
+        yield f"retry: {STATUS_STREAM_RETRY_MS}\n\n"
+        job_sync.refresh(job_id)
+        while time.monotonic() < stream_deadline:
+            delta = _build_status_delta(job_id, version, log_seq, last_position)
+            if delta is None:
+                payload = {"error": "Job nicht gefunden oder bereits aufgeräumt.", "running": False, "status": "not_found"}
+                yield f"event: not_found\ndata: {json.dumps(payload)}\n\n"
+                return
+            if delta["fields"] or delta["logs"] or version == 0:
+                if "position" in delta["fields"]: last_position = (delta["fields"]["position"], delta["fields"]["total_queued"])
+                version, log_seq = delta["version"], delta["log_seq"]
+                yield f"id: {version}:{log_seq}\ndata: {json.dumps(delta)}\n\n"
+            if _is_final_status(job_id): return
+            # Warteschlangen-Position ändert sich ohne Update am eigenen Job, daher kürzer warten
+            timeout = STATUS_STREAM_QUEUED_RECHECK_SECONDS if job_store.get_field(job_id, "status") == "queued" else STATUS_STREAM_KEEPALIVE_SECONDS
+            if not wait_for_status_change(job_id, version, timeout):
+                if timeout == STATUS_STREAM_KEEPALIVE_SECONDS: yield ": keepalive\n\n"
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(generate(), mimetype='text/event-stream', headers=headers)
+
+@app.route('/status/poll')
+def poll_status():
+    """Long-Poll Fallback: wartet bis zu `timeout` Sekunden auf eine Änderung und liefert das Delta."""
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return jsonify({"error": "Job ID fehlt.", "running": False, "status": "error"}), 400
+    try:
+        since_version = max(0, int(request.args.get('since', 0)))
+        since_log_seq = max(0, int(request.args.get('log_since', 0)))
+        timeout = min(LONG_POLL_MAX_TIMEOUT_SECONDS, max(0.0, float(request.args.get('timeout', LONG_POLL_MAX_TIMEOUT_SECONDS))))
+    except ValueError:
+        return jsonify({"error": "Ungültige Parameter.", "running": False, "status": "error"}), 400
+    if not job_sync.refresh(job_id):
+        return jsonify({"error": "Job nicht gefunden oder bereits aufgeräumt.", "running": False, "status": "not_found"}), 404
+    if since_version > 0 and not _is_final_status(job_id):
+        if job_store.get_field(job_id, "status") == "queued": timeout = min(timeout, STATUS_STREAM_QUEUED_RECHECK_SECONDS)
+        wait_for_status_change(job_id, since_version, timeout)
+    delta = _build_status_delta(job_id, since_version, since_log_seq)
+    if delta is None:
+        return jsonify({"error": "Job nicht gefunden oder bereits aufgeräumt.", "running": False, "status": "not_found"}), 404
+    return jsonify(delta)
 
 @app.route('/history')
 def get_history():
-    history = load_history()
-    return jsonify(history)
+    # Paginierung per Cursor (?cursor=<id>) oder Offset, Filter: platform, since, until
+    limit = max(1, min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), HISTORY_MAX_PAGE_SIZE))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    query = dict(limit=limit, offset=offset, before_id=request.args.get('cursor', type=int),
+                 platform=request.args.get('platform') or None,
+                 since=request.args.get('since') or None, until=request.args.get('until') or None)
+    if history_store is None: return jsonify({"entries": [], "next_cursor": None})
+    try:
+        etag = history_store.current_etag(**query)
+        if request.if_none_match.contains(etag): # Unverändert: nur die Version wird abgefragt
+            response = Response(status=304); response.set_etag(etag); return response
+        etag, body = history_store.page_response(**query)
+    except sqlite3.Error as e:
+        logging.error(f"Fehler Laden History: {e}")
+        return jsonify({"error": "Fehler beim Laden des Verlaufs."}), 500
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache' # Browser fragt mit If-None-Match nach
+    return response
 
 @app.route('/clear_history', methods=['POST'])
 def clear_history_route():
@@ -859,7 +3812,8 @@ def clear_history_route():
 
 @app.route('/stats')
 def get_stats():
-    stats_data = load_stats()
+    snapshot = stats_aggregator.snapshot()
+    stats_data = snapshot.totals
     avg_duration = 0.0
     if stats_data.get('successful_jobs', 0) > 0:
         avg_duration = stats_data.get('total_duration_seconds', 0.0) / stats_data['successful_jobs']
@@ -867,11 +3821,20 @@ def get_stats():
         "total_jobs": stats_data.get('total_jobs', 0),
         "successful_jobs": stats_data.get('successful_jobs', 0),
         "average_duration_seconds": round(avg_duration, 2),
-        "total_size_formatted": format_size(stats_data.get('total_size_bytes', 0))
+        "total_size_formatted": format_size(stats_data.get('total_size_bytes', 0)),
+        "platforms": snapshot.platforms,
+        # Perzentile sind Bucket-Obergrenzen (Genauigkeit ca. ±20%)
+        "phases": {phase: {"count": sum(counts), "p50": latency_percentile(counts, 50),
+                           "p95": latency_percentile(counts, 95), "p99": latency_percentile(counts, 99)}
+                   for phase, counts in snapshot.latency.items()},
     }
     return jsonify(formatted_stats)
 
-# --- Cleanup Funktion (leicht angepasst für Manager Dict) ---
+@app.route('/metrics')
+def get_metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# --- Cleanup Funktion ---
 def cleanup_old_jobs():
     logging.info("Job Status Cleanup Thread gestartet.")
     while True:
@@ -879,21 +3842,27 @@ def cleanup_old_jobs():
         now = time.time()
         jobs_to_remove = []
         try:
-            current_job_ids = list(job_statuses.keys())
-            for job_id in current_job_ids:
-                status = job_statuses.get(job_id)
-                if not status: continue
-                is_running = status.get("running", False)
-                last_update = status.get("last_update", 0)
-                is_queued_long_time = status.get("status") == "queued" and (now - status.get("start_time", 0)) > (JOB_STATUS_TTL_SECONDS * 2)
+            for job_id in job_store.job_ids():
+                if job_id not in job_store: continue
+                is_running = job_store.get_field(job_id, "running", False)
+                last_update = job_store.get_field(job_id, "last_update", 0)
+                is_queued_long_time = job_store.get_field(job_id, "status") == "queued" and (now - job_store.get_field(job_id, "start_time", 0)) > (JOB_STATUS_TTL_SECONDS * 2)
                 if (not is_running and (now - last_update) > JOB_STATUS_TTL_SECONDS) or is_queued_long_time:
-                    if is_queued_long_time:
-                         logging.warning(f"Räume sehr alten 'queued' Job {job_id} auf (möglicherweise hängt der Worker).")
                     jobs_to_remove.append(job_id)
+            if jobs_to_remove:
+                # Noch wartende (zurückgestellt, gedrosselt, Wiederholung) oder geleaste Jobs behalten ihren Status
+                still_active = job_backend.active_jobs(jobs_to_remove)
+                jobs_to_remove = [job_id for job_id in jobs_to_remove if job_id not in still_active]
+                for job_id in jobs_to_remove:
+                    if job_store.get_field(job_id, "status") == "queued":
+                        logging.warning(f"Räume sehr alten 'queued' Job {job_id} auf (nicht mehr in der Warteschlange des Job-Backends).")
             if jobs_to_remove:
                 logging.info(f"Räume {len(jobs_to_remove)} alte Job-Status auf: {', '.join(jobs_to_remove)}")
                 for job_id in jobs_to_remove:
-                    job_statuses.pop(job_id, None)
+                    job_store.remove(job_id)
+                    job_sync.forget(job_id)
+            job_backend.purge(now - JOB_STATUS_TTL_SECONDS * 2)
+            sweep_work_dir(min_age=JOB_STATUS_TTL_SECONDS * 2) # Artefakte von Jobs, die auf einem anderen Host weiterliefen
         except Exception as e:
             logging.error(f"Fehler im Cleanup Thread: {e}", exc_info=True)
 
@@ -918,12 +3887,30 @@ def start_background_threads():
              _background_threads = []
 
     logging.info("Starte Hintergrund-Threads global...")
-    print(f"--> Starte {MAX_WORKERS} Worker-Thread(s) global...")
-    for i in range(MAX_WORKERS):
-        worker = threading.Thread(target=worker_thread_target, daemon=True, name=f"BGWorker-{i+1}")
-        worker.start()
-        _background_threads.append(worker)
-        print(f"--> Worker {i+1} gestartet.")
+    try: sweep_work_dir() # Reste abgebrochener Läufe, bevor neue Jobs starten
+    except OSError as e: logging.error(f"Fehler beim Aufräumen des Arbeitsverzeichnisses: {e}")
+    pool_sizes = {"download": DOWNLOAD_WORKERS, "transcode": TRANSCODE_WORKERS, "upload": UPLOAD_WORKERS}
+    for stage_name, pool_size in pool_sizes.items():
+        print(f"--> Starte {pool_size} {stage_name}-Worker-Thread(s) global...")
+        for i in range(pool_size):
+            worker = threading.Thread(target=pipeline_worker_target, args=(stage_name,), daemon=True,
+                                      name=f"BGWorker-{stage_name}-{i+1}")
+            worker.start()
+            _background_threads.append(worker)
+        print(f"--> {pool_size} {stage_name}-Worker gestartet.")
+
+    if job_backend.shared:
+        job_sync_thread = threading.Thread(target=job_sync.run, daemon=True, name="JobSyncThread")
+        job_sync_thread.start()
+        _background_threads.append(job_sync_thread)
+
+    batch_thread = threading.Thread(target=batch_tracker.run, daemon=True, name="BatchThread")
+    batch_thread.start()
+    _background_threads.append(batch_thread)
+
+    stats_flusher = threading.Thread(target=stats_flush_loop, daemon=True, name="StatsFlushThread")
+    stats_flusher.start()
+    _background_threads.append(stats_flusher)
 
     print("--> Starte Job Status Cleanup Thread global...")
     cleanup = threading.Thread(target=cleanup_old_jobs, daemon=True, name="CleanupThread")
@@ -933,15 +3920,16 @@ def start_background_threads():
     _threads_started_globally = True
     logging.info(f"Hintergrund-Threads global gestartet ({len(_background_threads)} Threads).")
 
-start_background_threads()
+# Werkzeuge, die app nur importieren (z.B. benchmarks/), setzen BACKGROUND_THREADS=false: kein Aufräumen
+# von JOB_WORK_DIR, keine Pipeline-Worker und kein Leasen von Aufträgen aus dem Job-Backend.
+if os.getenv('BACKGROUND_THREADS', 'true').lower() == 'true': start_background_threads()
 
 # --- Hauptprogramm (nur für lokale Entwicklung mit `python app.py`) ---
 if __name__ == '__main__':
-    import shutil
     if shutil.which("ffmpeg") is None: print("\nWARNUNG: FFmpeg nicht im PATH gefunden (innerhalb Containers OK).\n")
     else: print("\nINFO: FFmpeg gefunden.\n")
     print(f"\nFlask App startet (lokaler Modus)...");
-    print(f"Download-Verzeichnis: {DOWNLOAD_DIR}")
+    print(f"Arbeitsverzeichnis: {JOB_WORK_DIR}")
     print(f"Verlauf aktiviert: {ENABLE_HISTORY}")
     print(f"Öffne http://127.0.0.1:5000 oder http://<Deine-IP>:5000 im Browser.")
     print("(Beende mit STRG+C)\n")
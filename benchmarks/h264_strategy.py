@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Vergleicht die beiden H.264-Strategien (H264_FORMAT_STRATEGY) pro Job.
+
+'prefer' fragt H.264/AAC Formate direkt bei der Plattform an, 'transcode'
+lädt das beste Format und konvertiert danach. Gemessen werden Wall-Zeit und
+CPU-Sekunden (eigener Prozess + FFmpeg-Kindprozesse) für Download und
+Konvertierung, ohne S3 Upload.
+
+Aufruf (im Projektverzeichnis):
+    python benchmarks/h264_strategy.py --platform YouTube --quality "Medium (~720p)" URL [URL ...]
+"""
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['BACKGROUND_THREADS'] = 'false' # Keine Worker/Aufräumläufe, die einem laufenden Server in die Quere kommen
+import app  # noqa: E402
+
+app.info_cache = None # Jede Messung extrahiert selbst, sonst wäre die zweite Strategie im Vorteil
+
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run_job(url, platform, quality, strategy, work_dir):
+    app.H264_FORMAT_STRATEGY = strategy
+    job_id = f"bench-{uuid.uuid4()}"
+    app.job_store.create(job_id, log_entry=f"Benchmark ({strategy})")
+    wall_start = time.perf_counter(); cpu_start = cpu_seconds()
+    downloaded_file, _, _ = app.download_track(job_id, url, platform, 'mp4', app.DEFAULT_MP3_BITRATE, quality, 'h264', work_dir)
+    converted_file = app.convert_to_h264(job_id, downloaded_file) if downloaded_file else None
+    result = {
+        "strategy": strategy,
+        "wall_seconds": time.perf_counter() - wall_start,
+        "cpu_seconds": cpu_seconds() - cpu_start,
+        "ok": converted_file is not None,
+        "size_bytes": os.path.getsize(converted_file) if converted_file else 0,
+        "path": next((line.split("(Pfad: ")[1].rstrip(").") for line in app.job_store.snapshot(job_id)["logs"] if "(Pfad: " in line), "-"),
+    }
+    app.job_store.remove(job_id)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--platform', default="YouTube", choices=["YouTube", "TikTok", "Instagram", "Twitter"])
+    parser.add_argument('--quality', default=app.DEFAULT_MP4_QUALITY, choices=app.MP4_QUALITIES)
+    parser.add_argument('--repeat', type=int, default=1, help="Durchläufe pro URL und Strategie")
+    args = parser.parse_args()
+
+    results = []
+    for url in args.urls:
+        for _ in range(args.repeat):
+            for strategy in ('transcode', 'prefer'):
+                work_dir = tempfile.mkdtemp(prefix="h264-bench-")
+                try:
+                    result = run_job(url, args.platform, args.quality, strategy, work_dir)
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                result["url"] = url
+                results.append(result)
+                print(f"{strategy:<10} {result['path']:<10} wall={result['wall_seconds']:8.2f}s cpu={result['cpu_seconds']:8.2f}s "
+                      f"size={app.format_size(result['size_bytes']):>10} ok={result['ok']}  {url}", flush=True)
+
+    print("\nDurchschnitt pro Job:")
+    for strategy in ('transcode', 'prefer'):
+        runs = [r for r in results if r["strategy"] == strategy and r["ok"]]
+        if not runs:
+            print(f"  {strategy:<10} keine erfolgreichen Läufe"); continue
+        wall = sum(r["wall_seconds"] for r in runs) / len(runs)
+        cpu = sum(r["cpu_seconds"] for r in runs) / len(runs)
+        print(f"  {strategy:<10} wall={wall:8.2f}s cpu={cpu:8.2f}s ({len(runs)} Läufe)")
+
+
+if __name__ == '__main__':
+    main()
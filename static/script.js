@@ -20,6 +20,8 @@ document.addEventListener('DOMContentLoaded', () => {
         errorMessage: '#error-message',
         historyTableBody: '#history-table tbody',
         clearHistoryButton: '#clear-history-button',
+        historyPlatformFilter: '#history-platform-filter',
+        historyLoadMoreButton: '#history-load-more',
         contextMenu: '#context-menu',
         queueInfo: '#queue-info',
         statsTotalJobs: '#stats-total-jobs',
@@ -36,9 +38,15 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const dom = {};
     let pollingInterval = null;
+    let statusSource = null; // EventSource für /status/stream
+    let longPollController = null;
+    let statusMode = null; // 'sse' | 'longpoll' | 'interval'
+    let jobState = {}; // Aus Deltas zusammengeführter Job-Status
+    let statusCursor = { version: 0, logSeq: 0 };
     let currentJobId = null;
     let isPolling = false;
     const historyEnabled = !!document.querySelector(selectors.clearHistoryButton);
+    let historyNextCursor = null; // Cursor für "Mehr laden" (ID des letzten geladenen Eintrags)
     const videoPlatforms = ['YouTube', 'TikTok', 'Instagram', 'Twitter'];
 
     const memeMessages = [
@@ -60,7 +68,7 @@ document.addEventListener('DOMContentLoaded', () => {
     function init() {
         for (const key in selectors) {
             dom[key] = document.querySelector(selectors[key]);
-            if (!dom[key] && !['copyResultUrlLink', 'clearHistoryButton', 'historyTableBody', 'contextMenu'].includes(key)) {
+            if (!dom[key] && !['copyResultUrlLink', 'clearHistoryButton', 'historyTableBody', 'historyPlatformFilter', 'historyLoadMoreButton', 'contextMenu'].includes(key)) {
                  console.warn(`DOM-Element nicht gefunden: ${selectors[key]}`);
             }
         }
@@ -87,6 +95,8 @@ document.addEventListener('DOMContentLoaded', () => {
         dom.platformRadios.forEach(radio => radio.addEventListener('change', updateDynamicOptionsVisibility));
         dom.ytFormatRadios.forEach(radio => radio.addEventListener('change', updateYoutubeQualityVisibility));
         if (dom.clearHistoryButton) dom.clearHistoryButton.addEventListener('click', handleClearHistory);
+        if (dom.historyPlatformFilter) dom.historyPlatformFilter.addEventListener('change', () => fetchHistory());
+        if (dom.historyLoadMoreButton) dom.historyLoadMoreButton.addEventListener('click', () => fetchHistory(true));
         document.addEventListener('click', hideContextMenu);
         if (dom.contextMenu) dom.contextMenu.addEventListener('click', handleContextMenuClick);
         if (dom.historyTableBody && historyEnabled) {
@@ -314,6 +324,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (response.ok) {
                     appendLog('Verlauf erfolgreich gelöscht.', 'info');
                     dom.historyTableBody.innerHTML = '<tr><td colspan="5" class="text-center text-muted">Verlauf wurde gelöscht.</td></tr>';
+                    historyNextCursor = null;
+                    if (dom.historyLoadMoreButton) dom.historyLoadMoreButton.classList.add('d-none');
                 } else {
                     const result = await response.json(); throw new Error(result.error || 'Unbekannter Fehler.');
                 }
@@ -325,7 +337,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // --- Polling ---
+    // --- Status-Updates (SSE mit Long-Poll- und Intervall-Fallback) ---
     function startPolling() {
         if (!currentJobId) return;
         stopPolling();
@@ -334,20 +346,103 @@ document.addEventListener('DOMContentLoaded', () => {
              dom.submitButton.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Verarbeite...';
              dom.submitButton.disabled = true;
         }
-        pollingInterval = setInterval(fetchStatus, 2000);
-        fetchStatus();
-        console.log(`Polling gestartet für Job ${currentJobId}.`);
+        jobState = {};
+        statusCursor = { version: 0, logSeq: 0 };
+        if (window.EventSource) startEventStream();
+        else startLongPoll();
     }
 
     function stopPolling() {
+        statusMode = null;
+        if (statusSource) {
+            statusSource.close();
+            statusSource = null;
+        }
+        if (longPollController) {
+            longPollController.abort();
+            longPollController = null;
+        }
         if (pollingInterval) {
             clearInterval(pollingInterval);
             pollingInterval = null;
+        }
+        if (isPolling) {
             isPolling = false;
-            console.log("Polling gestoppt.");
+            console.log("Status-Updates gestoppt.");
+        }
+    }
+
+    function startEventStream() {
+        statusMode = 'sse';
+        statusSource = new EventSource(`/status/stream?job_id=${encodeURIComponent(currentJobId)}`);
+        statusSource.onmessage = (event) => applyStatusDelta(JSON.parse(event.data));
+        statusSource.addEventListener('not_found', (event) => handleJobNotFound(JSON.parse(event.data)));
+        statusSource.onerror = () => {
+            // EventSource verbindet selbst neu; nur bei endgültigem Abbruch auf Long-Polling wechseln
+            if (statusSource && statusSource.readyState === EventSource.CLOSED) {
+                statusSource = null;
+                console.warn('SSE-Verbindung geschlossen, wechsle auf Long-Polling.');
+                if (isPolling) startLongPoll();
+            }
+        };
+        console.log(`SSE-Stream gestartet für Job ${currentJobId}.`);
+    }
+
+    async function startLongPoll() {
+        statusMode = 'longpoll';
+        const jobId = currentJobId;
+        let failures = 0;
+        console.log(`Long-Polling gestartet für Job ${jobId}.`);
+        while (isPolling && statusMode === 'longpoll' && currentJobId === jobId) {
+            try {
+                longPollController = new AbortController();
+                const params = new URLSearchParams({
+                    job_id: jobId, since: statusCursor.version, log_since: statusCursor.logSeq, timeout: 25
+                });
+                const response = await fetch(`/status/poll?${params}`, { signal: longPollController.signal });
+                if (response.status === 404) {
+                    handleJobNotFound(await response.json());
+                    return;
+                }
+                if (!response.ok) throw new Error(`Status-Serverfehler: ${response.status}`);
+                applyStatusDelta(await response.json());
+                failures = 0;
+            } catch (error) {
+                if (error.name === 'AbortError') return;
+                failures++;
+                console.warn('Long-Poll-Fehler:', error);
+                if (failures >= 3) {
+                    console.warn('Long-Polling fehlgeschlagen, wechsle auf Intervall-Polling.');
+                    startIntervalPolling();
+                    return;
+                }
+                await new Promise(resolve => setTimeout(resolve, 2000));
+            }
         }
     }
 
+    function startIntervalPolling() {
+        statusMode = 'interval';
+        pollingInterval = setInterval(fetchStatus, 2000);
+        fetchStatus();
+        console.log(`Polling gestartet für Job ${currentJobId}.`);
+    }
+
+    function applyStatusDelta(delta) {
+        if (!delta || !isPolling) return;
+        Object.assign(jobState, delta.fields || {});
+        const newLogs = Array.isArray(delta.logs) ? delta.logs : [];
+        statusCursor = { version: delta.version, logSeq: delta.log_seq };
+        renderStatus(jobState, newLogs);
+    }
+
+    function handleJobNotFound(status) {
+        showError(status.error || "Auftrag nicht gefunden (möglicherweise zu alt).");
+        stopPolling();
+        hideProcessingOverlay();
+        resetSubmitButton();
+    }
+
     async function fetchStatus() {
         if (!currentJobId || !isPolling) {
             stopPolling();
@@ -356,58 +451,11 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             const response = await fetch(`/status?job_id=${currentJobId}`);
             if (response.status === 404) {
-                const status = await response.json();
-                showError(status.error || "Auftrag nicht gefunden (möglicherweise zu alt).");
-                stopPolling();
-                hideProcessingOverlay();
-                resetSubmitButton();
+                handleJobNotFound(await response.json());
                 return;
             }
             if (!response.ok) throw new Error(`Status-Serverfehler: ${response.status}`);
-            
-            const status = await response.json();
-            
-            if (dom.logContent && Array.isArray(status.logs)) {
-                 dom.logContent.textContent = status.logs.join('\n') + '\n';
-                 if (dom.logOutput) dom.logOutput.scrollTop = dom.logOutput.scrollHeight;
-            }
-
-            const isRunning = status.running === true;
-            const isQueued = status.status === 'queued';
-            const isCompleted = status.status === 'completed';
-            const isError = !!status.error || status.status === 'error';
-            const isNotFound = status.status === 'not_found';
-
-            // Status und Fortschritt an beide UI-Teile senden
-            updateAllProgressBars(status.progress || 0, isError, isRunning, isQueued);
-            if (isQueued && status.position !== undefined && status.total_queued !== undefined) {
-                updateAllStatusMessages(status.message || 'In Warteschlange...', status.position, status.total_queued);
-            } else {
-                updateAllStatusMessages(status.message || '...');
-            }
-
-            if (isCompleted || isError || isNotFound) {
-                stopPolling();
-                hideProcessingOverlay();
-
-                if (isError) {
-                    showError(status.error || status.message);
-                } else if (isCompleted) {
-                    updateAllStatusMessages('Abgeschlossen!');
-                    updateAllProgressBars(100, false, false, false);
-                    if (status.result_url) showResult(status.result_url);
-                    if (historyEnabled) fetchHistory();
-                    fetchStats();
-                } else {
-                     showError(status.error || status.message || "Auftrag beendet, aber Status unklar.");
-                }
-                resetSubmitButton();
-            } else if (isRunning || isQueued) { 
-                 if (dom.submitButton && !dom.submitButton.disabled) {
-                     dom.submitButton.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Verarbeite...';
-                     dom.submitButton.disabled = true;
-                 }
-            }
+            renderStatus(await response.json());
         } catch (error) {
             console.error('Polling-Fehler:', error);
             appendLog(`Polling fehlgeschlagen: ${error.message}`, 'error');
@@ -417,6 +465,56 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // newLogs == null: status.logs enthält alle Logs (Intervall-Polling), sonst nur neue Zeilen anhängen
+    function renderStatus(status, newLogs = null) {
+        if (dom.logContent) {
+            if (newLogs === null && Array.isArray(status.logs)) {
+                dom.logContent.textContent = status.logs.join('\n') + '\n';
+                if (dom.logOutput) dom.logOutput.scrollTop = dom.logOutput.scrollHeight;
+            } else if (newLogs && newLogs.length) {
+                dom.logContent.textContent += newLogs.join('\n') + '\n';
+                if (dom.logOutput) dom.logOutput.scrollTop = dom.logOutput.scrollHeight;
+            }
+        }
+
+        const isRunning = status.running === true;
+        const isQueued = status.status === 'queued';
+        const isCompleted = status.status === 'completed';
+        const isError = !!status.error || status.status === 'error';
+        const isNotFound = status.status === 'not_found';
+
+        // Status und Fortschritt an beide UI-Teile senden
+        updateAllProgressBars(status.progress || 0, isError, isRunning, isQueued);
+        if (isQueued && status.position !== undefined && status.total_queued !== undefined) {
+            updateAllStatusMessages(status.message || 'In Warteschlange...', status.position, status.total_queued);
+        } else {
+            updateAllStatusMessages(status.message || '...');
+        }
+
+        if (isCompleted || isError || isNotFound) {
+            stopPolling();
+            hideProcessingOverlay();
+
+            if (isError) {
+                showError(status.error || status.message);
+            } else if (isCompleted) {
+                updateAllStatusMessages('Abgeschlossen!');
+                updateAllProgressBars(100, false, false, false);
+                if (status.result_url) showResult(status.result_url);
+                if (historyEnabled) fetchHistory();
+                fetchStats();
+            } else {
+                 showError(status.error || status.message || "Auftrag beendet, aber Status unklar.");
+            }
+            resetSubmitButton();
+        } else if (isRunning || isQueued) {
+             if (dom.submitButton && !dom.submitButton.disabled) {
+                 dom.submitButton.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Verarbeite...';
+                 dom.submitButton.disabled = true;
+             }
+        }
+    }
+
     function resetSubmitButton() {
         if (dom.submitButton) {
              dom.submitButton.disabled = false;
@@ -424,24 +522,35 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // --- History (unverändert) ---
-    async function fetchHistory() {
+    // --- History (seitenweise, Server antwortet bei unveränderten Daten mit 304) ---
+    async function fetchHistory(append = false) {
         if (!dom.historyTableBody || !historyEnabled) return;
-        dom.historyTableBody.innerHTML = '<tr><td colspan="5" class="text-center text-muted"><i class="fas fa-spinner fa-spin"></i> Lade Verlauf...</td></tr>';
+        if (!append) dom.historyTableBody.innerHTML = '<tr><td colspan="5" class="text-center text-muted"><i class="fas fa-spinner fa-spin"></i> Lade Verlauf...</td></tr>';
+        if (dom.historyLoadMoreButton) dom.historyLoadMoreButton.disabled = true;
+        const params = new URLSearchParams();
+        if (append && historyNextCursor !== null) params.set('cursor', historyNextCursor);
+        if (dom.historyPlatformFilter && dom.historyPlatformFilter.value) params.set('platform', dom.historyPlatformFilter.value);
         try {
-            const response = await fetch('/history');
+            const response = await fetch(`/history?${params}`);
             if (!response.ok) throw new Error(`Serverfehler History: ${response.status}`);
-            const history = await response.json();
-            renderHistory(history);
+            const page = await response.json();
+            historyNextCursor = page.next_cursor;
+            renderHistory(page.entries, append);
         } catch (error) {
             console.error('Fehler Laden Verlauf:', error);
-            dom.historyTableBody.innerHTML = `<tr><td colspan="5" class="text-center text-danger">Fehler Laden Verlauf: ${error.message}</td></tr>`;
+            if (!append) dom.historyTableBody.innerHTML = `<tr><td colspan="5" class="text-center text-danger">Fehler Laden Verlauf: ${error.message}</td></tr>`;
+            else showError(`Fehler Laden Verlauf: ${error.message}`);
+        } finally {
+            if (dom.historyLoadMoreButton) {
+                dom.historyLoadMoreButton.disabled = false;
+                dom.historyLoadMoreButton.classList.toggle('d-none', historyNextCursor === null);
+            }
         }
     }
-    function renderHistory(historyData) {
+    function renderHistory(historyData, append = false) {
         if (!dom.historyTableBody || !historyEnabled) return;
-        dom.historyTableBody.innerHTML = '';
-        if (!historyData || !Array.isArray(historyData) || historyData.length === 0) {
+        if (!append) dom.historyTableBody.innerHTML = '';
+        if (!append && (!historyData || !Array.isArray(historyData) || historyData.length === 0)) {
             dom.historyTableBody.innerHTML = '<tr><td colspan="5" class="text-center text-muted">Keine Einträge im Verlauf.</td></tr>'; return;
         }
         historyData.forEach(entry => {